@@ -1,16 +1,171 @@
 # agents/automation_agent.py
+import ast
+import hashlib
 import os
 import json
+import logging
 import re
-from config_env import init_env
+import textwrap
+from typing import Any, Callable, Dict, List, Optional
+
+from .gherkin import GherkinError, compile_feature, default_registry, parse_feature, undefined_steps
+from .json_stream import parse_json_value
+from .playwright_conftest import write_conftest
+from .registry import per_thread
+from .step_snippets import bind_snippet, normalize_step, step_fingerprint
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MODES = ("module", "per_case", "steps")
+
+# Precedes every scenario block in generated .feature files
+_TC_MARKER = re.compile(r"^\s*#\s*tc:\s*(\S+)(?:\s+fp:\s*(\w+))?\s*$")
+
+_CFG = None
+
+
+def get_config() -> dict:
+    """Load .env via config_env.init_env on first use instead of at import time."""
+    global _CFG
+    if _CFG is None:
+        from config_env import init_env
+        _CFG = init_env()
+    return _CFG
+
+
+def case_function_name(tc_id: Any) -> str:
+    """test_<id lowercased, non-alphanumerics as _>, the name map_testcase_ids() looks for."""
+    slug = re.sub(r"[^a-z0-9]+", "_", str(tc_id).lower()).strip("_")
+    return f"test_{slug or 'case'}"
+
+
+def case_function_names(cases: List[dict]) -> List[str]:
+    """case_function_name() for each case, made unique within the suite."""
+    names: List[str] = []
+    for i, tc in enumerate(cases):
+        name = case_function_name(tc.get("id") or f"case_{i + 1:02d}")
+        while name in names:
+            name += "_x"
+        names.append(name)
+    return names
+
+
+def case_steps(tc: dict, keys=("steps", "expected")) -> List[str]:
+    """A test case's steps followed by its expected result(s), as one-line step texts."""
+    texts = []
+    for key in keys:
+        items = tc.get(key)
+        for item in items if isinstance(items, list) else [items]:
+            if isinstance(item, dict):
+                item = item.get("action") or item.get("step") or item.get("text") or item.get("expected")
+            if isinstance(item, str) and item.strip():
+                texts.append(re.sub(r"\s+", " ", item).strip())
+    return texts
+
+
+def testcase_fingerprint(tc: dict) -> str:
+    return hashlib.sha256(json.dumps(tc, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+
+
+def split_feature_blocks(text: str):
+    """
+    Split a generated .feature file into (header, [(tc_id, fp, block)]): each
+    block runs from its `# tc: <id> fp: <sha>` line up to the next one, with
+    trailing blank lines removed. A file without markers is all header.
+    """
+    lines = text.splitlines()
+    starts = [i for i, line in enumerate(lines) if _TC_MARKER.match(line)]
+    if not starts:
+        return text, []
+    header = "\n".join(lines[:starts[0]]).rstrip("\n") + "\n"
+    blocks = []
+    for a, b in zip(starts, starts[1:] + [len(lines)]):
+        m = _TC_MARKER.match(lines[a])
+        blocks.append((m.group(1), m.group(2), "\n".join(lines[a:b]).rstrip() + "\n"))
+    return header, blocks
+
+
+def check_python(code: str, filename: str = "<generated>") -> Optional[str]:
+    """None if code parses and compiles, else a short error message."""
+    try:
+        compile(ast.parse(code, filename), filename, "exec")
+    except SyntaxError as e:
+        return f"line {e.lineno}: {e.msg}"
+    except (ValueError, TypeError) as e:
+        return str(e)
+    return None
+
+
+def assemble_module(snippets: List[str]) -> str:
+    """
+    Join validated snippets into one module: imports are hoisted and
+    de-duplicated (__future__ imports first), other top-level statements
+    keep their original source (decorators included) and are dropped when
+    an identical one was already added.
+    """
+    future: List[str] = []
+    imports: List[str] = []
+    body: List[str] = []
+    seen = set()
+    for src in snippets:
+        lines = src.splitlines()
+        for node in ast.parse(src).body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                text = ast.unparse(node)
+                if text not in seen:
+                    seen.add(text)
+                    (future if getattr(node, "module", None) == "__future__" else imports).append(text)
+                continue
+            if isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str):
+                continue  # module docstrings of the snippets
+            start = min([d.lineno for d in getattr(node, "decorator_list", [])] + [node.lineno])
+            text = "\n".join(lines[start - 1:node.end_lineno])
+            if text not in seen:
+                seen.add(text)
+                body.append(text)
+    head = "\n".join(future + imports)
+    return (head + "\n\n\n" if head else "") + "\n\n\n".join(body) + "\n"
 
-CFG = init_env()
 
 class AutomationAgent:
-    def __init__(self, lm=None):
+    """
+    Turns generated test cases into pytest / Behave files.
+
+    synthesize_pytests() has three modes (AUTOMATION_MODE, default "module"):
+    "module" asks for the whole suite in one prompt; "per_case" asks for one
+    test function per test case, concurrently, checks each with ast.parse +
+    compile, retries only the ones that fail (AUTOMATION_CASE_RETRIES times)
+    and assembles the rest into one module. A case that still fails becomes
+    a skipped placeholder test instead of costing the whole suite. Module
+    output is checked the same way; if it does not compile, the suite is
+    rebuilt per case. "steps" builds every test from per-step snippets (see
+    below), so a project whose steps are all known needs no model call.
+
+    sync_gherkin_to_pytest() compiles .feature files locally through the
+    `steps` registry (agents.gherkin). In both it and "steps" mode the model
+    only writes code for steps that no definition matches and that have no
+    cached snippet, all of them in one request. Snippets are cached by
+    normalized step template (agents.step_snippets, quoted values and
+    numbers become arg0, arg1...) in `memory` (step_snippets, with usage
+    counts) or, without one, for the life of the agent.
+    """
+
+    # Reports of the calling thread's last call (the agent is shared across threads)
+    last_synthesis_report = per_thread(dict)
+    last_sync_report = per_thread(dict)
+    last_learn_report = per_thread(dict)
+    last_feature_report = per_thread(dict)
+
+    def __init__(self, lm=None, mode: Optional[str] = None, case_retries: Optional[int] = None, memory=None):
         from .llm_client import LMClient
         self.lm = lm or LMClient()
-        self.app_base = CFG.get("JIRA_BASE", "http://example.com")
+        self.memory = memory
+        self.steps = default_registry()
+        self._step_cache: Dict[str, str] = {}
+        self.app_base = get_config().get("JIRA_BASE", "http://example.com")
+        self.mode = mode or os.getenv("AUTOMATION_MODE", "module")
+        self.case_retries = case_retries if case_retries is not None else int(os.getenv("AUTOMATION_CASE_RETRIES", "2"))
 
     # ---------------------------------------------------------
     # Utility: Strip Markdown fences and clean Python code
@@ -32,10 +187,74 @@ class AutomationAgent:
 
         return cleaned.strip()
 
+    def _generate(self, prompt: str, max_output_tokens: int = 4096, on_chunk: Optional[Callable[[str], None]] = None) -> str:
+        """Call the LM, streaming raw chunks to on_chunk when given."""
+        if on_chunk is None:
+            return self.lm.generate(prompt, max_output_tokens=max_output_tokens)
+        parts = []
+        for chunk in self.lm.generate_stream(prompt, max_output_tokens=max_output_tokens):
+            parts.append(chunk)
+            on_chunk(chunk)
+        return "".join(parts)
+
     # ---------------------------------------------------------
     # Synthesize pytest tests
     # ---------------------------------------------------------
-    def synthesize_pytests(self, testcases_json: dict, out_path: str):
+    def synthesize_pytests(
+        self,
+        testcases_json: dict,
+        out_path: str,
+        on_chunk: Optional[Callable[[str], None]] = None,
+        mode: Optional[str] = None,
+    ):
+        mode = mode or self.mode
+        if mode not in MODES:
+            raise ValueError(f"unknown synthesis mode {mode!r}; expected one of {MODES}")
+
+        cases = [tc for tc in testcases_json.get("test_cases") or [] if isinstance(tc, dict)]
+        if mode == "per_case" and cases:
+            code = self._synthesize_per_case(testcases_json, cases, on_chunk)
+        elif mode == "steps" and cases:
+            code = self._synthesize_from_steps(cases, on_chunk)
+        else:
+            code = self._synthesize_module(testcases_json, on_chunk)
+            if code is not None and cases:
+                error = check_python(code, out_path)
+                if error:
+                    logger.warning("AutomationAgent: generated suite does not compile (%s); rebuilding per test case", error)
+                    code = self._synthesize_per_case(testcases_json, cases, None)
+                else:
+                    self.last_synthesis_report = {"mode": "module", "cases": len(cases), "failed": []}
+
+        # If LM produced garbage or empty output → fallback example test
+        if code is None or check_python(code, out_path):
+            code = """import pytest
+
+def test_login_flow(page, base_url):
+    page.goto(base_url)
+    assert True
+"""
+            self.last_synthesis_report = {"mode": mode, "cases": len(cases), "failed": [], "fallback": True}
+
+        # Ensure folder exists; shared browser/context fixtures live next to the suite
+        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        write_conftest(os.path.dirname(out_path), self.app_base)
+
+        # Write cleaned code
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(code)
+
+        return out_path
+
+    def _is_garbage(self, code: str) -> bool:
+        return (
+            not code
+            or code.strip().startswith("[genai_error]")
+            or "mock response" in code
+            or code.strip() == "[mock]"
+        )
+
+    def _synthesize_module(self, testcases_json: dict, on_chunk: Optional[Callable[[str], None]]) -> Optional[str]:
         prompt = f"""
 Convert these testcases into Python pytest code.
 
@@ -44,110 +263,393 @@ STRICT RULES:
 - NO markdown fences
 - NO backticks
 - One test function per testcase
+- Name each test function test_<testcase id in lowercase, non-alphanumerics as _> (e.g. test_feat_login_tc_01)
 - Use pytest only
+- For UI steps, take the `page` (Playwright sync Page in a fresh browser context) and `base_url` fixtures
+  as arguments, e.g. def test_x(page, base_url): page.goto(base_url)
+- NEVER call sync_playwright(), launch a browser or create contexts; conftest.py provides them
 - No comments outside functions
 
 Testcases:
 {json.dumps(testcases_json, indent=2)}
 """
-        raw_code = self.lm.generate(prompt, max_output_tokens=4096)
+        raw_code = self._generate(prompt, max_output_tokens=4096, on_chunk=on_chunk)
         code = self._clean_code(raw_code)
+        if self._is_garbage(code) or not code.startswith("def") and "test_" not in code:
+            return None
+        return code
 
-        # If LM produced garbage or empty output → fallback example test
-        if (
-            not code
-            or code.strip().startswith("[genai_error]")
-            or "mock response" in code
-            or code.strip() == "[mock]"
-            or not code.startswith("def") and "test_" not in code
-        ):
-            code = f"""import pytest
-from playwright.sync_api import sync_playwright
-
-def test_login_flow():
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        page = browser.new_page()
-        page.goto("{self.app_base}")
-        assert True
+    # ---------------------------------------------------------
+    # Per-test-case synthesis
+    # ---------------------------------------------------------
+    def _synthesize_per_case(self, testcases_json: dict, cases: List[dict], on_chunk: Optional[Callable[[str], None]]) -> str:
+        from .llm_client import run_sync
+
+        names = case_function_names(cases)
+        snippets, attempts, errors = run_sync(self._run_cases(testcases_json.get("feature_id"), cases, names, on_chunk))
+        failed = [i for i, code in enumerate(snippets) if code is None]
+        for i in failed:
+            logger.warning("AutomationAgent: giving up on %s after %d attempts: %s", names[i], attempts[i], errors[i])
+            snippets[i] = (
+                "import pytest\n\n\n"
+                f"@pytest.mark.skip(reason={('synthesis failed: ' + errors[i])[:200]!r})\n"
+                f"def {names[i]}():\n"
+                "    pass\n"
+            )
+        self.last_synthesis_report = {
+            "mode": "per_case",
+            "cases": len(cases),
+            "retried": [names[i] for i, n in enumerate(attempts) if n > 1],
+            "failed": [names[i] for i in failed],
+        }
+        return assemble_module(snippets)
+
+    async def _run_cases(self, feature_id, cases, names, on_chunk):
+        """Generate all cases concurrently; each retry round only re-asks the ones that failed."""
+        import asyncio
+
+        snippets: List[Optional[str]] = [None] * len(cases)
+        attempts = [0] * len(cases)
+        errors: Dict[int, str] = {}
+        todo = list(range(len(cases)))
+        for _ in range(1 + max(0, self.case_retries)):
+            outcomes = await asyncio.gather(*(
+                self._synthesize_case(feature_id, cases[i], names[i], errors.get(i)) for i in todo
+            ))
+            retry = []
+            for i, (code, error) in zip(todo, outcomes):
+                attempts[i] += 1
+                if error:
+                    errors[i] = error
+                    retry.append(i)
+                    continue
+                snippets[i] = code
+                if on_chunk:
+                    on_chunk(code.rstrip() + "\n\n\n")
+            todo = retry
+            if not todo:
+                break
+        return snippets, attempts, errors
+
+    async def _synthesize_case(self, feature_id, tc: dict, name: str, previous_error: Optional[str]):
+        """Returns (code, None) for a valid function named `name`, else (None, error)."""
+        retry_note = ""
+        if previous_error:
+            retry_note = f"\nYour previous answer was rejected ({previous_error}). Fix it.\n"
+        prompt = f"""
+Convert this testcase into ONE Python pytest test function.
+
+STRICT RULES:
+- Output ONLY valid python: the imports it needs followed by the function
+- NO markdown fences
+- NO backticks
+- Name the function exactly {name}
+- For UI steps, take the `page` (Playwright sync Page in a fresh browser context) and `base_url` fixtures
+  as arguments, e.g. def {name}(page, base_url): page.goto(base_url)
+- NEVER call sync_playwright(), launch a browser or create contexts; conftest.py provides them
+- No other top-level code
+{retry_note}
+Feature: {feature_id}
+Testcase:
+{json.dumps(tc, indent=2)}
 """
+        code = self._clean_code(await self.lm.agenerate(prompt, max_output_tokens=1024))
+        if self._is_garbage(code):
+            return None, "no code returned"
+        error = check_python(code, f"<{name}>")
+        if error:
+            return None, error
 
-        # Ensure folder exists
-        os.makedirs(os.path.dirname(out_path), exist_ok=True)
+        tests = [n.name for n in ast.parse(code).body
+                 if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef)) and n.name.startswith("test_")]
+        if name not in tests:
+            if len(tests) != 1:
+                return None, f"expected exactly one test function named {name}"
+            code = re.sub(rf"\bdef\s+{re.escape(tests[0])}\b", f"def {name}", code, count=1)
+        return code, None
 
-        # Write cleaned code
-        with open(out_path, "w", encoding="utf-8") as f:
-            f.write(code)
+    # ---------------------------------------------------------
+    # Step-snippet synthesis
+    # ---------------------------------------------------------
+    def _synthesize_from_steps(self, cases: List[dict], on_chunk: Optional[Callable[[str], None]]) -> str:
+        names = case_function_names(cases)
+        steps = [[{"keyword": "", "text": t, "doc": None, "table": None} for t in case_steps(tc)] for tc in cases]
+        code_of = {}
+        unknown = []
+        for st in (st for case in steps for st in case):
+            if st["text"] not in code_of:
+                code_of[st["text"]] = self.steps.compile_step(st)
+                if code_of[st["text"]] is None:
+                    unknown.append(st["text"])
+        learned = self.learn_steps(unknown)
 
-        return out_path
+        functions = []
+        for tc, name, case in zip(cases, names, steps):
+            title = str(tc.get("title") or tc.get("id") or name)
+            doc = f'"""{title}"""' if '"' not in title and "\\" not in title else repr(title)
+            lines = [f"def {name}(page, base_url):", f"    {doc}"]
+            for st in case:
+                body = code_of[st["text"]] or (learned[st["text"]].splitlines() if st["text"] in learned else None)
+                lines.append(f"    # {st['text']}")
+                lines += ["    " + line for line in body or [f"pytest.skip({'undefined step: ' + st['text']!r})"]]
+            if not case:
+                lines.append("    pytest.skip('test case has no steps')")
+            functions.append("\n".join(lines) + "\n")
+            if on_chunk:
+                on_chunk(functions[-1] + "\n\n")
+
+        self.last_synthesis_report = dict(self.last_learn_report, mode="steps", cases=len(cases), failed=[])
+        return assemble_module(["import pytest\n"] + functions)
 
     # ---------------------------------------------------------
     # Behave (.feature file) synthesis
     # ---------------------------------------------------------
-    def synthesize_behave_feature(self, testcases_json: dict, feature_path: str):
+    def synthesize_behave_feature(self, testcases_json: dict, feature_path: str, on_chunk: Optional[Callable[[str], None]] = None):
+        """
+        Write one scenario block per test case, each preceded by
+        `# tc: <id> fp: <sha of the test case>`. When the file already exists,
+        blocks whose test case is unchanged are kept byte for byte (as is the
+        Feature header); only added or changed test cases are sent to the
+        model, and a block the model gets wrong is built locally instead.
+        Blocks of removed test cases are dropped. Counts are in
+        last_feature_report.
+        """
+        cases = [tc for tc in testcases_json.get("test_cases") or [] if isinstance(tc, dict)]
+        if not cases:
+            return self._write_feature(feature_path, self._fallback_feature())
+
+        old_text = ""
+        if os.path.exists(feature_path):
+            with open(feature_path, "r", encoding="utf-8") as f:
+                old_text = f.read()
+        header, old_blocks = split_feature_blocks(old_text)
+        if not old_blocks:
+            title = testcases_json.get("title") or str(testcases_json.get("feature_id") or "Generated feature").replace("_", " ")
+            header = f"Feature: {title}\n"
+        old = {tc_id: (fp, block) for tc_id, fp, block in old_blocks}
+
+        keyed = []
+        for i, tc in enumerate(cases):
+            tc_id = re.sub(r"\s+", "_", str(tc.get("id") or f"case_{i + 1:02d}"))
+            keyed.append((tc_id, tc, testcase_fingerprint(tc)))
+        todo = [(tc_id, tc, fp) for tc_id, tc, fp in keyed if old.get(tc_id, (None,))[0] != fp]
+
+        generated = self._generate_scenarios([tc for _, tc, _ in todo], on_chunk) if todo else {}
+        blocks, fallback = [], 0
+        for tc_id, tc, fp in keyed:
+            if old.get(tc_id, (None,))[0] == fp:
+                blocks.append(old[tc_id][1])
+                continue
+            body = generated.get(tc_id)
+            if body is None:
+                body = self._local_scenario(tc)
+                fallback += 1
+            blocks.append(f"  # tc: {tc_id} fp: {fp}\n{body}")
+
+        self.last_feature_report = {
+            "kept": len(keyed) - len(todo),
+            "generated": len(todo) - fallback,
+            "fallback": fallback,
+            "removed": len(set(old) - {k for k, _, _ in keyed}),
+            "model_calls": 1 if todo else 0,
+        }
+        text = header + "\n" + "\n".join(blocks)
+        if text != old_text:
+            self._write_feature(feature_path, text)
+        return feature_path
+
+    def _write_feature(self, feature_path: str, text: str) -> str:
+        os.makedirs(os.path.dirname(feature_path), exist_ok=True)
+        with open(feature_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return feature_path
+
+    def _fallback_feature(self) -> str:
+        return (
+            "Feature: Login\n\n"
+            "  Scenario: Login with valid credentials\n"
+            "    Given I open the login page\n"
+            "    When I enter valid credentials\n"
+            "    And I click login\n"
+            "    Then I should see the dashboard\n\n"
+            "  Scenario: Login with invalid credentials\n"
+            "    Given I open the login page\n"
+            "    When I enter invalid credentials\n"
+            "    And I click login\n"
+            "    Then I should see an error message\n"
+        )
+
+    def _generate_scenarios(self, cases: List[dict], on_chunk: Optional[Callable[[str], None]]) -> Dict[str, str]:
+        """{tc id: scenario block (2-space indented)} for the blocks the model wrote that parse."""
         prompt = f"""
-Convert these testcases into a Behave (Gherkin) feature file.
+Convert these testcases into Behave (Gherkin) scenarios.
 
 STRICT RULES:
 - Output ONLY Gherkin text
 - No markdown; no code fences
-- Include multiple scenarios if needed
+- No Feature line
+- Before the scenario(s) of each testcase write a line: # tc: <testcase id>
+- Include multiple scenarios per testcase if needed
 
 Testcases JSON:
-{json.dumps(testcases_json, indent=2)}
+{json.dumps(cases, indent=2)}
 """
-        raw = self.lm.generate(prompt, max_output_tokens=2048)
-        gherkin = self._clean_code(raw)
-
-        if (
-            not gherkin
-            or gherkin.strip().startswith("[genai_error]")
-            or "mock response" in gherkin
-            or gherkin.strip() == "[mock]"
-        ):
-            gherkin = (
-                "Feature: Login\n\n"
-                "  Scenario: Login with valid credentials\n"
-                "    Given I open the login page\n"
-                "    When I enter valid credentials\n"
-                "    And I click login\n"
-                "    Then I should see the dashboard\n\n"
-                "  Scenario: Login with invalid credentials\n"
-                "    Given I open the login page\n"
-                "    When I enter invalid credentials\n"
-                "    And I click login\n"
-                "    Then I should see an error message\n"
-            )
+        raw = self._clean_code(self._generate(prompt, max_output_tokens=2048, on_chunk=on_chunk))
+        if self._is_garbage(raw):
+            return {}
 
-        os.makedirs(os.path.dirname(feature_path), exist_ok=True)
-        with open(feature_path, "w", encoding="utf-8") as f:
-            f.write(gherkin)
+        found: Dict[str, List[str]] = {}
+        current = None
+        for line in raw.splitlines():
+            m = _TC_MARKER.match(line)
+            if m:
+                current = found.setdefault(re.sub(r"\s+", "_", m.group(1)), [])
+            elif current is not None and not line.strip().startswith("Feature:"):
+                current.append(line)
 
-        return feature_path
+        blocks = {}
+        for tc_id, lines in found.items():
+            body = textwrap.indent(textwrap.dedent("\n".join(lines)).strip("\n"), "  ") + "\n"
+            try:
+                if not parse_feature("Feature: check\n" + body)["scenarios"]:
+                    continue
+            except GherkinError as e:
+                logger.warning("AutomationAgent: scenario for %s does not parse (%s)", tc_id, e)
+                continue
+            blocks[tc_id] = body
+        return blocks
+
+    def _local_scenario(self, tc: dict) -> str:
+        """Scenario built straight from the test case: preconditions, steps, expected results."""
+        title = re.sub(r"\s+", " ", str(tc.get("title") or tc.get("id") or "Test case")).strip()
+        lines = [f"  Scenario: {title}"]
+        for keyword, texts in (("Given", case_steps(tc, ("preconditions", "precondition"))),
+                               ("When", case_steps(tc, ("steps",)) or ["I perform the test case"]),
+                               ("Then", case_steps(tc, ("expected", "expected_result")))):
+            lines += [f"    {keyword if n == 0 else 'And'} {t}" for n, t in enumerate(texts)]
+        return "\n".join(lines) + "\n"
 
     def sync_gherkin_to_pytest(self, feature_file: str, out_py: str):
-        with open(feature_file, "r") as f:
-            gherkin = f.read()
+        with open(feature_file, "r", encoding="utf-8") as f:
+            feature = parse_feature(f.read())
 
-        prompt = f"""
-    Convert this Gherkin feature file into Python pytest test methods.
+        unknown = undefined_steps(feature, self.steps)
+        learned = self.learn_steps(unknown)
+        code = compile_feature(feature, self.steps, learned, source=os.path.basename(feature_file))
+        self.last_sync_report = {
+            "scenarios": len(feature["scenarios"]),
+            "undefined_steps": len(unknown),
+            "learned_steps": len(learned),
+        }
 
-    STRICT RULES:
-    - Output ONLY Python code
-    - One pytest test per Scenario
-    - Use Playwright sync API
-    - Do NOT change scenario titles
+        os.makedirs(os.path.dirname(out_py), exist_ok=True)
+        write_conftest(os.path.dirname(out_py), self.app_base)
+        with open(out_py, "w", encoding="utf-8") as f:
+            f.write(code)
 
-    Gherkin:
-    {gherkin}
-    """
+        return out_py
 
-        code = self.lm.generate(prompt)
+    # ---------------------------------------------------------
+    # Code for steps without a step definition
+    # ---------------------------------------------------------
+    def learn_steps(self, step_texts: List[str]) -> Dict[str, str]:
+        """
+        {step text: Python statements} for steps no definition matches. Steps
+        are grouped by normalized template; cached snippets are used first and
+        the remaining templates go to the model in one request. Snippets that
+        do not compile are dropped (their tests skip) and asked for again next
+        time. Counts are kept in last_learn_report.
+        """
+        shapes = {t: normalize_step(t) for t in step_texts}
+        fps = {t: step_fingerprint(t) for t in step_texts}
+        known = {fp: self._step_cache[fp] for fp in set(fps.values()) if fp in self._step_cache}
+        if self.memory is not None and len(known) < len(set(fps.values())):
+            try:
+                known.update(self.memory.get_step_snippets([fp for fp in fps.values() if fp not in known]))
+            except Exception:
+                logger.exception("AutomationAgent: could not read step snippets (non-fatal)")
+        self._step_cache.update(known)
+        cached = len(known)
 
-        clean = self._clean_code(code)
+        # One example step per unseen template
+        missing: List[str] = []
+        for text in step_texts:
+            if fps[text] not in known and all(fps[m] != fps[text] for m in missing):
+                missing.append(text)
+        fresh = []
+        if missing:
+            for text, code in self._generate_steps(missing, shapes).items():
+                fresh.append({"fingerprint": fps[text], "template": shapes[text][0], "step_text": text, "code": code})
+                known[fps[text]] = self._step_cache[fps[text]] = code
+            if fresh and self.memory is not None:
+                try:
+                    self.memory.save_step_snippets(fresh)
+                except Exception:
+                    logger.exception("AutomationAgent: could not save step snippets (non-fatal)")
+            logger.info("AutomationAgent: %d/%d new step templates learned", len(fresh), len(missing))
 
-        os.makedirs(os.path.dirname(out_py), exist_ok=True)
-        with open(out_py, "w", encoding="utf-8") as f:
-            f.write(clean)
+        result = {}
+        uses: Dict[str, int] = {}
+        for text, fp in fps.items():
+            if fp not in known:
+                continue
+            try:
+                result[text] = bind_snippet(known[fp], shapes[text][1])
+            except SyntaxError:
+                continue
+            uses[fp] = uses.get(fp, 0) + 1
+        if uses and self.memory is not None:
+            try:
+                self.memory.record_step_uses(uses)
+            except Exception:
+                logger.exception("AutomationAgent: could not record step uses (non-fatal)")
+
+        self.last_learn_report = {
+            "steps": len(step_texts),
+            "templates": len(set(fps.values())),
+            "cached": cached,
+            "generated": len(fresh),
+            "model_calls": 1 if missing else 0,
+            "undefined": len(step_texts) - len(result),
+        }
+        return result
+
+    def _generate_steps(self, step_texts: List[str], shapes: Dict[str, Any]) -> Dict[str, str]:
+        steps = [
+            {"step": t, "args": {f"arg{i}": v for i, v in enumerate(shapes[t][1])}}
+            for t in step_texts
+        ]
+        prompt = f"""
+Write Playwright (sync API) Python statements for each of these test steps.
+
+STRICT RULES:
+- Output ONLY a JSON object mapping every "step" text, exactly as given, to a string of Python statements
+- NO markdown fences
+- The statements run inside a pytest test where `page` (Playwright sync Page) and `base_url` exist;
+  steps that have a doc string or data table can also use `doc` (str) and `table` (list of row lists)
+- Use the variables named in "args" (arg0, arg1, ...) instead of writing those values literally,
+  so the code can be reused for the same step with other values
+- No imports, no function definitions, no browser launching
+
+Steps:
+{json.dumps(steps, indent=2, ensure_ascii=False)}
+"""
+        raw = self._clean_code(self.lm.generate(prompt, max_output_tokens=2048))
+        mapping = parse_json_value(raw)
+        if not isinstance(mapping, dict):
+            mapping = {}
 
-        return out_py
\ No newline at end of file
+        result = {}
+        for text in step_texts:
+            code = mapping.get(text)
+            if not isinstance(code, str) or not code.strip():
+                continue
+            code = code.strip()
+            body = "\n".join("    " + line for line in code.splitlines())
+            params = "".join(f", arg{i}=None" for i in range(len(shapes[text][1])))
+            error = check_python(f"def _step(page, base_url, doc=None, table=None{params}):\n{body}\n")
+            if error:
+                logger.warning("AutomationAgent: code for step %r does not compile (%s)", text, error)
+                continue
+            result[text] = code
+        return result
@@ -1,21 +1,46 @@
 # agents/conversation_agent.py
 import json
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 class ConversationAgent:
+    """
+    Chat history backed by PersistentMemory's append-only turn log.
 
-    def __init__(self, mem, conv_id="default"):
+    Each message is persisted as one row, so adding a message costs the
+    same regardless of conversation length. history_limit loads only the
+    most recent turns; load_older() pages further back.
+    """
+
+    def __init__(self, mem, conv_id="default", history_limit: Optional[int] = None):
         self.mem = mem
         self.conv_id = conv_id
-        self.history = mem.load_conversation(conv_id) or []
+        self.history = (mem.load_conversation(conv_id, limit=history_limit) if mem else []) or []
+        self.has_older = bool(
+            mem and history_limit is not None and self.history
+            and mem.count_turns(conv_id) > len(self.history)
+        )
+
+    def _append(self, role: str, text: str):
+        turn = {"role": role, "text": text}
+        if self.mem:
+            turn["seq"] = self.mem.append_turn(self.conv_id, role, text)
+        self.history.append(turn)
 
     def add_user_msg(self, text):
-        self.history.append({"role": "user", "text": text})
-        self.mem.save_conversation(self.conv_id, self.history)
+        self._append("user", text)
 
     def add_agent_msg(self, text):
-        self.history.append({"role": "agent", "text": text})
-        self.mem.save_conversation(self.conv_id, self.history)
+        self._append("agent", text)
+
+    def load_older(self, n: int = 50) -> List[Dict[str, Any]]:
+        """Prepend up to n earlier turns to history and return them."""
+        if not self.mem or not self.has_older:
+            return []
+        first_seq = self.history[0].get("seq") if self.history else None
+        older = self.mem.load_conversation(self.conv_id, limit=n, before_seq=first_seq)
+        self.history = older + self.history
+        self.has_older = bool(older) and older[0].get("seq", 1) > 1
+        return older
 
     def get_context(self) -> str:
         """Convert history to a prompt-friendly text block."""
@@ -33,9 +58,16 @@ class ConversationAgent:
         return json.dumps(self.history, indent=2)
 
     def save(self):
-        if self.mem:
+        """
+        Rewrite the stored log to match history. Turns are already persisted
+        as they are added, so this is only needed after editing history by
+        hand, and is skipped while older turns are not loaded.
+        """
+        if self.mem and not self.has_older:
             self.mem.save_conversation(self.conv_id, self.history)
 
     def reset(self):
         self.history = []
-        self.save()
\ No newline at end of file
+        self.has_older = False
+        if self.mem:
+            self.mem.clear_conversation(self.conv_id)
@@ -1,9 +1,352 @@
-
+import heapq
+import importlib.util
+import json
+import logging
+import os
+import re
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
+import uuid
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from .registry import per_thread
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Used for tests with no recorded duration yet
+DEFAULT_TEST_SECONDS = 5.0
+
+
+def junit_key(nodeid: str) -> str:
+    """Map a pytest node id to the classname::name form used in JUnit XML."""
+    path, _, rest = nodeid.partition("::")
+    parts = rest.split("::") if rest else []
+    module = path[:-3] if path.endswith(".py") else path
+    module = module.replace("\\", "/").strip("/").replace("/", ".")
+    classname = ".".join([module] + parts[:-1])
+    return f"{classname}::{parts[-1] if parts else ''}"
+
+
 class ExecutionAgent:
-    def run_pytest(self, path):
+    """
+    Runs generated pytest suites.
+
+    run() returns a structured report with per-test results parsed from
+    JUnit XML; when a PersistentMemory is given they are stored in its
+    test_results table (which also supplies historical durations), otherwise
+    only durations are kept in a JSON file. run_pytest() keeps the
+    (returncode, stdout, stderr) contract. With
+    shards > 1 the collected tests are split over that many pytest
+    subprocesses, balanced by recorded durations (longest first onto the
+    least loaded shard), each writing JUnit XML; the shard results are then
+    merged into one report, available as last_report.
+
+    Timeouts: shard_timeout bounds each subprocess, and every test of a
+    killed shard is reported as an error; test_timeout is passed to
+    pytest-timeout when that plugin is installed.
+
+    Shards write into a temporary directory that is removed after parsing;
+    the (merged) JUnit file is kept as <results_dir>/<run_id>.xml, of which
+    only the newest keep_results are retained.
+    """
+
+    PYTEST = ["pytest"]
+
+    # Report of the calling thread's last run() (the agent is shared across threads)
+    last_report = per_thread(dict)
+
+    def __init__(
+        self,
+        shards: Optional[int] = None,
+        test_timeout: Optional[float] = None,
+        shard_timeout: Optional[float] = None,
+        durations_path: Optional[str] = None,
+        memory=None,
+        results_dir: Optional[str] = None,
+        keep_results: Optional[int] = None,
+    ):
+        self.shards = shards if shards is not None else int(os.getenv("PYTEST_SHARDS", "1"))
+        self.test_timeout = test_timeout if test_timeout is not None else float(os.getenv("PYTEST_TEST_TIMEOUT", "300"))
+        self.shard_timeout = shard_timeout if shard_timeout is not None else float(os.getenv("PYTEST_SHARD_TIMEOUT", "1800"))
+        self.durations_path = durations_path or os.getenv("TEST_DURATIONS_PATH", "test_durations.json")
+        self.memory = memory
+        self.results_dir = results_dir or os.getenv("PYTEST_RESULTS_DIR", "test_results")
+        self.keep_results = keep_results if keep_results is not None else int(os.getenv("PYTEST_KEEP_RESULTS", "20"))
+        self.has_timeout_plugin = importlib.util.find_spec("pytest_timeout") is not None
+        self._lock = threading.Lock()
+
+    def _pytest_cmd(self, *args: str) -> List[str]:
+        cmd = self.PYTEST + ["-q"]
+        if self.has_timeout_plugin and self.test_timeout:
+            cmd.append(f"--timeout={int(self.test_timeout)}")
+        return cmd + list(args)
+
+    def run_pytest(self, path, shards: Optional[int] = None) -> Tuple[int, str, str]:
+        report = self.run(path, shards=shards)
+        return report["returncode"], report["stdout"], report["stderr"]
+
+    # ---------------------------------------------------------
+    # SHARDING
+    # ---------------------------------------------------------
+    def collect(self, path) -> List[str]:
+        """Node ids pytest would run for path (empty if collection fails)."""
         try:
-            p = subprocess.run(["pytest","-q",path],capture_output=True,text=True)
-            return p.returncode, p.stdout, p.stderr
+            p = subprocess.run(self.PYTEST + ["--collect-only", "-q", str(path)],
+                               capture_output=True, text=True, timeout=300)
         except Exception as e:
-            return 1, "", str(e)
+            logger.warning("ExecutionAgent: collection failed: %s", e)
+            return []
+        if p.returncode not in (0, 5):
+            logger.warning("ExecutionAgent: collection exited %s", p.returncode)
+            return []
+        return [line.strip() for line in p.stdout.splitlines() if "::" in line and not line.startswith(" ")]
+
+    def load_durations(self) -> Dict[str, float]:
+        """Recorded seconds per test key, from the results store or the JSON file."""
+        if self.memory is not None:
+            try:
+                return self.memory.test_durations()
+            except Exception:
+                logger.exception("ExecutionAgent: could not read durations (non-fatal)")
+                return {}
+        try:
+            with open(self.durations_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def record_results(self, run_id: str, feature_id: Optional[str], cases: List[Dict[str, Any]]):
+        """Persist per-test results (results store) or just their durations (JSON file)."""
+        if not cases:
+            return
+        if self.memory is not None:
+            try:
+                self.memory.save_test_results(run_id, feature_id, cases)
+            except Exception:
+                logger.exception("ExecutionAgent: could not save results (non-fatal)")
+            return
+        with self._lock:
+            durations = self.load_durations()
+            durations.update({c["key"]: c["duration"] for c in cases if c["outcome"] != "skipped"})
+            try:
+                with open(self.durations_path, "w", encoding="utf-8") as f:
+                    json.dump(durations, f, indent=1, sort_keys=True)
+            except OSError:
+                logger.exception("ExecutionAgent: could not save durations (non-fatal)")
+
+    @staticmethod
+    def plan_shards(nodeids: List[str], n: int, durations: Dict[str, float]) -> List[List[str]]:
+        """Longest-processing-time-first: each test goes to the currently lightest shard."""
+        known = sorted(durations.values())
+        default = known[len(known) // 2] if known else DEFAULT_TEST_SECONDS
+        weighted = sorted(((durations.get(junit_key(t), default), t) for t in nodeids), key=lambda x: (-x[0], x[1]))
+        heap = [(0.0, i) for i in range(max(1, n))]
+        shards: List[List[str]] = [[] for _ in heap]
+        for seconds, test in weighted:
+            load, i = heapq.heappop(heap)
+            shards[i].append(test)
+            heapq.heappush(heap, (load + seconds, i))
+        # Keep each shard in collection order so module/fixture setup is shared
+        order = {t: k for k, t in enumerate(nodeids)}
+        return [sorted(s, key=order.get) for s in shards if s]
+
+    def run(
+        self,
+        path,
+        shards: Optional[int] = None,
+        feature_id: Optional[str] = None,
+        test_cases: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Run the tests under path and return a structured report: returncode,
+        stdout, stderr, per-test "cases" (key, outcome, duration, message and
+        testcase_id when test_cases are given), outcome totals, the JUnit
+        path and per-shard details. With shards > 1 and at least two tests
+        collected, the tests are split over that many subprocesses.
+        """
+        shards = self.shards if shards is None else shards
+        started = time.perf_counter()
+        run_id = f"{time.strftime('%Y%m%dT%H%M%S')}_{uuid.uuid4().hex[:6]}"
+        workdir = tempfile.mkdtemp(prefix="pytest_run_")
+
+        plan = [[str(path)]]
+        if shards and shards > 1:
+            nodeids = self.collect(path)
+            if len(nodeids) >= 2:
+                plan = self.plan_shards(nodeids, shards, self.load_durations())
+                logger.info("ExecutionAgent: %d tests over %d shards", len(nodeids), len(plan))
+        sharded = len(plan) > 1
+
+        def _run(index: int, tests: List[str]) -> Dict[str, Any]:
+            junit = os.path.join(workdir, f"shard_{index}.xml")
+            t0 = time.perf_counter()
+            shard = {"index": index, "tests": len(tests), "junit": junit, "timed_out": False}
+            extra = ["-p", "no:cacheprovider"] if sharded else []
+            try:
+                p = subprocess.run(self._pytest_cmd(f"--junitxml={junit}", *extra, *tests),
+                                   capture_output=True, text=True, timeout=self.shard_timeout or None)
+                shard.update(returncode=p.returncode, stdout=p.stdout, stderr=p.stderr)
+            except subprocess.TimeoutExpired as e:
+                message = f"pytest exceeded {self.shard_timeout:.0f}s"
+                shard.update(returncode=1, stdout=_text(e.stdout), timed_out=True,
+                             stderr=_text(e.stderr) + f"\n[timeout] {message}")
+                # pytest writes its JUnit XML only at the end of the session, so
+                # the killed shard's tests are reported as errors instead
+                nodeids = tests if sharded else self.collect(path) or tests
+                write_error_junit(junit, nodeids, message, time.perf_counter() - t0)
+            except Exception as e:
+                shard.update(returncode=1, stdout="", stderr=str(e))
+            shard["duration_s"] = round(time.perf_counter() - t0, 2)
+            return shard
+
+        if sharded:
+            with ThreadPoolExecutor(max_workers=len(plan), thread_name_prefix="shard") as pool:
+                results = list(pool.map(lambda a: _run(*a), enumerate(plan)))
+        else:
+            results = [_run(0, plan[0])]
+
+        cases = []
+        for shard in results:
+            shard["cases"] = parse_junit(shard["junit"])
+            cases.extend(shard["cases"])
+        if test_cases:
+            map_testcase_ids(cases, test_cases)
+        self.record_results(run_id, feature_id, cases)
+
+        totals: Dict[str, int] = {}
+        for c in cases:
+            totals[c["outcome"]] = totals.get(c["outcome"], 0) + 1
+
+        if sharded:
+            merged = os.path.join(workdir, "merged.xml")
+            merge_junit([s["junit"] for s in results], merged)
+            stdout = "\n".join(
+                f"===== shard {s['index'] + 1}/{len(results)}: {s['tests']} tests, exit={s['returncode']}, "
+                f"{s['duration_s']}s{' (TIMED OUT)' if s['timed_out'] else ''} =====\n{s['stdout']}"
+                for s in results
+            )
+            stdout += "\n===== merged: " + ", ".join(f"{v} {k}" for k, v in sorted(totals.items())) + " ====="
+        else:
+            merged = results[0]["junit"]
+            stdout = results[0]["stdout"]
+        junit = self._keep_junit(merged, run_id)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+        failing = [s["returncode"] for s in results if s["returncode"] != 0]
+        self.last_report = {
+            "run_id": run_id,
+            "feature_id": feature_id,
+            "returncode": failing[0] if failing else 0,
+            "stdout": stdout,
+            "stderr": "\n".join(s["stderr"] for s in results if s["stderr"]),
+            "shards": [{k: v for k, v in s.items() if k not in ("stdout", "stderr", "cases", "junit")} for s in results],
+            "tests": totals,
+            "cases": cases,
+            "junit": junit,
+            "duration_s": round(time.perf_counter() - started, 2),
+        }
+        return self.last_report
+
+
+    def _keep_junit(self, path: str, run_id: str) -> Optional[str]:
+        """Copy a run's JUnit file into results_dir and prune old ones; returns the kept path."""
+        if not os.path.exists(path):
+            return None
+        try:
+            os.makedirs(self.results_dir, exist_ok=True)
+            kept = os.path.join(self.results_dir, f"{run_id}.xml")
+            shutil.copyfile(path, kept)
+            old = sorted((e for e in os.scandir(self.results_dir) if e.name.endswith(".xml")),
+                         key=lambda e: e.stat().st_mtime, reverse=True)
+            for entry in old[max(1, self.keep_results):]:
+                os.remove(entry.path)
+            return kept
+        except OSError:
+            logger.exception("ExecutionAgent: could not keep JUnit results (non-fatal)")
+            return None
+
+
+def _text(value) -> str:
+    if value is None:
+        return ""
+    return value.decode("utf-8", "replace") if isinstance(value, bytes) else value
+
+
+def parse_junit(path: str) -> List[Dict[str, Any]]:
+    """Per-test records from a JUnit XML file: key, classname, name, outcome, duration, message."""
+    try:
+        root = ET.parse(path).getroot()
+    except (OSError, ET.ParseError):
+        return []
+    records = []
+    for tc in root.iter("testcase"):
+        outcome, message = "passed", None
+        for tag in ("failure", "error", "skipped"):
+            el = tc.find(tag)
+            if el is not None:
+                outcome = {"failure": "failed", "error": "error", "skipped": "skipped"}[tag]
+                message = el.get("message") or (el.text or "").strip()[:2000] or None
+                break
+        classname, name = tc.get("classname", ""), tc.get("name", "")
+        records.append({
+            "key": f"{classname}::{name}",
+            "classname": classname,
+            "name": name,
+            "outcome": outcome,
+            "duration": float(tc.get("time") or 0.0),
+            "message": message,
+        })
+    return records
+
+
+def map_testcase_ids(cases: List[Dict[str, Any]], test_cases: List[Dict[str, Any]]):
+    """
+    Set case["testcase_id"] from the generated test cases: a test maps to the
+    test case whose id (lowercased, non-alphanumerics as "_") appears in its
+    function name as whole "_"-separated tokens (so TC_01 never matches
+    test_tc_010); the longest match wins.
+    """
+    slugs = sorted(
+        ((re.sub(r"[^a-z0-9]+", "_", str(tc["id"]).lower()).strip("_"), tc["id"])
+         for tc in test_cases if isinstance(tc, dict) and tc.get("id")),
+        key=lambda x: -len(x[0]),
+    )
+    for case in cases:
+        name = case.get("name", "").split("[")[0].lower()
+        case["testcase_id"] = next(
+            (tc_id for slug, tc_id in slugs if slug and re.search(rf"(^|_){re.escape(slug)}($|_)", name)), None
+        )
+
+
+def write_error_junit(path: str, nodeids: List[str], message: str, seconds: float = 0.0):
+    """
+    Write a JUnit file with an <error> testcase per node id, for runs that
+    produced no report of their own. The elapsed seconds are split evenly so
+    the recorded durations keep these tests heavy when planning shards.
+    """
+    suite = ET.Element("testsuite", name="pytest", tests=str(len(nodeids)), errors=str(len(nodeids)))
+    per_test = f"{seconds / len(nodeids):.3f}" if nodeids else "0"
+    for nodeid in nodeids:
+        classname, _, name = junit_key(nodeid).partition("::")
+        tc = ET.SubElement(suite, "testcase", classname=classname, name=name, time=per_test)
+        ET.SubElement(tc, "error", message=message)
+    ET.ElementTree(suite).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def merge_junit(paths: List[str], out_path: str):
+    """Combine the <testsuite> elements of several JUnit files into one <testsuites> document."""
+    merged = ET.Element("testsuites")
+    for path in paths:
+        try:
+            root = ET.parse(path).getroot()
+        except (OSError, ET.ParseError):
+            continue
+        suites = [root] if root.tag == "testsuite" else list(root.iter("testsuite"))
+        merged.extend(suites)
+    ET.ElementTree(merged).write(out_path, encoding="utf-8", xml_declaration=True)
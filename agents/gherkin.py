@@ -0,0 +1,436 @@
+# agents/gherkin.py
+import re
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+STEP_KEYWORDS = ("Given", "When", "Then", "And", "But", "*")
+
+_STEP = re.compile(r"^(Given|When|Then|And|But|\*)\s+(.*)$")
+_SECTION = re.compile(
+    r"^(Feature|Rule|Background|Scenario Outline|Scenario Template|Scenario|Example|Examples|Scenarios)\s*:\s*(.*)$"
+)
+
+
+class GherkinError(ValueError):
+    """Malformed .feature text; the message starts with the line number."""
+
+
+# ---------------------------------------------------------
+# PARSER
+# ---------------------------------------------------------
+def _cells(line: str) -> List[str]:
+    """Cells of a `| a | b |` row; `\\|` is a literal pipe."""
+    body = line.strip()[1:]
+    if body.endswith("|"):
+        body = body[:-1]
+    cells = re.split(r"(?<!\\)\|", body)
+    return [c.strip().replace("\\|", "|").replace("\\n", "\n") for c in cells]
+
+
+def parse_feature(text: str) -> Dict[str, Any]:
+    """
+    Parse Gherkin into a plain dict:
+
+        {"name", "tags", "description", "background": [step],
+         "scenarios": [{"name", "tags", "outline", "rule", "background",
+                        "steps": [step], "examples": [{"name", "tags", "header", "rows"}], "line"}]}
+
+    A step is {"keyword", "type", "text", "doc", "table", "line"}; "type" is
+    Given/When/Then with And/But/* resolved to the previous step's type.
+    Scenarios inside a Rule carry that rule's name and its Background steps.
+    Raises GherkinError on structural problems.
+    """
+    feature: Dict[str, Any] = {"name": None, "tags": [], "description": "", "background": [], "scenarios": []}
+    tags: List[str] = []
+    container: Optional[Dict[str, Any]] = None   # feature, background holder, scenario or examples block
+    steps: Optional[List[Dict[str, Any]]] = None
+    rule_background: List[Dict[str, Any]] = []
+    rule: Optional[str] = None
+    last_type = "Given"
+    lines = (text or "").splitlines()
+    i = 0
+
+    def _fail(msg: str):
+        raise GherkinError(f"line {i + 1}: {msg}")
+
+    while i < len(lines):
+        raw = lines[i]
+        line = raw.strip()
+
+        if line.startswith('"""') or line.startswith("```"):
+            fence = line[:3]
+            if not steps:
+                _fail("doc string without a step")
+            indent = len(raw) - len(raw.lstrip())
+            body = []
+            start = i
+            i += 1
+            while i < len(lines) and lines[i].strip() != fence:
+                body.append(lines[i][indent:] if lines[i][:indent].strip() == "" else lines[i].lstrip())
+                i += 1
+            if i >= len(lines):
+                i = start
+                _fail("unterminated doc string")
+            steps[-1]["doc"] = "\n".join(body).replace('\\"\\"\\"', '"""')
+            i += 1
+            continue
+
+        i += 1
+        if not line or line.startswith("#"):
+            continue
+
+        if line.startswith("@"):
+            tags.extend(t.lstrip("@") for t in line.split("#")[0].split() if t.startswith("@"))
+            continue
+
+        if line.startswith("|"):
+            row = _cells(line)
+            if container is not None and container.get("kind") == "examples":
+                if container["header"] is None:
+                    container["header"] = row
+                elif len(row) != len(container["header"]):
+                    i -= 1
+                    _fail("examples row has a different number of cells than its header")
+                else:
+                    container["rows"].append(row)
+            elif steps:
+                steps[-1]["table"] = (steps[-1]["table"] or []) + [row]
+            else:
+                i -= 1
+                _fail("table without a step")
+            continue
+
+        m = _SECTION.match(line)
+        if m:
+            keyword, name = m.group(1), m.group(2).strip()
+            if keyword == "Feature":
+                if feature["name"] is not None:
+                    i -= 1
+                    _fail("second Feature in one file")
+                feature.update(name=name, tags=tags)
+                container, steps = feature, None
+            elif feature["name"] is None:
+                i -= 1
+                _fail(f"{keyword} before Feature")
+            elif keyword == "Rule":
+                rule, rule_background = name, []
+                container, steps = {"kind": "rule"}, None
+            elif keyword == "Background":
+                steps = rule_background if rule else feature["background"]
+                container = {"kind": "background"}
+            elif keyword in ("Examples", "Scenarios"):
+                scenario = feature["scenarios"][-1] if feature["scenarios"] else None
+                if scenario is None or not scenario["outline"]:
+                    i -= 1
+                    _fail("Examples outside a Scenario Outline")
+                container = {"kind": "examples", "name": name, "tags": tags, "header": None, "rows": []}
+                scenario["examples"].append(container)
+                steps = None
+            else:
+                scenario = {
+                    "kind": "scenario",
+                    "name": name,
+                    "tags": feature["tags"] + tags,
+                    "outline": keyword in ("Scenario Outline", "Scenario Template"),
+                    "rule": rule,
+                    "background": list(rule_background),
+                    "steps": [],
+                    "examples": [],
+                    "line": i,
+                }
+                feature["scenarios"].append(scenario)
+                container, steps = scenario, scenario["steps"]
+            tags = []
+            last_type = "Given"
+            continue
+
+        m = _STEP.match(line)
+        if m:
+            if steps is None:
+                i -= 1
+                _fail("step outside a Scenario or Background")
+            keyword, step_text = m.group(1), m.group(2).strip()
+            if keyword in ("Given", "When", "Then"):
+                last_type = keyword
+            steps.append({"keyword": keyword, "type": last_type, "text": step_text, "doc": None, "table": None, "line": i})
+            continue
+
+        # Free text: a description, kept only for the feature itself
+        if container is feature and not feature["scenarios"]:
+            feature["description"] = (feature["description"] + "\n" + line).strip()
+
+    if feature["name"] is None:
+        raise GherkinError("line 1: no Feature found")
+    for scenario in feature["scenarios"]:
+        if scenario["outline"] and not any(ex["rows"] for ex in scenario["examples"]):
+            raise GherkinError(f"line {scenario['line']}: Scenario Outline {scenario['name']!r} has no Examples rows")
+    return feature
+
+
+def _fill(value: Any, row: Dict[str, str]) -> Any:
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return [_fill(v, row) for v in value]
+    return re.sub(r"<([^<>]+)>", lambda m: row.get(m.group(1), m.group(0)), value)
+
+
+def expand_scenarios(feature: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Concrete scenarios: outlines become one scenario per Examples row with
+    <placeholders> filled in. Each gets "steps" = feature Background + rule
+    Background + its own steps, and "example" = (examples name, row number) or None.
+    """
+    out = []
+    for sc in feature["scenarios"]:
+        base = feature["background"] + sc["background"]
+        if not sc["outline"]:
+            out.append(dict(sc, steps=base + sc["steps"], example=None))
+            continue
+        n = 0
+        for ex in sc["examples"]:
+            for cells in ex["rows"]:
+                n += 1
+                row = dict(zip(ex["header"], cells))
+                steps = [dict(st, text=_fill(st["text"], row), doc=_fill(st["doc"], row), table=_fill(st["table"], row))
+                         for st in sc["steps"]]
+                out.append(dict(sc, name=_fill(sc["name"], row), tags=sc["tags"] + ex["tags"],
+                                steps=base + steps, example=(ex["name"], n)))
+    return out
+
+
+# ---------------------------------------------------------
+# STEP DEFINITIONS
+# ---------------------------------------------------------
+StepFn = Callable[..., Any]
+
+
+class StepRegistry:
+    """
+    Ordered list of (regex, fn) step definitions. A step's text (without its
+    keyword) is matched with re.fullmatch, case-insensitively; the first
+    match wins and fn(step, *groups) returns the Python statements for it
+    (a string or list of lines) using the test's `page` and `base_url`.
+    """
+
+    def __init__(self, defaults: bool = True):
+        self._steps: List[Tuple[re.Pattern, StepFn]] = []
+        if defaults:
+            for pattern, fn in _DEFAULT_STEPS:
+                self.register(pattern, fn)
+
+    def register(self, pattern: str, fn: Optional[StepFn] = None):
+        """register(pattern, fn), or use as a decorator: @registry.register(pattern)."""
+        if fn is None:
+            return lambda f: self.register(pattern, f) or f
+        self._steps.append((re.compile(pattern, re.IGNORECASE), fn))
+
+    def compile_step(self, step: Dict[str, Any]) -> Optional[List[str]]:
+        """Code lines for a step, or None when no definition matches."""
+        for pattern, fn in self._steps:
+            m = pattern.fullmatch(step["text"].strip())
+            if m:
+                code = fn(step, *m.groups())
+                return code.splitlines() if isinstance(code, str) else list(code)
+        return None
+
+
+_DEFAULT_STEPS: List[Tuple[str, StepFn]] = []
+
+
+def _default(pattern: str):
+    def deco(fn):
+        _DEFAULT_STEPS.append((pattern, fn))
+        return fn
+    return deco
+
+
+_Q = r'"([^"]*)"'
+
+
+@_default(r"I (?:open|visit|navigate to|go to|am on) (?:the )?" + _Q + r"(?: page)?")
+def _goto(step, target):
+    if re.match(r"https?://", target):
+        return f"page.goto({target!r})"
+    if target.startswith("/"):
+        return f"page.goto(base_url.rstrip('/') + {target!r})"
+    return "page.goto(base_url)"
+
+
+@_default(r"I (?:open|visit|launch|navigate to|go to|am on) (?:the )?(?:app|application|site|website|home ?page|[\w -]+ page)")
+def _goto_base(step):
+    return "page.goto(base_url)"
+
+
+@_default(r"I (?:enter|type|fill in|fill|input) " + _Q + r" (?:in|into|as|for) (?:the )?" + _Q + r"(?: field| input| box)?")
+def _fill_value(step, value, field):
+    return f"page.get_by_label({field!r}).fill({value!r})"
+
+
+@_default(r"I (?:fill in|fill|set) (?:the )?" + _Q + r"(?: field)? (?:with|to) " + _Q)
+def _fill_field(step, field, value):
+    return f"page.get_by_label({field!r}).fill({value!r})"
+
+
+@_default(r"I (?:fill in|fill) (?:the )?(?:form|fields)(?: with)?(?: the following)?:?")
+def _fill_table(step):
+    rows = step.get("table") or []
+    if rows and [c.lower() for c in rows[0]] in (["field", "value"], ["label", "value"]):
+        rows = rows[1:]
+    return [f"page.get_by_label({r[0]!r}).fill({r[1]!r})" for r in rows if len(r) >= 2] or ["pass"]
+
+
+@_default(r"I (?:enter|type|paste) the following (?:text )?(?:in|into) (?:the )?" + _Q + r"(?: field)?:?")
+def _fill_doc(step, field):
+    return f"page.get_by_label({field!r}).fill({step.get('doc') or ''!r})"
+
+
+@_default(r"I press (?:the )?" + _Q + r"(?: key)?")
+def _press(step, key):
+    return f"page.keyboard.press({key!r})"
+
+
+@_default(r"I (?:click|tap|press)(?: on)? (?:the )?" + _Q + r" (button|link|tab|checkbox|menuitem)")
+def _click_role(step, name, role):
+    return f"page.get_by_role({role.lower()!r}, name={name!r}).click()"
+
+
+@_default(r"I (?:click|tap)(?: on)? (?:the )?" + _Q)
+def _click_text(step, name):
+    return f"page.get_by_text({name!r}).first.click()"
+
+
+@_default(r"I (check|uncheck|tick|untick) (?:the )?" + _Q + r"(?: checkbox| box| option)?")
+def _check(step, action, label):
+    method = "uncheck" if action.lower() in ("uncheck", "untick") else "check"
+    return f"page.get_by_label({label!r}).{method}()"
+
+
+@_default(r"I select " + _Q + r" (?:from|in) (?:the )?" + _Q + r"(?: dropdown| list| select| field)?")
+def _select(step, value, field):
+    return f"page.get_by_label({field!r}).select_option({value!r})"
+
+
+@_default(r"I should not see " + _Q)
+def _not_see(step, text):
+    return f"page.get_by_text({text!r}).first.wait_for(state='hidden')"
+
+
+@_default(r"(?:I should see|I see) " + _Q + r"|" + _Q + r" (?:should be|is) (?:visible|displayed|shown)")
+def _see(step, text, alt=None):
+    return f"page.get_by_text({text if text is not None else alt!r}).first.wait_for(state='visible')"
+
+
+@_default(r"the (?:page )?url should (?:contain|include) " + _Q)
+def _url_contains(step, part):
+    return f"page.wait_for_url(lambda url: {part!r} in url)"
+
+
+@_default(r"the (?:page )?title should (?:be|equal) " + _Q)
+def _title_is(step, title):
+    return f"assert page.title() == {title!r}"
+
+
+@_default(r"the (?:page )?title should contain " + _Q)
+def _title_contains(step, part):
+    return f"assert {part!r} in page.title()"
+
+
+@_default(r"I wait (?:for )?(\d+(?:\.\d+)?) seconds?")
+def _wait(step, seconds):
+    return f"page.wait_for_timeout({int(float(seconds) * 1000)})"
+
+
+@_default(r"I (?:reload|refresh) the page")
+def _reload(step):
+    return "page.reload()"
+
+
+@_default(r"I go back")
+def _back(step):
+    return "page.go_back()"
+
+
+def default_registry() -> StepRegistry:
+    return StepRegistry()
+
+
+# ---------------------------------------------------------
+# COMPILER
+# ---------------------------------------------------------
+def undefined_steps(feature: Dict[str, Any], registry: StepRegistry) -> List[str]:
+    """Distinct texts of the (expanded) steps no definition matches, in file order."""
+    seen: Dict[str, None] = {}
+    for sc in expand_scenarios(feature):
+        for st in sc["steps"]:
+            if st["text"] not in seen and registry.compile_step(st) is None:
+                seen[st["text"]] = None
+    return list(seen)
+
+
+# Compiled modules list their tag markers on this header line; the generated
+# conftest registers exactly those names
+MARKERS_HEADER = "# pytest markers:"
+
+# Marks with a meaning of their own (pytest builtins and pytest-timeout); a tag
+# with one of these names is escaped rather than applied with no arguments
+_RESERVED_MARKS = {"skipif", "parametrize", "usefixtures", "filterwarnings", "timeout"}
+
+
+def _marker_name(tag: str) -> Optional[str]:
+    """pytest marker for a scenario tag; None for skip/xfail, which are applied as they are."""
+    if tag in ("skip", "xfail"):
+        return None
+    name = re.sub(r"\W+", "_", tag).strip("_") or "tag"
+    return "tag_" + name if name[0].isdigit() or name in _RESERVED_MARKS else name
+
+
+def compile_feature(
+    feature: Dict[str, Any],
+    registry: StepRegistry,
+    learned: Optional[Dict[str, str]] = None,
+    source: Optional[str] = None,
+) -> str:
+    """
+    Compile a parsed feature into a pytest module, one test per concrete
+    scenario, using the `page` / `base_url` fixtures. `learned` maps the
+    text of steps without a definition to their code (e.g. from the model);
+    a step that has neither skips its test.
+    """
+    learned = learned or {}
+    names: Dict[str, int] = {}
+    scenarios = expand_scenarios(feature)
+    markers = [_marker_name(t) for sc in scenarios for t in sc["tags"]]
+    out = [f"# Generated from {source or feature['name']}; edit the .feature file, not this module."]
+    if any(markers):
+        out.append(" ".join([MARKERS_HEADER] + [m for m in dict.fromkeys(markers) if m]))
+    out += ["import pytest", ""]
+
+    for sc in scenarios:
+        base = "test_" + (re.sub(r"[^a-z0-9]+", "_", sc["name"].lower()).strip("_") or "scenario")
+        if sc["example"]:
+            base += f"_{sc['example'][1]}"
+        names[base] = names.get(base, 0) + 1
+        name = base if names[base] == 1 else f"{base}_{names[base]}"
+
+        title = ("Scenario Outline: " if sc["outline"] else "Scenario: ") + sc["name"]
+        if sc["example"]:
+            title += f" (Examples{': ' + sc['example'][0] if sc['example'][0] else ''}, row {sc['example'][1]})"
+        out += [""] + [f"@pytest.mark.{_marker_name(t) or t}" for t in dict.fromkeys(sc["tags"])]
+        doc = f'"""{title}"""' if '"' not in title and "\\" not in title else repr(title)
+        out += [f"def {name}(page, base_url):", f"    {doc}"]
+
+        for st in sc["steps"]:
+            out.append(f"    # {st['keyword']} {st['text']}")
+            lines = registry.compile_step(st)
+            if lines is None and st["text"] in learned:
+                lines = []
+                if st["doc"] is not None:
+                    lines.append(f"doc = {st['doc']!r}")
+                if st["table"] is not None:
+                    lines.append(f"table = {st['table']!r}")
+                lines += learned[st["text"]].splitlines()
+            if lines is None:
+                lines = [f"pytest.skip({'undefined step: ' + st['text']!r})"]
+            out += ["    " + line if line.strip() else "" for line in lines]
+        out.append("")
+    return "\n".join(out).rstrip() + "\n"
@@ -0,0 +1,77 @@
+# agents/image_batch.py
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def run_image_batch(
+    fn: Callable[[str], Any],
+    image_paths: List[str],
+    max_workers: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Run fn(path) for every image in a bounded thread pool.
+
+    Returns one record per input, in input order:
+    {"path", "result", "error", "latency_ms"}. A failing image only sets its
+    own "error"; the others are unaffected. Model calls are still throttled
+    by the shared rate limiter, so max_workers only bounds local threads.
+    """
+    paths = list(image_paths or [])
+    if not paths:
+        return []
+
+    def _one(path: str) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        try:
+            result, error = fn(path), None
+        except Exception as e:
+            logger.warning("ImageBatch: %s failed: %s", path, e)
+            result, error = None, str(e) or type(e).__name__
+        return {"path": path, "result": result, "error": error,
+                "latency_ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+    # IMAGE_WORKERS is read on use so a value from .env (loaded later) applies
+    workers = max(1, min(max_workers or int(os.getenv("IMAGE_WORKERS", "8")), len(paths)))
+    t0 = time.perf_counter()
+    if workers == 1:
+        records = [_one(p) for p in paths]
+    else:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image") as pool:
+            records = list(pool.map(_one, paths))
+
+    wall = (time.perf_counter() - t0) * 1000
+    slowest = max(r["latency_ms"] for r in records)
+    failed = sum(1 for r in records if r["error"])
+    logger.info("ImageBatch: %d images (%d failed) in %.0f ms, slowest %.0f ms",
+                len(records), failed, wall, slowest)
+    return records
+
+
+def describe_images(lm, image_paths: List[str], max_workers: Optional[int] = None) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Describe images concurrently; failed ones become "[desc_failed] <path>"."""
+    records = run_image_batch(lm.describe_image, image_paths, max_workers)
+    descs = [r["result"] if not r["error"] else f"[desc_failed] {r['path']}" for r in records]
+    return descs, records
+
+
+def analyze_images(vision, image_paths: List[str], max_workers: Optional[int] = None) -> Tuple[List[Any], List[Dict[str, Any]]]:
+    """
+    Extract UI structure from images concurrently. One entry per image, in
+    input order; a failed image becomes an empty screen carrying its
+    "image" path and "error", so it is never silently dropped.
+    """
+    records = run_image_batch(vision.analyze_image, image_paths, max_workers)
+    screens = [
+        r["result"] if not r["error"] else {
+            "screen_name": "unknown", "elements": [], "interactions": [], "validations": [],
+            "image": r["path"], "error": r["error"],
+        }
+        for r in records
+    ]
+    return screens, records
@@ -0,0 +1,197 @@
+# agents/image_cache.py
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+from .response_cache import CACHE_DB_PATH, connect_cache_db
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def image_max_dim() -> int:
+    """IMAGE_MAX_DIM, read on use so values from .env (loaded later) apply."""
+    return int(os.getenv("IMAGE_MAX_DIM", "1568"))
+
+
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def detect_mime(data: bytes, path: str = "") -> str:
+    """Sniff the image type from magic bytes, then the file extension."""
+    for magic, mime in _SIGNATURES:
+        if data.startswith(magic):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    guessed, _ = mimetypes.guess_type(path)
+    return guessed or "image/png"
+
+
+def prepare_image(data: bytes, path: str = "", max_dim: Optional[int] = None) -> Tuple[bytes, str]:
+    """
+    Downscale an image so its longest side is at most max_dim and recompress
+    it (JPEG for opaque images, optimized PNG otherwise). Returns
+    (bytes, mime); the original bytes are returned when Pillow is missing or
+    the result would not be smaller.
+    """
+    mime = detect_mime(data, path)
+    max_dim = image_max_dim() if max_dim is None else max_dim
+    try:
+        from PIL import Image
+    except ImportError:
+        return data, mime
+
+    try:
+        img = Image.open(io.BytesIO(data))
+        if max(img.size) <= max_dim:
+            return data, mime
+        img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        out = io.BytesIO()
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        if has_alpha:
+            img.save(out, format="PNG", optimize=True)
+            new_mime = "image/png"
+        else:
+            img.convert("RGB").save(out, format="JPEG", quality=85, optimize=True)
+            new_mime = "image/jpeg"
+        resized = out.getvalue()
+        if len(resized) >= len(data):
+            return data, mime
+        return resized, new_mime
+    except Exception:
+        logger.exception("prepare_image: resize failed, sending original")
+        return data, mime
+
+
+class ImageCache:
+    """
+    Persistent cache of per-image model results (descriptions, extracted
+    UI structures), keyed by (sha256 of the image bytes, kind, model).
+
+    Lives in the LLM cache DB by default and uses the same connection
+    settings; entries expire after ttl_seconds and the table is capped at
+    max_items rows (least recently used first).
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_items: int = 2000,
+        ttl_seconds: float = 30 * 24 * 3600,
+    ):
+        self.db_path = db_path or os.getenv("IMAGE_CACHE_DB", os.getenv("LLM_CACHE_DB", CACHE_DB_PATH))
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self.conn = connect_cache_db(self.db_path)
+        self._ensure_tables()
+
+    def _ensure_tables(self):
+        cur = self.conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS image_results (
+                image_hash TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                model TEXT NOT NULL,
+                result TEXT,
+                created_at REAL,
+                accessed_at REAL,
+                PRIMARY KEY (image_hash, kind, model)
+            )
+        """)
+        # Migration: tables created before eviction had no accessed_at
+        cols = {row[1] for row in cur.execute("PRAGMA table_info(image_results)")}
+        if "accessed_at" not in cols:
+            cur.execute("ALTER TABLE image_results ADD COLUMN accessed_at REAL")
+            cur.execute("UPDATE image_results SET accessed_at = created_at")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_image_results_accessed ON image_results (accessed_at)")
+        self.conn.commit()
+
+    @classmethod
+    def from_env(cls) -> "ImageCache":
+        return cls(
+            max_items=int(os.getenv("IMAGE_CACHE_ITEMS", "2000")),
+            ttl_seconds=float(os.getenv("IMAGE_CACHE_TTL_SECONDS", str(30 * 24 * 3600))),
+        )
+
+    def get(self, image_hash: str, kind: str, model: str) -> Optional[str]:
+        now = time.time()
+        key = (image_hash, kind, model)
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT result, created_at FROM image_results WHERE image_hash = ? AND kind = ? AND model = ?",
+                key,
+            ).fetchone()
+            if row and self.ttl_seconds and now - (row[1] or 0) > self.ttl_seconds:
+                self.conn.execute("DELETE FROM image_results WHERE image_hash = ? AND kind = ? AND model = ?", key)
+                self.stats["evictions"] += 1
+                row = None
+            elif row:
+                self.conn.execute(
+                    "UPDATE image_results SET accessed_at = ? WHERE image_hash = ? AND kind = ? AND model = ?",
+                    (now,) + key,
+                )
+            self.conn.commit()
+            self.stats["hits" if row else "misses"] += 1
+            return row[0] if row else None
+
+    def set(self, image_hash: str, kind: str, model: str, result: str):
+        now = time.time()
+        with self._lock:
+            self.conn.execute(
+                "REPLACE INTO image_results (image_hash, kind, model, result, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (image_hash, kind, model, result, now, now),
+            )
+            self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now: float):
+        cur = self.conn.cursor()
+        if self.ttl_seconds:
+            cur.execute("DELETE FROM image_results WHERE created_at < ?", (now - self.ttl_seconds,))
+            self.stats["evictions"] += max(cur.rowcount, 0)
+        if self.max_items:
+            cur.execute(
+                "DELETE FROM image_results WHERE rowid IN ("
+                "  SELECT rowid FROM image_results ORDER BY accessed_at DESC LIMIT -1 OFFSET ?"
+                ")",
+                (self.max_items,),
+            )
+            self.stats["evictions"] += max(cur.rowcount, 0)
+
+
+_shared: Optional[ImageCache] = None
+_shared_lock = threading.Lock()
+
+
+def get_image_cache() -> Optional[ImageCache]:
+    """Process-wide image cache, or None when IMAGE_CACHE=0 or the DB cannot be opened."""
+    global _shared
+    if os.getenv("IMAGE_CACHE", "1").lower() in ("0", "false", "no", "off"):
+        return None
+    with _shared_lock:
+        if _shared is None:
+            try:
+                _shared = ImageCache.from_env()
+            except Exception:
+                logger.exception("ImageCache: unavailable (non-fatal)")
+                return None
+        return _shared
@@ -11,4 +11,26 @@ class JiraAgent:
         return self.jira.add_comment(issue_key, body)
 
     def attach_artifact(self, issue_key: str, file_path: str):
-        return self.jira.add_attachment(issue_key, file_path)
\ No newline at end of file
+        return self.jira.add_attachment(issue_key, file_path)
+
+XRAY_STATUS = {"passed": "PASSED", "failed": "FAILED", "error": "FAILED", "skipped": "TODO"}
+
+
+def xray_execution_payload(feature_id: str, results: dict, summary: str = None) -> dict:
+    """Xray-style execution import built from ExecutionAgent's structured results."""
+    tests = []
+    for case in results.get("cases", []):
+        test = {
+            "testKey": case.get("testcase_id") or case["key"],
+            "status": XRAY_STATUS.get(case.get("outcome"), "FAILED"),
+            "duration": case.get("duration"),
+        }
+        if case.get("message"):
+            test["comment"] = case["message"][:2000]
+        tests.append(test)
+    return {
+        "feature_id": feature_id,
+        "summary": summary or f"Automated execution for {feature_id}",
+        "info": {"run_id": results.get("run_id"), "totals": results.get("tests", {})},
+        "tests": tests,
+    }
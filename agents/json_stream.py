@@ -0,0 +1,197 @@
+# agents/json_stream.py
+import json
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+_TRAILING_COMMA = re.compile(r",\s*(?=[}\]])")
+
+
+def _loads_lenient(text: str) -> Any:
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(_TRAILING_COMMA.sub("", text))
+
+
+class TestCaseStreamParser:
+    """
+    Incremental, tolerant parser for model output shaped like
+    {"feature_id": ..., "test_cases": [{...}, {...}]} (or a bare list).
+
+    Feed chunks as they arrive; feed() returns the test case objects whose
+    closing brace appeared in that chunk. Text before the first '{' / '['
+    (markdown fences, prose) is skipped. If the output is cut off, the items
+    completed so far stay available in .items.
+    """
+
+    __test__ = False  # not a pytest class
+
+    def __init__(self, array_key: str = "test_cases"):
+        self.array_key = array_key
+        self.items: List[Dict[str, Any]] = []
+        self.meta: Dict[str, Any] = {}
+        self.errors = 0
+
+        self._buf = ""
+        self._pos = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._str_start = 0
+        self._last_string: Optional[str] = None
+        self._pending_key: Optional[str] = None
+        self._array_depth: Optional[int] = None
+        self._item_start: Optional[int] = None
+        self._doc_start: Optional[int] = None
+        self._doc_end: Optional[int] = None
+
+    @property
+    def complete(self) -> bool:
+        """True once the top-level JSON value has been closed."""
+        return self._doc_end is not None
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        if not chunk or self.complete:
+            return []
+        self._buf += chunk
+        new_items = []
+        buf = self._buf
+        i = self._pos
+        n = len(buf)
+
+        while i < n:
+            c = buf[i]
+
+            if self._doc_start is None:
+                if c in "{[":
+                    self._doc_start = i
+                else:
+                    i += 1
+                    continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_string = False
+                    self._close_string(buf[self._str_start:i])
+                i += 1
+                continue
+
+            if c == '"':
+                self._in_string = True
+                self._str_start = i + 1
+            elif c == ":":
+                self._pending_key = self._last_string
+            elif c == ",":
+                self._pending_key = None
+            elif c in "{[":
+                self._stack.append(c)
+                depth = len(self._stack)
+                if self._array_depth is None and c == "[" and (self._pending_key == self.array_key or depth == 1):
+                    self._array_depth = depth
+                elif c == "{" and self._array_depth is not None and depth == self._array_depth + 1:
+                    self._item_start = i
+                self._pending_key = None
+            elif c in "}]":
+                if self._stack:
+                    self._stack.pop()
+                depth = len(self._stack)
+                if c == "}" and self._item_start is not None and depth == self._array_depth:
+                    item = self._parse_item(buf[self._item_start:i + 1])
+                    if item is not None:
+                        self.items.append(item)
+                        new_items.append(item)
+                    self._item_start = None
+                elif c == "]" and self._array_depth is not None and depth == self._array_depth - 1:
+                    self._array_depth = None
+                if not self._stack:
+                    self._doc_end = i
+                    i += 1
+                    break
+            i += 1
+
+        self._pos = i
+        return new_items
+
+    def document(self) -> Any:
+        """The full parsed JSON value, or None if the output never closed or does not parse."""
+        if not self.complete:
+            return None
+        try:
+            return _loads_lenient(self._buf[self._doc_start:self._doc_end + 1])
+        except json.JSONDecodeError:
+            return None
+
+    def result(self) -> Dict[str, Any]:
+        """Best available {"feature_id", "test_cases"} view: the full document if valid, else recovered items."""
+        doc = self.document()
+        if isinstance(doc, dict):
+            return doc
+        if isinstance(doc, list):
+            return {"feature_id": self.meta.get("feature_id"), "test_cases": doc}
+        return {"feature_id": self.meta.get("feature_id"), "test_cases": list(self.items)}
+
+    # ---------------------------------------------------------
+    # INTERNALS
+    # ---------------------------------------------------------
+    def _close_string(self, raw: str):
+        depth = len(self._stack)
+        if self._pending_key is not None and depth == 1:
+            # top-level scalar value, e.g. "feature_id": "feat_login"
+            try:
+                self.meta[self._pending_key] = json.loads(f'"{raw}"')
+            except json.JSONDecodeError:
+                self.meta[self._pending_key] = raw
+            self._last_string = None
+        else:
+            self._last_string = raw
+
+    def _parse_item(self, text: str) -> Optional[Dict[str, Any]]:
+        try:
+            item = _loads_lenient(text)
+        except json.JSONDecodeError:
+            self.errors += 1
+            return None
+        return item if isinstance(item, dict) else None
+
+
+def iter_test_cases(chunks: Iterable[str], parser: Optional[TestCaseStreamParser] = None) -> Iterator[Dict[str, Any]]:
+    """Yield each test case as soon as its closing brace has streamed in."""
+    parser = parser or TestCaseStreamParser()
+    for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
+
+
+def parse_json_value(raw: str) -> Any:
+    """
+    The first complete JSON value in a model response: prose and fences
+    around it are skipped, braces inside strings are respected and
+    trailing commas tolerated. None when no value closes or it does not parse.
+    """
+    parser = TestCaseStreamParser()
+    parser.feed(raw or "")
+    return parser.document()
+
+
+def parse_test_cases(raw: str) -> Dict[str, Any]:
+    """
+    Parse a complete (possibly truncated or fenced) model response.
+
+    Returns the full document when it is valid JSON, otherwise the test
+    cases that were completed before the output broke off. Raises
+    ValueError when nothing usable is found.
+    """
+    if not raw:
+        raise ValueError("Empty output")
+    parser = TestCaseStreamParser()
+    parser.feed(raw)
+    if parser._doc_start is None:
+        raise ValueError("No JSON found in model output")
+    result = parser.result()
+    if parser.document() is None and not result["test_cases"]:
+        raise ValueError("No complete test case found in model output")
+    return result
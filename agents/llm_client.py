@@ -2,16 +2,35 @@
 import os
 import json
 import logging
-from typing import Optional
+import threading
+from typing import Iterator, Optional
 
 from dotenv import load_dotenv
 
+from .image_cache import get_image_cache, prepare_image, sha256_bytes
+from .rate_limiter import RateLimiter, estimate_tokens, get_rate_limiter
+from .response_cache import ResponseCache, get_shared_cache, is_cacheable, make_cache_key
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 
+def run_sync(coro):
+    """Run a coroutine from sync code, even if the calling thread already has a running loop."""
+    import asyncio
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    # Called from inside an event loop (e.g. notebooks): run on a helper thread
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+
 class LMClient:
     """
     LMClient updated for the NEW Gemini SDK (2025+).
@@ -20,58 +39,205 @@ class LMClient:
       from google.generativeai import GenerativeModel
       model = GenerativeModel("gemini-2.0-flash")
       model.generate_content(...)
+
+    Every real model call goes through the process-wide RateLimiter
+    (LLM_RPM / LLM_TPM / LLM_MAX_CONCURRENCY), for both the sync methods
+    and their asyncio counterparts agenerate / adescribe_image.
     """
 
-    def __init__(self, model_name: Optional[str] = None):
+    # Rough per-image token charge used for TPM accounting
+    IMAGE_TOKENS = 258
+
+    def __init__(self, model_name: Optional[str] = None, cache: Optional[ResponseCache] = None, limiter: Optional[RateLimiter] = None):
         self.api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GENAI_API_KEY")
         self.model_name = model_name or os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
         self.use_mock = not bool(self.api_key)
+        self.cache = cache if cache is not None else (None if self.use_mock else get_shared_cache())
+        self._limiter = limiter
+
+        self._model = None
+        self._model_lock = threading.Lock()
 
         if self.use_mock:
             logger.warning("LMClient: API key missing — using mock mode")
-            self.model = None
-            return
 
-        try:
-            import google.generativeai as genai
-            genai.configure(api_key=self.api_key)
-            from google.generativeai import GenerativeModel
+    @property
+    def model(self):
+        """
+        The Gemini model, built on first use so that constructing an
+        LMClient (or importing this module) does not import the SDK.
+        Falls back to mock mode if the SDK cannot be initialized.
+        """
+        if self._model is None and not self.use_mock:
+            with self._model_lock:
+                if self._model is None and not self.use_mock:
+                    try:
+                        import google.generativeai as genai
+                        genai.configure(api_key=self.api_key)
+                        from google.generativeai import GenerativeModel
 
-            self.model = GenerativeModel(self.model_name)
-            logger.info("LMClient: Using new Gemini SDK interface")
+                        self._model = GenerativeModel(self.model_name)
+                        logger.info("LMClient: Using new Gemini SDK interface")
 
-        except Exception as e:
-            logger.exception("LMClient: Failed to initialize new Gemini SDK")
-            self.use_mock = True
-            self.model = None
+                    except Exception as e:
+                        logger.exception("LMClient: Failed to initialize new Gemini SDK")
+                        self.use_mock = True
+        return self._model
+
+    @model.setter
+    def model(self, value):
+        self._model = value
 
     # ---------------------------------------------------------------------
     # TEXT GENERATION
     # ---------------------------------------------------------------------
-    def generate(self, prompt: str, max_output_tokens: int = 4096) -> str:
-        """Generate text using Gemini 2.x or return mock output."""
+    def _generation_config(self, max_output_tokens: int) -> dict:
+        return {"max_output_tokens": max_output_tokens, "temperature": 0.0, "top_p": 1, "top_k": 1}
+
+    @property
+    def limiter(self) -> RateLimiter:
+        return self._limiter or get_rate_limiter()
+
+    def _cache_lookup(self, prompt: str, max_output_tokens: int, use_cache: bool):
+        """Return (cache_key, cached_text); both None when caching does not apply."""
+        if self.cache is None:
+            return None, None
+        key = make_cache_key(self.model_name, prompt, max_output_tokens, self._generation_config(max_output_tokens))
+        return key, (self.cache.get(key) if use_cache else None)
+
+    def _cache_store(self, key: Optional[str], text: str):
+        if key is not None and is_cacheable(text):
+            self.cache.set(key, text)
+
+    def generate(self, prompt: str, max_output_tokens: int = 4096, use_cache: bool = True) -> str:
+        """
+        Generate text using Gemini 2.x or return mock output.
+
+        Identical requests are served from the response cache; pass
+        use_cache=False to force a fresh model call (the result still
+        refreshes the cache). Error results are never cached.
+        """
 
         if self.use_mock or self.model is None:
             return self._mock_response(prompt)
 
+        key, cached = self._cache_lookup(prompt, max_output_tokens, use_cache)
+        if cached is not None:
+            return cached
+
+        limiter = self.limiter
         try:
-            response = self.model.generate_content(
-                prompt,
-                generation_config={"max_output_tokens": max_output_tokens, "temperature": 0.0, "top_p": 1, "top_k": 1}
-            )
+            with limiter.slot():
+                limiter.acquire(estimate_tokens(prompt))
+                response = self.model.generate_content(
+                    prompt, generation_config=self._generation_config(max_output_tokens)
+                )
 
             # new SDK unified text access
-            return response.text or ""
+            text = response.text or ""
 
         except Exception as e:
             logger.exception("LMClient.generate failed")
             return f"[genai_error] {str(e)}"
 
+        limiter.record_tokens(estimate_tokens(text))
+        self._cache_store(key, text)
+        return text
+
+    async def agenerate(self, prompt: str, max_output_tokens: int = 4096, use_cache: bool = True) -> str:
+        """asyncio variant of generate(); calls overlap up to LLM_MAX_CONCURRENCY."""
+        import asyncio
+
+        if self.use_mock or self.model is None:
+            return self._mock_response(prompt)
+
+        key, cached = self._cache_lookup(prompt, max_output_tokens, use_cache)
+        if cached is not None:
+            return cached
+
+        limiter = self.limiter
+        config = self._generation_config(max_output_tokens)
+        try:
+            async with limiter.async_slot():
+                await limiter.acquire_async(estimate_tokens(prompt))
+                if hasattr(self.model, "generate_content_async"):
+                    response = await self.model.generate_content_async(prompt, generation_config=config)
+                else:
+                    response = await asyncio.to_thread(self.model.generate_content, prompt, generation_config=config)
+
+            text = response.text or ""
+
+        except Exception as e:
+            logger.exception("LMClient.agenerate failed")
+            return f"[genai_error] {str(e)}"
+
+        limiter.record_tokens(estimate_tokens(text))
+        self._cache_store(key, text)
+        return text
+
+    def generate_stream(self, prompt: str, max_output_tokens: int = 4096, use_cache: bool = True, chunk_size: int = 64) -> Iterator[str]:
+        """
+        Yield the response text in chunks as the model produces them.
+
+        Cache hits are yielded as a single chunk; mock mode splits the mock
+        response into chunk_size pieces so callers behave the same offline.
+        A failure mid-stream yields a final "[genai_error] ..." chunk.
+
+        The concurrency slot covers sending the request only, never a yield:
+        a consumer that stops iterating early cannot keep a slot (or leave
+        the slot flag set in its own context).
+        """
+
+        if self.use_mock or self.model is None:
+            text = self._mock_response(prompt)
+            for i in range(0, len(text), chunk_size):
+                yield text[i:i + chunk_size]
+            return
+
+        key, cached = self._cache_lookup(prompt, max_output_tokens, use_cache)
+        if cached is not None:
+            yield cached
+            return
+
+        limiter = self.limiter
+        parts = []
+        try:
+            with limiter.slot():
+                limiter.acquire(estimate_tokens(prompt))
+                response = self.model.generate_content(
+                    prompt, generation_config=self._generation_config(max_output_tokens), stream=True
+                )
+            for chunk in response:
+                text = getattr(chunk, "text", "") or ""
+                if text:
+                    parts.append(text)
+                    yield text
+
+        except Exception as e:
+            logger.exception("LMClient.generate_stream failed")
+            yield f"[genai_error] {str(e)}"
+            return
+
+        full = "".join(parts)
+        limiter.record_tokens(estimate_tokens(full))
+        self._cache_store(key, full)
+
+    def cache_stats(self) -> dict:
+        """Hit/miss counters of the response cache (empty if caching is disabled)."""
+        if self.cache is None:
+            return {}
+        return dict(self.cache.stats, hit_rate=self.cache.hit_rate())
+
     # ---------------------------------------------------------------------
     # IMAGE DESCRIPTION
     # ---------------------------------------------------------------------
     def describe_image(self, image_path: str) -> str:
-        """Describe an image using new Gemini multimodal input."""
+        """
+        Describe an image using new Gemini multimodal input.
+
+        Descriptions are cached by image content hash, and images are
+        downscaled to IMAGE_MAX_DIM before upload.
+        """
 
         if self.use_mock or self.model is None:
             return self._local_fallback(image_path)
@@ -80,23 +246,49 @@ class LMClient:
             if not os.path.exists(image_path):
                 return f"[image_missing] {image_path}"
 
-            # Multimodal: pass image as binary
             with open(image_path, "rb") as f:
                 img_bytes = f.read()
 
-            response = self.model.generate_content(
-                [
-                    "Describe this image in short bullet points.",
-                    {"mime_type": "image/png", "data": img_bytes},
-                ]
-            )
+            cache = get_image_cache()
+            image_hash = sha256_bytes(img_bytes)
+            if cache is not None:
+                cached = cache.get(image_hash, "describe", self.model_name)
+                if cached is not None:
+                    return cached
+
+            # Multimodal: pass image as binary
+            data, mime = prepare_image(img_bytes, image_path)
+            limiter = self.limiter
+            with limiter.slot():
+                limiter.acquire(self.IMAGE_TOKENS)
+                response = self.model.generate_content(
+                    [
+                        "Describe this image in short bullet points.",
+                        {"mime_type": mime, "data": data},
+                    ]
+                )
 
-            return response.text or "[no_description]"
+            text = response.text
+            if text and cache is not None:
+                cache.set(image_hash, "describe", self.model_name, text)
+            return text or "[no_description]"
 
         except Exception:
             logger.exception("LMClient.describe_image: Gemini multimodal failed")
             return self._local_fallback(image_path)
 
+    async def adescribe_image(self, image_path: str) -> str:
+        """
+        asyncio variant of describe_image(), bounded by the shared limiter.
+        The slot taken here carries over into the worker thread, so
+        describe_image() does not take a second one.
+        """
+        import asyncio
+        if self.use_mock or self.model is None:
+            return self._local_fallback(image_path)
+        async with self.limiter.async_slot():
+            return await asyncio.to_thread(self.describe_image, image_path)
+
     # ---------------------------------------------------------------------
     # LOCAL IMAGE FALLBACK
     # ---------------------------------------------------------------------
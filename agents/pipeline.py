@@ -0,0 +1,217 @@
+# agents/pipeline.py
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+class Stage:
+    """
+    One pipeline step: fn(**inputs) -> {output_name: value}.
+
+    A stage with a single output may return the bare value. `files` names
+    outputs that are file paths; a checkpoint is only reused while those
+    files still exist. `should_checkpoint(outputs)` can veto storing a
+    result (e.g. keep re-running a failed test run). Bump `version` when the
+    stage's logic changes to invalidate its old checkpoints.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        inputs: Sequence[str] = (),
+        outputs: Sequence[str] = (),
+        checkpoint: bool = True,
+        files: Sequence[str] = (),
+        should_checkpoint: Optional[Callable[[Dict[str, Any]], bool]] = None,
+        version: str = "1",
+    ):
+        self.name = name
+        self.fn = fn
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs) or (name,)
+        self.checkpoint = checkpoint
+        self.files = tuple(files)
+        self.should_checkpoint = should_checkpoint
+        self.version = version
+
+    def input_hash(self, values: Dict[str, Any]) -> str:
+        payload = {"stage": self.name, "version": self.version, "inputs": {k: values[k] for k in self.inputs}}
+        blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _normalize(self, result: Any) -> Dict[str, Any]:
+        if len(self.outputs) == 1 and not (isinstance(result, dict) and set(result) == set(self.outputs)):
+            return {self.outputs[0]: result}
+        if not isinstance(result, dict) or not set(self.outputs) <= set(result):
+            raise ValueError(f"stage {self.name} must return {list(self.outputs)}")
+        return {k: result[k] for k in self.outputs}
+
+
+class CheckpointStore:
+    """SQLite store of stage outputs keyed by (stage, input hash)."""
+
+    def __init__(self, db_path: Optional[str] = None):
+        self.db_path = db_path or os.getenv("PIPELINE_DB", "pipeline_checkpoints.db")
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pipeline_checkpoints (
+                stage TEXT NOT NULL,
+                input_hash TEXT NOT NULL,
+                outputs TEXT NOT NULL,
+                duration_ms REAL,
+                created_at REAL,
+                PRIMARY KEY (stage, input_hash)
+            )
+        """)
+        self.conn.commit()
+
+    def get(self, stage: str, input_hash: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT outputs FROM pipeline_checkpoints WHERE stage = ? AND input_hash = ?",
+                (stage, input_hash),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, stage: str, input_hash: str, outputs: Dict[str, Any], duration_ms: float = 0.0):
+        blob = json.dumps(outputs, ensure_ascii=False)
+        with self._lock:
+            self.conn.execute(
+                "REPLACE INTO pipeline_checkpoints (stage, input_hash, outputs, duration_ms, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (stage, input_hash, blob, duration_ms, time.time()),
+            )
+            self.conn.commit()
+
+    def clear(self, stage: Optional[str] = None):
+        with self._lock:
+            if stage is None:
+                self.conn.execute("DELETE FROM pipeline_checkpoints")
+            else:
+                self.conn.execute("DELETE FROM pipeline_checkpoints WHERE stage = ?", (stage,))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class Pipeline:
+    """
+    Runs stages as a DAG: a stage starts as soon as all of its inputs exist,
+    so independent stages run concurrently in a thread pool.
+
+    With a CheckpointStore, each stage's outputs are saved under a hash of
+    its inputs. A rerun reuses them for unchanged inputs, which also resumes
+    a failed run from the stage that failed. A failing stage only skips the
+    stages downstream of it.
+    """
+
+    def __init__(self, stages: Iterable[Stage], store: Optional[CheckpointStore] = None, max_workers: int = 4):
+        self.stages: List[Stage] = list(stages)
+        self.store = store
+        self.max_workers = max_workers
+        self._producer: Dict[str, str] = {}
+        for st in self.stages:
+            for out in st.outputs:
+                if out in self._producer:
+                    raise ValueError(f"output {out!r} produced by both {self._producer[out]} and {st.name}")
+                self._producer[out] = st.name
+        self._check_acyclic()
+
+    def _check_acyclic(self):
+        deps = {st.name: {self._producer[i] for i in st.inputs if i in self._producer} for st in self.stages}
+        done: set = set()
+        while len(done) < len(deps):
+            ready = [n for n, d in deps.items() if n not in done and d <= done]
+            if not ready:
+                raise ValueError(f"pipeline has a cycle among {sorted(set(deps) - done)}")
+            done.update(ready)
+
+    def run(self, initial: Optional[Dict[str, Any]] = None, fresh: bool = False) -> Dict[str, Any]:
+        """
+        Execute the DAG. Returns {"values": {...}, "stages": {name: info}, "ok": bool};
+        info has status (ran | cached | failed | skipped), duration_ms and, for
+        failures, error. fresh=True ignores existing checkpoints (new results are
+        still stored).
+        """
+        values: Dict[str, Any] = dict(initial or {})
+        missing = {i for st in self.stages for i in st.inputs} - set(values) - set(self._producer)
+        if missing:
+            raise ValueError(f"pipeline inputs not provided: {sorted(missing)}")
+
+        report: Dict[str, Dict[str, Any]] = {}
+        pending = list(self.stages)
+        running: Dict[Any, Stage] = {}
+
+        def _blocked(st: Stage) -> bool:
+            return any(self._producer.get(i) in report and report[self._producer[i]]["status"] in ("failed", "skipped")
+                       for i in st.inputs)
+
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers), thread_name_prefix="stage") as pool:
+            while pending or running:
+                for st in list(pending):
+                    if _blocked(st):
+                        pending.remove(st)
+                        report[st.name] = {"status": "skipped", "duration_ms": 0.0}
+                    elif all(i in values for i in st.inputs):
+                        pending.remove(st)
+                        args = {k: values[k] for k in st.inputs}
+                        running[pool.submit(self._run_stage, st, args, fresh)] = st
+                if not running:
+                    if pending:
+                        # Remaining stages wait on outputs that nothing will produce
+                        for st in pending:
+                            report[st.name] = {"status": "skipped", "duration_ms": 0.0}
+                        pending.clear()
+                    break
+
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    st = running.pop(fut)
+                    info, outputs = fut.result()
+                    report[st.name] = info
+                    if outputs is not None:
+                        values.update(outputs)
+
+        ok = all(r["status"] in ("ran", "cached") for r in report.values())
+        return {"values": values, "stages": {st.name: report[st.name] for st in self.stages}, "ok": ok}
+
+    def _run_stage(self, st: Stage, args: Dict[str, Any], fresh: bool):
+        key = st.input_hash(args) if (st.checkpoint and self.store is not None) else None
+
+        if key and not fresh:
+            try:
+                cached = self.store.get(st.name, key)
+            except Exception:
+                logger.exception("Pipeline: checkpoint read failed for %s (non-fatal)", st.name)
+                cached = None
+            if cached is not None and all(os.path.exists(str(cached.get(f, ""))) for f in st.files):
+                logger.info("Pipeline: %s unchanged, using checkpoint", st.name)
+                return {"status": "cached", "duration_ms": 0.0, "input_hash": key}, cached
+
+        t0 = time.perf_counter()
+        try:
+            outputs = st._normalize(st.fn(**args))
+        except Exception as e:
+            ms = round((time.perf_counter() - t0) * 1000, 1)
+            logger.warning("Pipeline: stage %s failed: %s", st.name, e)
+            return {"status": "failed", "duration_ms": ms, "error": str(e) or type(e).__name__}, None
+        ms = round((time.perf_counter() - t0) * 1000, 1)
+
+        if key and (st.should_checkpoint is None or st.should_checkpoint(outputs)):
+            try:
+                self.store.set(st.name, key, outputs, ms)
+            except Exception:
+                logger.exception("Pipeline: could not checkpoint %s (non-fatal)", st.name)
+        return {"status": "ran", "duration_ms": ms, "input_hash": key}, outputs
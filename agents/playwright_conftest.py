@@ -0,0 +1,155 @@
+# agents/playwright_conftest.py
+import os
+import threading
+
+from .gherkin import MARKERS_HEADER
+
+# First line of every conftest.py we generate; files without it are never overwritten
+MARKER = "# Generated by AutomationAgent: shared Playwright fixtures"
+
+CONFTEST_TEMPLATE = MARKER + '''
+#
+# One browser per pytest process (session scope). Every test gets a `page`
+# in a brand new browser context, which is closed afterwards, so no state
+# leaks between tests.
+#
+# PW_CONTEXT_POOL=N (opt-in) reuses up to N contexts instead, which saves
+# context start-up time. Between tests, pages are closed, cookies and
+# permissions are cleared, and localStorage/sessionStorage are cleared for
+# the origin of the test's page only. IndexedDB, the storage of other
+# origins, service workers and the HTTP cache DO carry over to the next
+# test, so only use it for suites that do not depend on that isolation.
+#
+#   PW_BROWSER       chromium | firefox | webkit   (default chromium)
+#   PW_HEADLESS      1 | 0                         (default 1)
+#   PW_CONTEXT_POOL  number of reusable contexts   (default 0: fresh context per test)
+#   APP_BASE_URL     base_url fixture              (default {app_base!r})
+import os
+from collections import deque
+
+import pytest
+
+
+def pytest_configure(config):
+    # Scenario tags from .feature files become @pytest.mark.<tag>; each module
+    # compiled from a .feature file lists them in its header. Register those
+    # so -m selects them and --strict-markers accepts them
+    here = os.path.dirname(os.path.abspath(__file__))
+    names = set()
+    for fname in os.listdir(here):
+        if fname.endswith(".py") and fname != "conftest.py":
+            with open(os.path.join(here, fname), encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    if not line.startswith("#"):
+                        break
+                    if line.startswith({markers_header!r}):
+                        names.update(line[len({markers_header!r}):].split())
+    for name in sorted(names):
+        config.addinivalue_line("markers", f"{{name}}: scenario tag")
+
+
+@pytest.fixture(scope="session")
+def base_url():
+    return os.getenv("APP_BASE_URL", {app_base!r})
+
+
+@pytest.fixture(scope="session")
+def _playwright():
+    sync_api = pytest.importorskip("playwright.sync_api")
+    pw = sync_api.sync_playwright().start()
+    yield pw
+    pw.stop()
+
+
+@pytest.fixture(scope="session")
+def browser(_playwright):
+    browser_type = getattr(_playwright, os.getenv("PW_BROWSER", "chromium"))
+    browser = browser_type.launch(headless=os.getenv("PW_HEADLESS", "1") != "0")
+    yield browser
+    browser.close()
+
+
+class ContextPool:
+    def __init__(self, browser, size):
+        self.browser = browser
+        self.size = size
+        self.idle = deque(browser.new_context() for _ in range(size))
+
+    def acquire(self):
+        if self.idle:
+            return self.idle.popleft()
+        return self.browser.new_context()
+
+    def release(self, context):
+        if len(self.idle) >= self.size:
+            context.close()
+            return
+        try:
+            for page in list(context.pages):
+                page.close()
+            context.clear_cookies()
+            context.clear_permissions()
+        except Exception:
+            context.close()
+            return
+        self.idle.append(context)
+
+    def close(self):
+        while self.idle:
+            self.idle.popleft().close()
+
+
+@pytest.fixture(scope="session")
+def context_pool(browser):
+    pool = ContextPool(browser, int(os.getenv("PW_CONTEXT_POOL", "0")))
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def context(context_pool):
+    ctx = context_pool.acquire()
+    yield ctx
+    context_pool.release(ctx)
+
+
+@pytest.fixture
+def page(context, context_pool):
+    page = context.new_page()
+    yield page
+    # Pages opened during the test are closed when the context is released.
+    # With a pool, clear this origin's storage while still on it (needs an origin)
+    try:
+        if context_pool.size and page.url.startswith("http"):
+            page.evaluate("() => {{ localStorage.clear(); sessionStorage.clear(); }}")
+    except Exception:
+        pass
+'''
+
+
+def write_conftest(directory: str, app_base: str) -> str:
+    """
+    Write the shared-fixture conftest.py into directory, unless a
+    hand-written conftest.py (one without our marker) is already there.
+
+    An unchanged file is left alone; otherwise the new content goes to a
+    temporary file that replaces conftest.py in one step, so a pytest run
+    collecting the directory meanwhile never sees a half-written file.
+    """
+    path = os.path.join(directory or ".", "conftest.py")
+    content = CONFTEST_TEMPLATE.format(app_base=app_base, markers_header=MARKERS_HEADER)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            current = f.read()
+        if not current.startswith(MARKER) or current == content:
+            return path
+    os.makedirs(directory or ".", exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
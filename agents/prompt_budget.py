@@ -0,0 +1,117 @@
+# agents/prompt_budget.py
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .rate_limiter import estimate_tokens
+from .registry import per_thread
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+
+def compact_json(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False)
+
+
+class PromptSection:
+    """
+    One block of prompt context.
+
+    Lower priority numbers are kept first. Required sections are never
+    dropped or shortened; the others are truncated (list items from the
+    end, long strings cut) or omitted when the budget runs out.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        value: Any,
+        priority: int = 10,
+        required: bool = False,
+        render: Optional[Callable[[Any], str]] = None,
+        empty: str = "None",
+    ):
+        self.name = name
+        self.value = value
+        self.priority = priority
+        self.required = required
+        self.render = render or (lambda v: v if isinstance(v, str) else compact_json(v))
+        self.empty = empty
+
+
+class PromptBudgeter:
+    """Fit prompt sections into a token budget, by priority."""
+
+    # Report of the calling thread's last fit()
+    last_report = per_thread(dict)
+
+    def __init__(self, budget_tokens: int = 6000, min_section_tokens: int = 16):
+        self.budget_tokens = budget_tokens
+        self.min_section_tokens = min_section_tokens
+
+    def fit(self, sections: List[PromptSection], overhead_tokens: int = 0) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        """Return ({name: rendered text}, report) with the total kept within budget where possible."""
+        remaining = self.budget_tokens - overhead_tokens
+        rendered: Dict[str, str] = {}
+        report: Dict[str, Any] = {"budget": self.budget_tokens, "overhead": overhead_tokens, "sections": {}}
+
+        for sec in sorted(sections, key=lambda s: (not s.required, s.priority)):
+            if sec.value in (None, "", [], {}):
+                rendered[sec.name] = sec.empty
+                report["sections"][sec.name] = {"tokens": 0, "dropped": 0}
+                continue
+
+            full = sec.render(sec.value)
+            need = estimate_tokens(full)
+            if sec.required or need <= remaining:
+                text = full
+            elif remaining >= self.min_section_tokens:
+                text = self._shrink(sec, remaining)
+            else:
+                text = None
+
+            used = estimate_tokens(text) if text else 0
+            rendered[sec.name] = text if text else sec.empty
+            remaining -= used
+            report["sections"][sec.name] = {"tokens": used, "dropped": need - used}
+
+        report["total"] = overhead_tokens + sum(s["tokens"] for s in report["sections"].values())
+        for name, s in report["sections"].items():
+            logger.info("PromptBudget: %-14s used=%d dropped=%d", name, s["tokens"], s["dropped"])
+        if report["total"] > self.budget_tokens:
+            logger.warning("PromptBudget: required sections exceed budget (%d > %d)", report["total"], self.budget_tokens)
+        self.last_report = report
+        return rendered, report
+
+    # ---------------------------------------------------------
+    # TRUNCATION
+    # ---------------------------------------------------------
+    def _shrink(self, sec: PromptSection, max_tokens: int) -> Optional[str]:
+        value = sec.value
+        if isinstance(value, list):
+            return self._shrink_list(value, lambda items: sec.render(items), max_tokens)
+
+        if isinstance(value, dict):
+            lists = [k for k, v in value.items() if isinstance(v, list) and v]
+            if lists:
+                key = max(lists, key=lambda k: len(compact_json(value[k])))
+                text = self._shrink_list(value[key], lambda items: sec.render(dict(value, **{key: items})), max_tokens)
+                if text:
+                    return text
+
+        text = sec.render(value)
+        cut = max_tokens * 4 - 20
+        return text[:cut] + " …[truncated]" if cut > 0 else None
+
+    @staticmethod
+    def _shrink_list(items: List[Any], render: Callable[[List[Any]], str], max_tokens: int) -> Optional[str]:
+        """Longest prefix of items whose rendering fits (binary search)."""
+        lo, hi = 0, len(items)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if estimate_tokens(render(items[:mid])) <= max_tokens:
+                lo = mid
+            else:
+                hi = mid - 1
+        return render(items[:lo]) if lo else None
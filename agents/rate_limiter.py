@@ -0,0 +1,252 @@
+# agents/rate_limiter.py
+import contextlib
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Set while the current thread/task holds a concurrency slot; it is copied
+# into asyncio.to_thread() workers, so nested slot() calls do not take a second one
+_holding_slot: contextvars.ContextVar = contextvars.ContextVar("holding_llm_slot", default=False)
+
+
+def estimate_tokens(text) -> int:
+    """Cheap local token estimate (~4 chars per token), good enough for budgeting."""
+    if not text:
+        return 0
+    if not isinstance(text, str):
+        text = str(text)
+    return max(1, math.ceil(len(text) / 4))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+
+    reserve() never blocks: it books the amount (the balance may go negative)
+    and returns how long the caller has to wait before proceeding, so the same
+    bucket serves both time.sleep and asyncio.sleep callers in arrival order.
+    """
+
+    def __init__(self, capacity: float, per_seconds: float = 60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / per_seconds
+        self.balance = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.balance = min(self.capacity, self.balance + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.balance -= amount
+            if self.balance >= 0:
+                return 0.0
+            return -self.balance / self.rate
+
+    def debit(self, amount: float):
+        """Charge usage discovered after the fact (e.g. output tokens)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.balance = max(-self.capacity, self.balance - float(amount))
+
+
+class SharedSlots:
+    """
+    Counting semaphore shared by threads and event loops: a blocked thread
+    waits on an Event, a blocked coroutine on a future of its own loop.
+    Waiters are served first come, first served whichever kind they are, so
+    every caller in the process counts against the same limit.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._free = size
+        self._lock = threading.Lock()
+        self._waiters: deque = deque()   # threading.Event or (loop, future)
+
+    def acquire(self):
+        with self._lock:
+            if self._free > 0 and not self._waiters:
+                self._free -= 1
+                return
+            event = threading.Event()
+            self._waiters.append(event)
+        event.wait()   # release() hands the slot over directly
+
+    async def acquire_async(self):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._free > 0 and not self._waiters:
+                self._free -= 1
+                return
+            fut = loop.create_future()
+            waiter = (loop, fut)
+            self._waiters.append(waiter)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            with self._lock:
+                queued = waiter in self._waiters
+                if queued:
+                    self._waiters.remove(waiter)
+            if not queued and fut.done() and not fut.cancelled():
+                self.release()   # the slot was handed over just before the cancel
+            raise
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, fut = waiter
+                try:
+                    loop.call_soon_threadsafe(self._hand_over, fut)
+                    return
+                except RuntimeError:
+                    continue   # that loop is closed; try the next waiter
+            self._free += 1
+
+    def _hand_over(self, fut):
+        if fut.cancelled():
+            self.release()
+        else:
+            fut.set_result(None)
+
+    @property
+    def in_use(self) -> int:
+        with self._lock:
+            return self.size - self._free
+
+
+class RateLimiter:
+    """
+    Process-wide limiter for model calls: requests/minute, tokens/minute and a
+    concurrency cap. Sync callers use slot()/acquire(); asyncio callers use
+    async_slot()/acquire_async(). Both kinds of slot come from one
+    SharedSlots, so threads and every event loop (run_sync starts a new one
+    per call) share a single LLM_MAX_CONCURRENCY. Slots are not nested: code
+    already holding one (including asyncio.to_thread work started under
+    async_slot) passes through. A limit of 0 disables that dimension.
+    """
+
+    def __init__(self, rpm: int = 0, tpm: int = 0, max_concurrency: int = 0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self._requests = TokenBucket(rpm) if rpm else None
+        self._tokens = TokenBucket(tpm) if tpm else None
+        self._slots = SharedSlots(max_concurrency) if max_concurrency else None
+        self._stats_lock = threading.Lock()
+        self.stats = {"requests": 0, "throttled": 0, "waited_seconds": 0.0}
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        return cls(
+            rpm=int(os.getenv("LLM_RPM", "60")),
+            tpm=int(os.getenv("LLM_TPM", "1000000")),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "4")),
+        )
+
+    # ---------------------------------------------------------
+    # RATE
+    # ---------------------------------------------------------
+    def _reserve(self, tokens: int) -> float:
+        wait = 0.0
+        if self._requests is not None:
+            wait = max(wait, self._requests.reserve(1))
+        if self._tokens is not None and tokens:
+            wait = max(wait, self._tokens.reserve(tokens))
+        with self._stats_lock:
+            self.stats["requests"] += 1
+            if wait > 0:
+                self.stats["throttled"] += 1
+                self.stats["waited_seconds"] += wait
+        if wait > 0:
+            logger.info("RateLimiter: throttling for %.2fs", wait)
+        return wait
+
+    def acquire(self, tokens: int = 0):
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: int = 0):
+        wait = self._reserve(tokens)
+        if wait > 0:
+            import asyncio
+            await asyncio.sleep(wait)
+
+    def record_tokens(self, tokens: int):
+        if self._tokens is not None and tokens:
+            self._tokens.debit(tokens)
+
+    # ---------------------------------------------------------
+    # CONCURRENCY
+    # ---------------------------------------------------------
+    @contextlib.contextmanager
+    def slot(self):
+        if self._slots is None or _holding_slot.get():
+            yield
+            return
+        self._slots.acquire()
+        token = _holding_slot.set(True)
+        try:
+            yield
+        finally:
+            _holding_slot.reset(token)
+            self._slots.release()
+
+    @contextlib.asynccontextmanager
+    async def async_slot(self):
+        if self._slots is None or _holding_slot.get():
+            yield
+            return
+        await self._slots.acquire_async()
+        token = _holding_slot.set(True)
+        try:
+            yield
+        finally:
+            _holding_slot.reset(token)
+            self._slots.release()
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Limiter shared by every LMClient in the process (configured from LLM_RPM/LLM_TPM/LLM_MAX_CONCURRENCY)."""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter.from_env()
+        return _limiter
+
+
+def configure_rate_limiter(rpm: Optional[int] = None, tpm: Optional[int] = None, max_concurrency: Optional[int] = None) -> RateLimiter:
+    """Replace the shared limiter, keeping any setting that is not given."""
+    global _limiter
+    with _limiter_lock:
+        base = _limiter or RateLimiter.from_env()
+        _limiter = RateLimiter(
+            rpm=base.rpm if rpm is None else rpm,
+            tpm=base.tpm if tpm is None else tpm,
+            max_concurrency=base.max_concurrency if max_concurrency is None else max_concurrency,
+        )
+        return _limiter
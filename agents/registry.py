@@ -0,0 +1,145 @@
+# agents/registry.py
+import hashlib
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Env vars that affect how clients/agents are built; a change invalidates the registry
+CONFIG_KEYS = (
+    "GOOGLE_API_KEY",
+    "GENAI_API_KEY",
+    "GEMINI_MODEL",
+    "FIGMA_TOKEN",
+    "JIRA_BASE",
+    "JIRA_USER",
+    "JIRA_API_TOKEN",
+    "LLM_CACHE",
+    "LLM_CACHE_DB",
+)
+
+
+def config_fingerprint() -> str:
+    """Short hash of the config env vars, usable as a cache key."""
+    h = hashlib.sha256()
+    for key in CONFIG_KEYS:
+        h.update(f"{key}={os.getenv(key, '')}\0".encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+class per_thread:
+    """
+    Instance attribute kept per thread. Agents from the registry are shared
+    by Streamlit sessions and batch threads, so per-call reports
+    (last_*_report) use this: each thread reads back what its own last call
+    stored, and concurrent stories cannot overwrite each other's reports.
+    """
+
+    def __init__(self, default: Callable[[], Any] = dict):
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.slot = f"_per_thread_{name}"
+
+    def _local(self, obj) -> threading.local:
+        local = obj.__dict__.get(self.slot)
+        if local is None:
+            local = obj.__dict__.setdefault(self.slot, threading.local())
+        return local
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        local = self._local(obj)
+        if not hasattr(local, "value"):
+            local.value = self.default()
+        return local.value
+
+    def __set__(self, obj, value):
+        self._local(obj).value = value
+
+
+class ResourceRegistry:
+    """
+    Thread-safe, process-wide store of expensive shared objects
+    (LMClient, PersistentMemory, agents). Objects are built once per
+    config fingerprint and rebuilt after invalidate() or an env change.
+
+    Dropping an object only forgets it: agents built earlier (and calls
+    still running on them) may hold the same memory or client, so nothing
+    is closed here. SQLite connections are released once the last
+    reference goes away.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._items: Dict[str, Any] = {}
+        self._fingerprint: Optional[str] = None
+
+    def get(self, name: str, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            fp = config_fingerprint()
+            if fp != self._fingerprint:
+                if self._items:
+                    logger.info("ResourceRegistry: config changed, rebuilding resources")
+                self._items.clear()
+                self._fingerprint = fp
+            if name not in self._items:
+                self._items[name] = factory()
+            return self._items[name]
+
+    def invalidate(self, name: Optional[str] = None):
+        with self._lock:
+            if name is None:
+                self._items.clear()
+            else:
+                self._items.pop(name, None)
+
+
+registry = ResourceRegistry()
+
+
+# ---------------------------------------------------------
+# SHARED RESOURCES
+# ---------------------------------------------------------
+def get_llm_client():
+    from .llm_client import LMClient
+    return registry.get("lm", LMClient)
+
+
+def get_memory():
+    from memory.persistent import PersistentMemory
+    return registry.get("memory", PersistentMemory)
+
+
+def get_requirement_agent():
+    from .requirement_agent import RequirementAgent
+    return registry.get("requirement_agent", lambda: RequirementAgent(lm=get_llm_client()))
+
+
+def get_testcase_agent():
+    from .testcase_agent import TestCaseAgent
+    return registry.get("testcase_agent", lambda: TestCaseAgent(lm=get_llm_client(), memory=get_memory()))
+
+
+def get_automation_agent():
+    from .automation_agent import AutomationAgent
+    return registry.get("automation_agent", lambda: AutomationAgent(lm=get_llm_client(), memory=get_memory()))
+
+
+def get_execution_agent():
+    from .execution_agent import ExecutionAgent
+    return registry.get("execution_agent", lambda: ExecutionAgent(memory=get_memory()))
+
+
+def get_jira_agent():
+    from .jira_agent import JiraAgent
+    return registry.get("jira_agent", JiraAgent)
+
+
+def get_figma_tool():
+    from tools.figma_tool import FigmaTool
+    return registry.get("figma_tool", lambda: FigmaTool(token=os.getenv("FIGMA_TOKEN")))
@@ -1,19 +1,31 @@
 
 import json
+from .image_batch import analyze_images
 from .llm_client import LMClient
-from .vision_agent import VisionAgent
+from .registry import per_thread
 
 class RequirementAgent:
+    # Per-image records of the calling thread's last analyze() (the agent is shared)
+    last_image_report = per_thread(list)
+
     def __init__(self, lm=None):
         self.lm = lm or LMClient()
-        self.vision = VisionAgent()
+        self._vision = None
+
+    @property
+    def vision(self):
+        """VisionAgent, created only when a story comes with screenshots."""
+        if self._vision is None:
+            from .vision_agent import VisionAgent
+            self._vision = VisionAgent()
+        return self._vision
 
     def analyze(self, story_text: str, image_paths=None):
         image_context = []
 
         if image_paths:
-            for img in image_paths:
-                image_context.append(self.vision.analyze_image(img))
+            # Screens are analyzed concurrently; per-image latency/errors land in last_image_report
+            image_context, self.last_image_report = analyze_images(self.vision, image_paths)
 
         prompt = f"""
 Extract feature details from the story and return STRICT JSON:
@@ -40,4 +52,4 @@ Extract feature details from the story and return STRICT JSON:
         try:
             return json.loads(raw)
         except:
-            return {"feature_id": "feat_demo", "title": "Unknown Feature", "screens": image_context}
\ No newline at end of file
+            return {"feature_id": "feat_demo", "title": "Unknown Feature", "screens": image_context, "fallback": True}
\ No newline at end of file
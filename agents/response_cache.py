@@ -0,0 +1,242 @@
+# agents/response_cache.py
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Default for LLM_CACHE_DB; the env var is read when a cache is built, after .env is loaded
+CACHE_DB_PATH = "llm_cache.db"
+
+# Responses starting with one of these markers are failures, never cache them
+UNCACHEABLE_PREFIXES = ("[genai_error]",)
+
+# Applied to every connection on the cache DB (shared with ImageCache); WAL and
+# busy_timeout let concurrent processes read and write without "database is locked"
+CACHE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+def connect_cache_db(db_path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(db_path, timeout=5.0, check_same_thread=False)
+    for pragma in CACHE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def make_cache_key(model_name: str, prompt: Any, max_output_tokens: int, generation_config: Dict[str, Any]) -> str:
+    """Content address for a generation request (sha256 over a canonical JSON payload)."""
+    payload = json.dumps(
+        {
+            "model": model_name,
+            "prompt": prompt,
+            "max_output_tokens": max_output_tokens,
+            "config": generation_config,
+        },
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_cacheable(text: Optional[str]) -> bool:
+    if not text:
+        return False
+    return not text.lstrip().startswith(UNCACHEABLE_PREFIXES)
+
+
+class ResponseCache:
+    """
+    Two-tier cache for LLM responses.
+
+    - memory tier: bounded LRU (OrderedDict), process local
+    - disk tier: SQLite table with TTL and size-based eviction (oldest access first)
+
+    Keys come from make_cache_key(); values are the raw response text.
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        max_memory_items: int = 256,
+        max_disk_items: int = 5000,
+        ttl_seconds: float = 7 * 24 * 3600,
+    ):
+        self.db_path = db_path or os.getenv("LLM_CACHE_DB", CACHE_DB_PATH)
+        self.max_memory_items = max_memory_items
+        self.max_disk_items = max_disk_items
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.RLock()
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self.stats = {"hits": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+        self.conn = None
+        if self.db_path:
+            try:
+                self.conn = connect_cache_db(self.db_path)
+                self._ensure_tables()
+            except Exception:
+                logger.exception("ResponseCache: disk tier unavailable, using memory only")
+                self.conn = None
+
+    def _ensure_tables(self):
+        cur = self.conn.cursor()
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key TEXT PRIMARY KEY,
+                response TEXT,
+                created_at REAL,
+                accessed_at REAL
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_accessed ON llm_cache (accessed_at)")
+        self.conn.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional["ResponseCache"]:
+        """Build a cache from LLM_CACHE_* env vars, or None if LLM_CACHE=0."""
+        if os.getenv("LLM_CACHE", "1").lower() in ("0", "false", "no", "off"):
+            return None
+        return cls(
+            db_path=os.getenv("LLM_CACHE_DB", CACHE_DB_PATH),
+            max_memory_items=int(os.getenv("LLM_CACHE_MEMORY_ITEMS", "256")),
+            max_disk_items=int(os.getenv("LLM_CACHE_DISK_ITEMS", "5000")),
+            ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600))),
+        )
+
+    # ---------------------------------------------------------
+    # LOOKUP / STORE
+    # ---------------------------------------------------------
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created_at = entry
+                if self._fresh(created_at, now) and is_cacheable(value):
+                    self._memory.move_to_end(key)
+                    self.stats["hits"] += 1
+                    self.stats["memory_hits"] += 1
+                    return value
+                del self._memory[key]
+
+            value = self._disk_get(key, now)
+            if value is not None:
+                self.stats["hits"] += 1
+                self.stats["disk_hits"] += 1
+                return value
+
+            self.stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: str):
+        if not is_cacheable(value):
+            return
+        now = time.time()
+        with self._lock:
+            self._memory_put(key, value, now)
+            self.stats["stores"] += 1
+            if self.conn is None:
+                return
+            try:
+                self.conn.execute(
+                    "REPLACE INTO llm_cache (key, response, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                self._evict_disk(now)
+                self.conn.commit()
+            except Exception:
+                logger.exception("ResponseCache: disk write failed (non-fatal)")
+
+    def invalidate(self, key: str):
+        with self._lock:
+            self._memory.pop(key, None)
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self.conn is not None:
+                self.conn.execute("DELETE FROM llm_cache")
+                self.conn.commit()
+
+    def hit_rate(self) -> float:
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+    # ---------------------------------------------------------
+    # INTERNALS
+    # ---------------------------------------------------------
+    def _fresh(self, created_at: float, now: float) -> bool:
+        return not self.ttl_seconds or (now - created_at) <= self.ttl_seconds
+
+    def _memory_put(self, key: str, value: str, created_at: float):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _disk_get(self, key: str, now: float) -> Optional[str]:
+        if self.conn is None:
+            return None
+        try:
+            row = self.conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            value, created_at = row
+            if not self._fresh(created_at, now) or not is_cacheable(value):
+                self.conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            self.conn.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self._memory_put(key, value, created_at)
+            return value
+        except Exception:
+            logger.exception("ResponseCache: disk read failed (non-fatal)")
+            return None
+
+    def _evict_disk(self, now: float):
+        cur = self.conn.cursor()
+        if self.ttl_seconds:
+            cur.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+            self.stats["evictions"] += max(cur.rowcount, 0)
+        if self.max_disk_items:
+            cur.execute(
+                "DELETE FROM llm_cache WHERE key IN ("
+                "  SELECT key FROM llm_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?"
+                ")",
+                (self.max_disk_items,),
+            )
+            self.stats["evictions"] += max(cur.rowcount, 0)
+
+
+_shared_cache: Optional[ResponseCache] = None
+_shared_lock = threading.Lock()
+_shared_built = False
+
+
+def get_shared_cache() -> Optional[ResponseCache]:
+    """Process-wide cache shared by every LMClient (None when disabled via LLM_CACHE=0)."""
+    global _shared_cache, _shared_built
+    with _shared_lock:
+        if not _shared_built:
+            _shared_cache = ResponseCache.from_env()
+            _shared_built = True
+        return _shared_cache
@@ -0,0 +1,68 @@
+# agents/step_snippets.py
+import ast
+import hashlib
+import re
+from typing import Any, List, Tuple
+
+_KEYWORD = re.compile(r"^(?:given|when|then|and|but|\*)\s+", re.IGNORECASE)
+_NUMBERING = re.compile(r"^(?:step\s*)?\d+\s*[.):-]\s*", re.IGNORECASE)
+_QUOTED = re.compile(r'"([^"]*)"|“([^”]*)”|(?<!\w)\'([^\']*)\'(?!\w)')
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?![\w.])")
+
+
+def normalize_step(text: str) -> Tuple[str, List[Any]]:
+    """
+    Split a step into a template and its arguments: the Gherkin keyword and
+    list numbering are dropped, quoted values become {0}, {1}... (str) and
+    bare numbers become placeholders too (int / float); the rest is
+    lowercased with whitespace collapsed and trailing punctuation removed.
+
+        'When I enter "bob" into "Email".'  ->  ('i enter {0} into {1}', ['bob', 'Email'])
+    """
+    text = _NUMBERING.sub("", _KEYWORD.sub("", (text or "").strip()))
+    args: List[Any] = []
+    parts: List[str] = []
+    pos = 0
+    for m in _QUOTED.finditer(text):
+        parts.append(_numbers(text[pos:m.start()], args))
+        parts.append("{%d}" % len(args))
+        args.append(next(g for g in m.groups() if g is not None))
+        pos = m.end()
+    parts.append(_numbers(text[pos:], args))
+    template = re.sub(r"\s+", " ", "".join(parts)).strip().rstrip(".;:!").strip().lower()
+    return template, args
+
+
+def _numbers(chunk: str, args: List[Any]) -> str:
+    def _sub(m):
+        args.append(float(m.group(0)) if "." in m.group(0) else int(m.group(0)))
+        return "{%d}" % (len(args) - 1)
+    return _NUMBER.sub(_sub, chunk)
+
+
+def step_fingerprint(text: str) -> str:
+    """Cache key for a step: a hash of its normalize_step() template."""
+    return hashlib.sha256(normalize_step(text)[0].encode("utf-8")).hexdigest()[:16]
+
+
+class _BindArgs(ast.NodeTransformer):
+    def __init__(self, args: List[Any]):
+        self.args = args
+
+    def visit_Name(self, node):
+        m = re.fullmatch(r"arg(\d+)", node.id)
+        if m and isinstance(node.ctx, ast.Load) and int(m.group(1)) < len(self.args):
+            return ast.copy_location(ast.Constant(self.args[int(m.group(1))]), node)
+        return node
+
+
+def bind_snippet(code: str, args: List[Any]) -> str:
+    """
+    Instantiate a cached snippet for one step: the names arg0, arg1... in it
+    are replaced by that step's argument values. Code without such names is
+    returned unchanged.
+    """
+    if not args or not re.search(r"\barg\d+\b", code):
+        return code
+    tree = _BindArgs(args).visit(ast.parse(code))
+    return ast.unparse(ast.fix_missing_locations(tree))
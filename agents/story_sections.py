@@ -0,0 +1,74 @@
+# agents/story_sections.py
+import hashlib
+import json
+import re
+from typing import Any, Dict, Iterable, List, Set
+
+from memory.index import as_text, tokenize
+
+_HEADING = re.compile(r"^\s*(?:#{1,6}\s*(.+?)\s*#*|([A-Za-z][\w /&-]{1,60}):)\s*$")
+_ITEM = re.compile(r"^\s*(?:\d+[.)]|[-*•])\s+(.*)$")
+
+# Words too generic to tie a story section to one flow or screen
+_GENERIC = {"the", "and", "for", "with", "from", "into", "user", "users", "page", "screen", "flow", "path",
+            "should", "must", "can", "when", "then", "given", "want", "able"}
+
+
+def fingerprint(value: Any) -> str:
+    """Short, whitespace- and case-insensitive content hash."""
+    text = value if isinstance(value, str) else json.dumps(value, sort_keys=True, ensure_ascii=False)
+    norm = re.sub(r"\s+", " ", text).strip().lower()
+    return hashlib.sha256(norm.encode("utf-8")).hexdigest()[:16]
+
+
+def split_story(text: str) -> List[Dict[str, str]]:
+    """
+    Split a story into stable sections: one per list item (acceptance
+    criteria, flows, screens...) and one per paragraph, each tagged with the
+    heading it sits under. Returns [{"section", "text", "fp"}] in story order.
+    """
+    sections: List[Dict[str, str]] = []
+    heading = "story"
+    para: List[str] = []
+
+    def _flush():
+        if para:
+            body = " ".join(para)
+            sections.append({"section": heading, "text": body, "fp": fingerprint(body)})
+            para.clear()
+
+    for line in (text or "").splitlines():
+        if not line.strip():
+            _flush()
+            continue
+        m = _HEADING.match(line)
+        if m and not _ITEM.match(line):
+            _flush()
+            heading = re.sub(r"[^a-z0-9]+", "_", (m.group(1) or m.group(2)).lower()).strip("_") or "story"
+            continue
+        item = _ITEM.match(line)
+        if item:
+            _flush()
+            para.append(item.group(1).strip())
+            _flush()
+        else:
+            para.append(line.strip())
+    _flush()
+    return sections
+
+
+def diff_sections(old: Iterable[Dict[str, str]], new: Iterable[Dict[str, str]]) -> Dict[str, List[Dict[str, str]]]:
+    """Compare two split_story() results by fingerprint (order-insensitive)."""
+    old, new = list(old or []), list(new or [])
+    old_fps = {s["fp"] for s in old}
+    new_fps = {s["fp"] for s in new}
+    return {
+        "added": [s for s in new if s["fp"] not in old_fps],
+        "removed": [s for s in old if s["fp"] not in new_fps],
+        "unchanged": [s for s in new if s["fp"] in old_fps],
+    }
+
+
+def keywords(value: Any) -> Set[str]:
+    """Distinctive words of a text / flow / screen, used to map story sections to slices."""
+    return {w for w in tokenize(as_text(value).replace("_", " ")) if len(w) > 2 and w not in _GENERIC}
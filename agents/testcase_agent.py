@@ -1,10 +1,18 @@
 # agents/testcase_agent.py
 import json
 import logging
+import os
 import re
-from typing import List, Dict, Any, Optional
-
-from agents.llm_client import LMClient
+import time
+from typing import Callable, List, Dict, Any, Optional
+
+from agents.image_batch import describe_images
+from agents.json_stream import TestCaseStreamParser, parse_test_cases
+from agents.llm_client import LMClient, run_sync
+from agents.prompt_budget import PromptBudgeter, PromptSection, compact_json
+from agents.rate_limiter import estimate_tokens
+from agents.registry import per_thread
+from agents.story_sections import diff_sections, fingerprint, keywords, split_story
 from memory.persistent import PersistentMemory
 
 logger = logging.getLogger(__name__)
@@ -12,26 +20,31 @@ logger.setLevel(logging.INFO)
 
 
 def extract_clean_json(raw: str) -> Any:
-    if not raw:
-        raise ValueError("Empty output")
+    """
+    Parse model output into {"feature_id", "test_cases"}.
+
+    Delegates to the streaming parser, so fenced output is handled and a
+    truncated response still yields every test case that was completed.
+    """
+    return parse_test_cases(raw)
+
 
-    cleaned = raw.strip()
-    cleaned = re.sub(r"^```(?:json|python)?\s*", "", cleaned, flags=re.IGNORECASE)
-    cleaned = re.sub(r"\s*```$", "", cleaned, flags=re.IGNORECASE)
+def _slug(value: Any) -> str:
+    return re.sub(r"[^A-Za-z0-9]+", "_", str(value)).strip("_").upper() or "X"
 
-    first = min([p for p in (cleaned.find("{"), cleaned.find("[")) if p != -1], default=None)
-    if first is None:
-        raise ValueError("No JSON found in model output")
 
-    opening = cleaned[first]
-    closing = "}" if opening == "{" else "]"
-    last = cleaned.rfind(closing)
-    candidate = cleaned[first:last+1] if last != -1 else cleaned[first:]
+def _name_of(item: Any) -> str:
+    if isinstance(item, dict):
+        return str(item.get("name") or item.get("id") or json.dumps(item, sort_keys=True))
+    return str(item)
 
-    # Remove trailing commas
-    candidate = re.sub(r",\s*(?=[}\]])", "", candidate)
 
-    return json.loads(candidate)
+def _title_key(tc: Dict[str, Any]) -> str:
+    return re.sub(r"\s+", " ", str(tc.get("title", ""))).strip().lower()
+
+
+def _env_flag(name: str) -> bool:
+    return os.getenv(name, "0").lower() in ("1", "true", "yes", "on")
 
 
 class TestCaseAgent:
@@ -40,11 +53,29 @@ class TestCaseAgent:
     uses persistent memory, and produces testcases.
     """
 
-    def __init__(self, lm: Optional[LMClient] = None, memory: Optional[PersistentMemory] = None):
+    FAN_OUT_TYPES = ["functional", "negative", "edge"]
+
+    # Reports of the calling thread's last call (the agent is shared across threads)
+    last_image_report = per_thread(list)
+    last_budget_report = per_thread(dict)
+    last_incremental_report = per_thread(dict)
+
+    def __init__(
+        self,
+        lm: Optional[LMClient] = None,
+        memory: Optional[PersistentMemory] = None,
+        prompt_budget: Optional[int] = None,
+        fan_out: Optional[bool] = None,
+        split_by_type: Optional[bool] = None,
+    ):
         self.lm = lm or LMClient()
         self.memory = memory or PersistentMemory()
+        self.budgeter = PromptBudgeter(prompt_budget or int(os.getenv("TESTCASE_PROMPT_BUDGET", "6000")))
+        # Defaults for generate(); the CLI (--fan-out) and the UI can override them per call
+        self.fan_out = fan_out if fan_out is not None else _env_flag("TESTCASE_FAN_OUT")
+        self.split_by_type = split_by_type if split_by_type is not None else _env_flag("TESTCASE_SPLIT_BY_TYPE")
 
-    def _build_prompt(self, feature: Dict[str, Any], stored_context: Dict[str, Any], clarifications: Optional[Dict[str, Any]] = None, image_descriptions: Optional[List[str]] = None) -> str:
+    def _build_prompt(self, feature: Dict[str, Any], stored_context: Dict[str, Any], clarifications: Optional[Dict[str, Any]] = None, image_descriptions: Optional[List[str]] = None, focus: Optional[Dict[str, Any]] = None, similar_cases: Optional[List[Dict[str, Any]]] = None) -> str:
         schema = {
             "feature_id": "string",
             "test_cases": [
@@ -60,11 +91,25 @@ class TestCaseAgent:
             ]
         }
 
-        clar_text = json.dumps(clarifications, indent=2) if clarifications else "{}"
-        stored_text = json.dumps(stored_context, indent=2) if stored_context else "None"
-        images_text = "\n".join(f"- {d}" for d in image_descriptions) if image_descriptions else "None"
-
-        prompt = f"""
+        focus_text = ""
+        if focus:
+            scope = ", ".join(f"{k} = {v}" for k, v in focus.items())
+            focus_text = f"\nSCOPE:\nGenerate test cases ONLY for: {scope}. Other parts of the feature are covered separately.\n"
+
+        sections = [
+            PromptSection("schema", schema, required=True),
+            PromptSection("feature", feature, required=True),
+            PromptSection("clarifications", clarifications, priority=1, empty="{}"),
+            PromptSection("images", image_descriptions, priority=2, render=lambda v: "\n".join(f"- {d}" for d in v)),
+            PromptSection(
+                "similar",
+                [{k: c.get(k) for k in ("title", "steps", "expected")} for c in similar_cases or []],
+                priority=3,
+                render=lambda v: "\n".join("- " + compact_json(c) for c in v),
+            ),
+            PromptSection("stored", stored_context, priority=4),
+        ]
+        template = """
 You are a senior QA engineer. Generate comprehensive test cases for the given feature.
 
 IMPORTANT RULES:
@@ -72,23 +117,30 @@ IMPORTANT RULES:
 - Use double quotes, no trailing commas.
 
 SCHEMA:
-{json.dumps(schema, indent=2)}
+{schema}
 
 FEATURE:
-{json.dumps(feature, indent=2)}
+{feature}
 
 STORED MEMORY (prior runs / context):
-{stored_text}
+{stored}
+
+SIMILAR PRIOR TEST CASES (other features; reuse their patterns, not their IDs):
+{similar}
 
 IMAGE DESCRIPTIONS:
-{images_text}
+{images}
 
 USER CLARIFICATIONS:
-{clar_text}
+{clarifications}
 
+{focus}
 Now produce a JSON object that contains 'feature_id' and 'test_cases' as per the schema.
 Keep test cases concise. For automation_feasible prefer 'ui' or 'api' or 'no'.
 """
+        overhead = estimate_tokens(template) + estimate_tokens(focus_text)
+        texts, self.last_budget_report = self.budgeter.fit(sections, overhead_tokens=overhead)
+        prompt = template.format(focus=focus_text, **texts)
         return prompt.strip()
 
     def generate(
@@ -97,26 +149,50 @@ Keep test cases concise. For automation_feasible prefer 'ui' or 'api' or 'no'.
         image_paths: Optional[List[str]] = None,
         image_descriptions: Optional[List[str]] = None,
         clarifications: Optional[Dict[str, Any]] = None,
+        fan_out: Optional[bool] = None,
+        split_by_type: Optional[bool] = None,
+        on_test_case: Optional[Callable[[Dict[str, Any]], None]] = None,
     ) -> Dict[str, Any]:
+        """
+        Generate test cases for a feature.
+
+        With fan_out=True the feature is split into one slice per flow/screen
+        (and per test type if split_by_type=True); slices are generated
+        concurrently and merged by _merge_slices(). Both default to the
+        agent's settings (TESTCASE_FAN_OUT / TESTCASE_SPLIT_BY_TYPE).
 
-        feature_id = feature.get("feature_id", f"feat_{int(__import__('time').time())}")
+        on_test_case, if given, is called with each test case as soon as it
+        is available (streamed from the model in single-prompt mode).
+        """
+
+        feature_id = feature.get("feature_id", f"feat_{int(time.time())}")
+        fan_out = self.fan_out if fan_out is None else fan_out
+        split_by_type = self.split_by_type if split_by_type is None else split_by_type
 
         # Load memory if available
         stored = self.memory.get_feature(feature_id) or {}
+        similar = self._similar_cases(feature, feature_id)
 
-        # If image_paths are provided, generate descriptions via LMClient (best-effort)
+        # If image_paths are provided, generate descriptions via LMClient (best-effort, concurrent)
         if image_paths and not image_descriptions:
-            image_descriptions = []
-            for p in image_paths:
-                try:
-                    image_descriptions.append(self.lm.describe_image(p))
-                except Exception:
-                    image_descriptions.append(f"[desc_failed] {p}")
+            image_descriptions, self.last_image_report = describe_images(self.lm, image_paths)
+
+        slices = self._plan_slices(feature, split_by_type) if fan_out else []
+        if len(slices) > 1:
+            parsed = run_sync(self._generate_fan_out(feature_id, feature, stored, clarifications, image_descriptions, slices, similar))
+            if on_test_case:
+                for tc in parsed.get("test_cases", []):
+                    on_test_case(tc)
+            self._persist(feature_id, feature, parsed)
+            return parsed
 
-        prompt = self._build_prompt(feature, stored, clarifications, image_descriptions)
+        prompt = self._build_prompt(feature, stored, clarifications, image_descriptions, similar_cases=similar)
 
         logger.info("TestCaseAgent: sending prompt (len=%d)", len(prompt))
-        raw = self.lm.generate(prompt, max_output_tokens=4096)
+        if on_test_case:
+            raw = self._generate_streaming(prompt, on_test_case)
+        else:
+            raw = self.lm.generate(prompt, max_output_tokens=4096)
         logger.info("TestCaseAgent: raw output (first 500 chars): %s", raw[:500])
 
         parsed = None
@@ -135,20 +211,295 @@ Keep test cases concise. For automation_feasible prefer 'ui' or 'api' or 'no'.
                 logger.error("TestCaseAgent: retry parse failed: %s", e2)
                 parsed = self._fallback(feature)
 
-        # Persist feature + testcases
+        if isinstance(parsed, dict) and not parsed.get("feature_id"):
+            parsed["feature_id"] = feature_id
+
+        self._persist(feature_id, feature, parsed)
+        return parsed
+
+    def _similar_cases(self, feature: Dict[str, Any], feature_id: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Most similar test cases from other stored features (best-effort)."""
+        try:
+            return self.memory.similar_features(feature, k=k, kind="test_case", exclude_feature_id=feature_id)
+        except Exception:
+            logger.exception("TestCaseAgent: similarity lookup failed (non-fatal)")
+            return []
+
+    def _generate_streaming(self, prompt: str, on_test_case: Callable[[Dict[str, Any]], None]) -> str:
+        parser = TestCaseStreamParser()
+        parts = []
+        for chunk in self.lm.generate_stream(prompt, max_output_tokens=4096):
+            parts.append(chunk)
+            for tc in parser.feed(chunk):
+                on_test_case(tc)
+        return "".join(parts)
+
+    def _persist(self, feature_id: str, feature: Dict[str, Any], parsed: Optional[Dict[str, Any]]):
+        # Persist feature + testcases in one transaction. A fallback (the model
+        # failed) is not stored, so it never becomes the "previous" test cases
         try:
-            self.memory.save_feature(feature_id, feature)
-            if parsed:
-                self.memory.save_feature(f"{feature_id}_tcs", parsed)
+            with self.memory.batch():
+                self.memory.save_feature(feature_id, feature)
+                if parsed and not parsed.get("fallback"):
+                    self.memory.save_feature(f"{feature_id}_tcs", parsed)
         except Exception:
             logger.exception("Failed to save memory (non-fatal)")
 
+    # ---------------------------------------------------------
+    # FAN-OUT GENERATION
+    # ---------------------------------------------------------
+    def _plan_slices(self, feature: Dict[str, Any], split_by_type: bool = False) -> List[Dict[str, Any]]:
+        """One slice per flow, then per screen; optionally crossed with test types."""
+        slices = []
+        seen = set()
+        used_keys = set()
+        for kind, items in (("flow", feature.get("flows") or []), ("screen", feature.get("screens") or [])):
+            for item in items:
+                name = _name_of(item)
+                if (kind, name) in seen:
+                    continue
+                seen.add((kind, name))
+                key = base = _slug(name)
+                n = 1
+                while key in used_keys:
+                    n += 1
+                    key = f"{base}_{n}"
+                used_keys.add(key)
+                slices.append({"key": key, "focus": {kind: name}, "item": item})
+
+        if split_by_type and slices:
+            slices = [
+                {"key": f"{s['key']}_{_slug(t)}", "focus": dict(s["focus"], type=t), "item": s["item"]}
+                for s in slices
+                for t in self.FAN_OUT_TYPES
+            ]
+        return slices
+
+    async def _generate_slice(self, prompt: str, key: str) -> List[Dict[str, Any]]:
+        started = time.perf_counter()
+        raw = await self.lm.agenerate(prompt, max_output_tokens=2048)
+        try:
+            parsed = extract_clean_json(raw)
+        except Exception as e:
+            logger.warning("TestCaseAgent: slice %s parse failed, retrying with strict prompt: %s", key, e)
+            raw = await self.lm.agenerate("OUTPUT ONLY VALID JSON (NO MARKDOWN). REPEAT your JSON now.\n\n" + prompt, max_output_tokens=2048)
+            try:
+                parsed = extract_clean_json(raw)
+            except Exception as e2:
+                logger.error("TestCaseAgent: slice %s retry parse failed: %s", key, e2)
+                return []
+        logger.info("TestCaseAgent: slice %s done in %.2fs", key, time.perf_counter() - started)
+        items = parsed.get("test_cases", []) if isinstance(parsed, dict) else parsed
+        return [tc for tc in items or [] if isinstance(tc, dict)]
+
+    async def _run_slices(self, feature, stored, clarifications, image_descriptions, slices, similar=None) -> List[List[Dict[str, Any]]]:
+        import asyncio
+        prompts = [
+            self._build_prompt(feature, stored, clarifications, image_descriptions, focus=s["focus"], similar_cases=similar)
+            for s in slices
+        ]
+        logger.info("TestCaseAgent: fan-out over %d slices", len(slices))
+        return list(await asyncio.gather(*(self._generate_slice(p, s["key"]) for p, s in zip(prompts, slices))))
+
+    async def _generate_fan_out(self, feature_id, feature, stored, clarifications, image_descriptions, slices, similar=None) -> Dict[str, Any]:
+        results = await self._run_slices(feature, stored, clarifications, image_descriptions, slices, similar)
+        merged = self._merge_slices(feature_id, slices, results)
+        if not merged["test_cases"]:
+            return self._fallback(feature)
+        return merged
+
+    def _merge_slices(self, feature_id: str, slices: List[Dict[str, Any]], results: List[List[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Merge slice outputs in plan order. IDs are rewritten to
+        {feature_id}_{slice}_TC_{nn} so they are collision-free and stable
+        for the same output; test cases with an already-seen title are dropped.
+        """
+        merged = []
+        seen_titles = set()
+        for s, items in zip(slices, results):
+            n = 0
+            for tc in items:
+                title_key = _title_key(tc)
+                if title_key and title_key in seen_titles:
+                    continue
+                seen_titles.add(title_key)
+                n += 1
+                tc = dict(tc)
+                tc["id"] = f"{feature_id}_{s['key']}_TC_{n:02d}"
+                for k, v in s["focus"].items():
+                    tc.setdefault(k, v)
+                merged.append(tc)
+        return {"feature_id": feature_id, "test_cases": merged}
+
+    # ---------------------------------------------------------
+    # INCREMENTAL REGENERATION
+    # ---------------------------------------------------------
+    def generate_incremental(
+        self,
+        feature: Dict[str, Any],
+        story_text: Optional[str] = None,
+        image_paths: Optional[List[str]] = None,
+        image_descriptions: Optional[List[str]] = None,
+        clarifications: Optional[Dict[str, Any]] = None,
+        split_by_type: Optional[bool] = None,
+    ) -> Dict[str, Any]:
+        """
+        Regenerate only the flows/screens affected by a change.
+
+        The feature is planned into the same slices as fan-out generation and
+        each slice is fingerprinted. A slice is regenerated when its
+        fingerprint differs from the stored manifest, or when a changed story
+        section (story_text is split and diffed against the stored copy)
+        mentions it; a change that mentions no slice, or new clarifications /
+        images, regenerates all of them. Test cases of untouched slices are
+        kept as stored; regenerated ones keep the ID of the stored test case
+        with the same title. Without a stored manifest this is a full fan-out
+        run. What happened is recorded in last_incremental_report.
+        """
+        feature_id = feature.get("feature_id", f"feat_{int(time.time())}")
+        split_by_type = self.split_by_type if split_by_type is None else split_by_type
+        slices = self._plan_slices(feature, split_by_type)
+        if not slices:
+            self.last_incremental_report = {"mode": "full", "regenerated": [], "reused": [], "removed": 0, "failed": []}
+            return self.generate(feature, image_paths, image_descriptions, clarifications)
+
+        if image_paths and not image_descriptions:
+            image_descriptions, self.last_image_report = describe_images(self.lm, image_paths)
+        fps = {sl["key"]: self._slice_fingerprint(feature, sl) for sl in slices}
+        context_fp = fingerprint([clarifications or {}, image_descriptions or []])
+        sections = split_story(story_text) if story_text else None
+
+        previous = self.memory.get_feature(f"{feature_id}_tcs") or {}
+        manifest = self.memory.get_feature(f"{feature_id}_manifest") or {}
+        full = (
+            not previous.get("test_cases")
+            or manifest.get("split_by_type") != split_by_type
+            or manifest.get("context") != context_fp
+        )
+
+        changed_sections = 0
+        if full:
+            dirty = set(fps)
+        else:
+            dirty = {k for k, fp in fps.items() if (manifest.get("slices") or {}).get(k) != fp}
+            if sections is not None and manifest.get("sections") is not None:
+                diff = diff_sections(manifest["sections"], sections)
+                for sec in diff["added"] + diff["removed"]:
+                    changed_sections += 1
+                    # A change that names no flow/screen could affect any of them
+                    dirty |= self._slices_for_text(sec["text"], slices) or set(fps)
+
+        todo = [sl for sl in slices if sl["key"] in dirty]
+        results: List[List[Dict[str, Any]]] = []
+        if todo:
+            stored = self.memory.get_feature(feature_id) or {}
+            similar = self._similar_cases(feature, feature_id)
+            results = run_sync(self._run_slices(feature, stored, clarifications, image_descriptions, todo, similar))
+
+        parsed, report = self._splice(feature_id, slices, previous.get("test_cases") or [], dict(zip([sl["key"] for sl in todo], results)))
+        if not parsed["test_cases"]:
+            parsed = self._fallback(feature)
+        report.update(mode="full" if full else "incremental", sections_changed=changed_sections)
+        self.last_incremental_report = report
+        logger.info("TestCaseAgent: incremental %s: regenerated %d/%d slices (%d failed)",
+                    report["mode"], len(report["regenerated"]), len(slices), len(report["failed"]))
+
+        # Failed slices keep their stored test cases, so their old fingerprint stays valid
+        slice_fps = {k: ((manifest.get("slices") or {}).get(k) if k in report["failed"] else fp) for k, fp in fps.items()}
+        manifest = {"split_by_type": split_by_type, "context": context_fp, "slices": slice_fps,
+                    "sections": sections if sections is not None else manifest.get("sections")}
+        self._persist(feature_id, feature, parsed)
+        if parsed.get("fallback"):
+            # Nothing was stored, so the old manifest still describes the stored test cases
+            return parsed
+        try:
+            self.memory.save_feature(f"{feature_id}_manifest", manifest)
+        except Exception:
+            logger.exception("Failed to save incremental manifest (non-fatal)")
         return parsed
 
+    @staticmethod
+    def _slice_fingerprint(feature: Dict[str, Any], sl: Dict[str, Any]) -> str:
+        """The slice's own flow/screen definition plus the feature context every slice shares."""
+        shared = {k: v for k, v in feature.items() if k not in ("flows", "screens", "feature_id")}
+        return fingerprint({"item": sl.get("item"), "focus": sl["focus"], "shared": shared})
+
+    @staticmethod
+    def _slices_for_text(text: str, slices: List[Dict[str, Any]]) -> set:
+        """Keys of the slices whose flow/screen shares the most distinctive words with text."""
+        words = keywords(text)
+        scores = {sl["key"]: len(words & keywords(sl.get("item") or sl["focus"])) for sl in slices}
+        best = max(scores.values(), default=0)
+        return {k for k, v in scores.items() if v == best} if best else set()
+
+    def _slice_of(self, feature_id: str, tc: Dict[str, Any], slices: List[Dict[str, Any]]) -> Optional[str]:
+        tc_id = str(tc.get("id", ""))
+        for sl in slices:
+            if tc_id.startswith(f"{feature_id}_{sl['key']}_TC_"):
+                return sl["key"]
+        for sl in slices:
+            if all(tc.get(k) == v for k, v in sl["focus"].items()):
+                return sl["key"]
+        return None
+
+    def _splice(self, feature_id: str, slices: List[Dict[str, Any]], previous: List[Dict[str, Any]], fresh: Dict[str, List[Dict[str, Any]]]):
+        """
+        Rebuild the test case list in plan order: stored test cases for
+        untouched slices, new ones for regenerated slices. A regenerated test
+        case reuses the stored ID of the same-titled test case in its slice;
+        others get the next free {feature_id}_{slice}_TC_nn.
+        """
+        old_by_slice: Dict[str, List[Dict[str, Any]]] = {}
+        removed = 0
+        for tc in previous:
+            key = self._slice_of(feature_id, tc, slices)
+            if key is None:
+                removed += 1
+            else:
+                old_by_slice.setdefault(key, []).append(tc)
+
+        failed = [k for k, items in fresh.items() if not items]
+        keep = {sl["key"] for sl in slices if sl["key"] not in fresh or sl["key"] in failed}
+        seen_titles = {_title_key(tc) for k in keep for tc in old_by_slice.get(k, [])}
+
+        merged = []
+        for sl in slices:
+            key = sl["key"]
+            old = old_by_slice.get(key, [])
+            if key in keep:
+                merged.extend(old)
+                continue
+            old_ids = {_title_key(tc): tc["id"] for tc in old if tc.get("id")}
+            n = max([int(m.group(1)) for m in (re.search(r"_TC_(\d+)$", str(i)) for i in old_ids.values()) if m] or [0])
+            for tc in fresh[key]:
+                title_key = _title_key(tc)
+                if title_key and title_key in seen_titles:
+                    continue
+                seen_titles.add(title_key)
+                tc = dict(tc)
+                if title_key in old_ids:
+                    tc["id"] = old_ids.pop(title_key)
+                else:
+                    n += 1
+                    tc["id"] = f"{feature_id}_{key}_TC_{n:02d}"
+                for k, v in sl["focus"].items():
+                    tc.setdefault(k, v)
+                merged.append(tc)
+
+        report = {
+            "regenerated": [k for k in fresh if k not in failed],
+            "reused": [sl["key"] for sl in slices if sl["key"] not in fresh],
+            "failed": failed,
+            "removed": removed,
+        }
+        return {"feature_id": feature_id, "test_cases": merged}, report
+
     def _fallback(self, feature: Dict[str, Any]) -> Dict[str, Any]:
         fid = feature.get("feature_id", "feat_fallback")
+        # "fallback" lets callers (e.g. pipeline checkpoints) tell this apart from real output
         return {
             "feature_id": fid,
+            "fallback": True,
             "test_cases": [
                 {
                     "id": f"{fid}_TC_01",
@@ -1,20 +1,41 @@
-import google.generativeai as genai
-import base64
 import json
 import os
+import threading
+from .image_cache import get_image_cache, prepare_image, sha256_bytes
+from .rate_limiter import get_rate_limiter
 
 class VisionAgent:
+    MODEL_NAME = "gemini-1.5-flash"
+
     def __init__(self):
         self.api_key = os.getenv("GOOGLE_API_KEY")
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel("gemini-1.5-flash")
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        """Gemini model, configured on first use so construction stays free of SDK imports."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    import google.generativeai as genai
+                    genai.configure(api_key=self.api_key)
+                    self._model = genai.GenerativeModel(self.MODEL_NAME)
+        return self._model
 
     def analyze_image(self, image_path: str):
-        """Returns UI elements extracted from a screenshot."""
+        """Returns UI elements extracted from a screenshot (cached by image content hash)."""
         with open(image_path, "rb") as f:
             image_data = f.read()
 
-        encoded = base64.b64encode(image_data).decode()
+        cache = get_image_cache()
+        image_hash = sha256_bytes(image_data)
+        if cache is not None:
+            cached = cache.get(image_hash, "analyze", self.MODEL_NAME)
+            if cached is not None:
+                return json.loads(cached)
+
+        data, mime = prepare_image(image_data, image_path)
 
         prompt = """
         You are an expert UI analyst.
@@ -26,14 +47,21 @@ class VisionAgent:
         - validations
         """
 
-        response = self.model.generate_content(
-            contents=[
-                prompt,
-                {"mime_type": "image/png", "data": image_data}
-            ]
-        )
+        # Shares the process-wide quota with LMClient
+        limiter = get_rate_limiter()
+        with limiter.slot():
+            limiter.acquire(258)
+            response = self.model.generate_content(
+                contents=[
+                    prompt,
+                    {"mime_type": mime, "data": data}
+                ]
+            )
 
         try:
-            return json.loads(response.text)
+            result = json.loads(response.text)
         except:
-            return {"screen_name": "unknown", "elements": [], "interactions": [], "validations": []}
\ No newline at end of file
+            return {"screen_name": "unknown", "elements": [], "interactions": [], "validations": []}
+        if cache is not None:
+            cache.set(image_hash, "analyze", self.MODEL_NAME, json.dumps(result))
+        return result
\ No newline at end of file
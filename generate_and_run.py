@@ -1,82 +1,346 @@
 # generate_and_run.py
 import os
+import re
 import json
+import hashlib
+import time
+import glob
+import argparse
 import datetime
+import threading
 from pathlib import Path
-from agents.requirement_agent import RequirementAgent
-from agents.testcase_agent import TestCaseAgent
-from agents.automation_agent import AutomationAgent
-from agents.execution_agent import ExecutionAgent
-from agents.jira_agent import JiraAgent
-from memory.persistent import PersistentMemory
-from agents.llm_client import LMClient
-import requests
 
 BASE = Path(__file__).parent
 SAMPLE = BASE / "sample_data" / "story_login.md"
 GENERATED = BASE / "generated_tests"
 LOGS = BASE / "logs"
-XRAY = os.getenv("XRAY_MOCK_URL", "http://localhost:5001")
+# Default for XRAY_MOCK_URL; the env var is read when posting, after main() loads .env
+XRAY_DEFAULT = "http://localhost:5001"
+STORY_PATTERNS = ("*.md", "*.txt")
 
 LOGS.mkdir(exist_ok=True)
 GENERATED.mkdir(exist_ok=True)
 
+_print_lock = threading.Lock()
+
 
 def trace(msg):
     ts = datetime.datetime.utcnow().isoformat() + "Z"
-    print(f"{ts} | {msg}")
+    with _print_lock:
+        print(f"{ts} | {msg}")
 
 
-def main():
-    trace("Starting enhanced pipeline")
-    if not SAMPLE.exists():
-        print("Create sample_data/story_login.md first")
-        return
-    story = SAMPLE.read_text()
+def build_agents(checkpoints=True, shards=None, fan_out=None, split_by_type=None):
+    """
+    Create the agents once; they are shared by every story in a run.
+    fan_out / split_by_type override TESTCASE_FAN_OUT / TESTCASE_SPLIT_BY_TYPE.
+    """
+    # Agents (and their SDKs) are imported only once there is work to do
+    from agents.requirement_agent import RequirementAgent
+    from agents.testcase_agent import TestCaseAgent
+    from agents.automation_agent import AutomationAgent
+    from agents.execution_agent import ExecutionAgent
+    from agents.jira_agent import JiraAgent
+    from agents.pipeline import CheckpointStore
+    from memory.persistent import PersistentMemory
+    from agents.llm_client import LMClient
 
     lm = LMClient()
-    req = RequirementAgent()
     memory = PersistentMemory()
-    gen = TestCaseAgent(lm=lm, memory=memory)
-    auto = AutomationAgent(lm=lm)
-    exec_agent = ExecutionAgent()
-    jira = JiraAgent()
-
-    trace("Analyze")
-    feature = req.analyze(story)
-    fid = feature.get("feature_id", "feat_demo")
-    memory.save_feature(fid, feature)
-    trace(f"Feature saved: {fid}")
-
-    trace("Generate TCs")
-    # in a CLI run we don't have images; pass empty list
-    tests_json = gen.generate(feature, image_paths=[])
-    tc_path = GENERATED / f"testcases_{tests_json.get('feature_id', fid)}.json"
-    tc_path.write_text(json.dumps(tests_json, indent=2))
-
-    trace("Synthesize automation")
-    out_file = GENERATED / f"test_suite_{tests_json.get('feature_id', fid)}.py"
-    auto.synthesize_pytests(tests_json, str(out_file))
-
-    trace("Run tests")
-    code, stdout, stderr = exec_agent.run_pytest(str(out_file))
-    trace(f"Run done exit={code}")
-    res_path = GENERATED / f"results_{fid}.txt"
-    res_path.write_text(stdout + "\n" + stderr)
-
-    trace("Attach to Jira")
-    jira_resp = jira.attach_testcases("STORY-101", tests_json)
-    trace(f"Attach to Jira: {jira_resp}")
-
-    trace("XRAY post")
+    return {
+        "lm": lm,
+        "memory": memory,
+        "req": RequirementAgent(lm=lm),
+        "gen": TestCaseAgent(lm=lm, memory=memory, fan_out=fan_out, split_by_type=split_by_type),
+        "auto": AutomationAgent(lm=lm, memory=memory),
+        "exec": ExecutionAgent(shards=shards, memory=memory),
+        "jira": JiraAgent(),
+        "checkpoints": CheckpointStore(str(LOGS / "pipeline_checkpoints.db")) if checkpoints else None,
+    }
+
+
+def post_xray(fid, results=None):
+    import requests
+    from agents.jira_agent import xray_execution_payload
+    payload = xray_execution_payload(fid, results or {}, summary="demo exec")
+    xray = os.getenv("XRAY_MOCK_URL", XRAY_DEFAULT)
+    resp = requests.post(f"{xray}/xray/executions", json=payload, timeout=3)
+    return resp.status_code
+
+
+def jira_ok(response) -> bool:
+    """True for a mock comment or a 2xx Jira response (see tools.jira_tool.JiraAPI.add_comment)."""
+    if not isinstance(response, dict):
+        return False
+    if "status_code" in response:
+        return 200 <= int(response["status_code"]) < 300
+    return str(response.get("status", "")).startswith("mock")
+
+
+def xray_ok(status) -> bool:
+    """True for a 2xx status from post_xray (a failed post returns an error string)."""
+    return isinstance(status, int) and 200 <= status < 300
+
+
+def build_pipeline(agents, name, issue_key="STORY-101", unique_id=False, incremental=False, reuse_runs=False):
+    """
+    The story pipeline as a DAG:
+
+        analyze -> generate -> synthesize -> execute -> publish_xray
+                           +-> publish_jira
+
+    publish_jira only needs the test cases, so it runs while pytest does.
+    With unique_id, a story whose analysis yields no real feature_id is keyed
+    by its file name so stories in a batch do not overwrite each other's
+    artifacts. With incremental, generate only regenerates the flows/screens
+    touched by a story edit (TestCaseAgent.generate_incremental).
+
+    execute always runs by default: an unchanged suite still has to be run
+    against the app, which may have changed. With reuse_runs, a passing run
+    is checkpointed and reused while the suite and its inputs are unchanged.
+    """
+    from agents.pipeline import Pipeline, Stage
+
+    # Single-prompt and fan-out output differ, so each mode has its own generate checkpoints
+    gen = agents["gen"]
+    gen_version = ("1-fan-out-by-type" if gen.split_by_type else "1-fan-out") if gen.fan_out else "1"
+
+    def analyze(story):
+        trace(f"[{name}] analyze")
+        feature = agents["req"].analyze(story)
+        fid = feature.get("feature_id", "feat_demo")
+        if unique_id and fid in ("", "feat_demo"):
+            fid = "feat_" + re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+            feature["feature_id"] = fid
+        agents["memory"].save_feature(fid, feature)
+        return feature
+
+    def generate(feature, story=None):
+        trace(f"[{name}] generate")
+        if incremental:
+            tests_json = agents["gen"].generate_incremental(feature, story_text=story)
+            trace(f"[{name}] incremental: {agents['gen'].last_incremental_report}")
+        else:
+            # in a CLI run we don't have images; pass empty list
+            tests_json = agents["gen"].generate(feature, image_paths=[])
+        fid = tests_json.get("feature_id", feature.get("feature_id", "feat_demo"))
+        tc_path = GENERATED / f"testcases_{fid}.json"
+        tc_path.write_text(json.dumps(tests_json, indent=2))
+        return {"tests_json": tests_json, "feature_id": fid, "testcases_path": str(tc_path)}
+
+    def synthesize(tests_json, feature_id):
+        trace(f"[{name}] synthesize")
+        out_file = GENERATED / f"test_suite_{feature_id}.py"
+        agents["auto"].synthesize_pytests(tests_json, str(out_file))
+        suite_hash = hashlib.sha256(out_file.read_bytes()).hexdigest()
+        return {"suite_path": str(out_file), "suite_hash": suite_hash}
+
+    def execute(suite_path, suite_hash, feature_id, tests_json):
+        trace(f"[{name}] execute")
+        report = agents["exec"].run(suite_path, feature_id=feature_id, test_cases=tests_json.get("test_cases"))
+        code = report["returncode"]
+        res_path = GENERATED / f"results_{feature_id}.txt"
+        res_path.write_text(report["stdout"] + "\n" + report["stderr"])
+        results = {k: report[k] for k in ("run_id", "feature_id", "returncode", "tests", "cases", "duration_s")}
+        json_path = GENERATED / f"results_{feature_id}.json"
+        json_path.write_text(json.dumps(results, indent=2))
+        trace(f"[{name}] Run done exit={code} {report['tests']}")
+        return {"exit_code": code, "results_path": str(res_path), "results_json_path": str(json_path), "results": results}
+
+    def publish_jira(tests_json):
+        trace(f"[{name}] publish_jira")
+        return agents["jira"].attach_testcases(issue_key, tests_json)
+
+    def publish_xray(feature_id, results):
+        try:
+            status = post_xray(feature_id, results)
+        except Exception as e:
+            status = f"failed: {e}"
+        trace(f"[{name}] XRAY post: {status}")
+        return status
+
+    return Pipeline(
+        [
+            # LLM-failure fallbacks are not checkpointed, so the next run asks the model again
+            Stage("analyze", analyze, inputs=["story"], outputs=["feature"],
+                  should_checkpoint=lambda out: not out["feature"].get("fallback")),
+            Stage("generate", generate, inputs=["feature", "story"] if incremental else ["feature"],
+                  outputs=["tests_json", "feature_id", "testcases_path"], files=["testcases_path"],
+                  should_checkpoint=lambda out: not out["tests_json"].get("fallback"), version=gen_version),
+            Stage("synthesize", synthesize, inputs=["tests_json", "feature_id"], outputs=["suite_path", "suite_hash"],
+                  files=["suite_path"]),
+            # Opt-in only; even then a failing run is not checkpointed, so it is retried
+            Stage("execute", execute, inputs=["suite_path", "suite_hash", "feature_id", "tests_json"],
+                  outputs=["exit_code", "results_path", "results_json_path", "results"],
+                  files=["results_path", "results_json_path"], checkpoint=reuse_runs,
+                  should_checkpoint=lambda out: out["exit_code"] == 0),
+            Stage("publish_jira", publish_jira, inputs=["tests_json"], outputs=["jira"],
+                  should_checkpoint=lambda out: jira_ok(out["jira"])),
+            Stage("publish_xray", publish_xray, inputs=["feature_id", "results"], outputs=["xray_status"],
+                  should_checkpoint=lambda out: xray_ok(out["xray_status"])),
+        ],
+        store=agents.get("checkpoints"),
+    )
+
+
+def run_story(story_path, agents, issue_key="STORY-101", unique_id=False, fresh=False, incremental=False,
+              reuse_runs=False):
+    """
+    Run the story pipeline for one file.
+
+    Returns a summary dict with per-stage timings (ms) and status (ran,
+    cached, failed or skipped). A failing stage stops only the stages that
+    depend on it; rerunning resumes from there using the checkpoints of the
+    stages whose inputs did not change. fresh=True ignores checkpoints.
+    """
+    story_path = Path(story_path)
+    name = story_path.stem
+    summary = {"story": str(story_path), "feature_id": None, "status": "ok", "stages": {}, "artifacts": {}}
+    t_story = time.perf_counter()
+
     try:
-        resp = requests.post(f"{XRAY}/xray/executions", json={"feature_id": fid, "summary": "demo exec"}, timeout=3)
-        trace(f"XRAY post response: {resp.status_code}")
+        story = story_path.read_text()
+        pipeline = build_pipeline(agents, name, issue_key, unique_id, incremental, reuse_runs)
+        result = pipeline.run({"story": story}, fresh=fresh)
     except Exception as e:
-        trace(f"XRAY post failed: {e}")
+        summary.update(status="error", error=f"setup: {e}")
+        trace(f"[{name}] failed: {e}")
+        result = {"values": {}, "stages": {}, "ok": False}
+
+    values = result["values"]
+    summary["feature_id"] = values.get("feature_id") or (values.get("feature") or {}).get("feature_id")
+    summary["stages"] = {k: v["duration_ms"] for k, v in result["stages"].items()}
+    summary["stage_status"] = {k: v["status"] for k, v in result["stages"].items()}
+    for key, value_name in (("testcases", "testcases_path"), ("suite", "suite_path"), ("results", "results_path"),
+                            ("results_json", "results_json_path")):
+        if values.get(value_name):
+            summary["artifacts"][key] = values[value_name]
+    if "tests_json" in values:
+        summary["test_cases"] = len(values["tests_json"].get("test_cases", []))
+    for key in ("exit_code", "jira", "xray_status"):
+        if key in values:
+            summary[key] = values[key]
+    if "results" in values:
+        summary["tests"] = values["results"]["tests"]
+
+    failed = [f"{k}: {v.get('error')}" for k, v in result["stages"].items() if v["status"] == "failed"]
+    if failed:
+        summary["status"] = "error"
+        summary["error"] = "; ".join(failed)
+        trace(f"[{name}] failed in {summary['error']}")
+
+    summary["duration_ms"] = round((time.perf_counter() - t_story) * 1000, 1)
+    return summary
+
+
+def find_stories(spec):
+    """Expand a directory (its *.md / *.txt files) or a glob into sorted story paths."""
+    path = Path(spec)
+    if path.is_dir():
+        found = {p for pattern in STORY_PATTERNS for p in path.glob(pattern)}
+    elif path.is_file():
+        found = {path}
+    else:
+        found = {Path(p) for p in glob.glob(spec, recursive=True)}
+    return sorted(p for p in found if p.is_file())
+
+
+def run_batch(stories, workers=4, summary_path=None, issue_key="STORY-101", fresh=False, incremental=False,
+              shards=None, reuse_runs=False, fan_out=None, split_by_type=None):
+    """Run run_story over many stories in a thread pool and write a consolidated summary."""
+    from concurrent.futures import ThreadPoolExecutor
+    from agents.rate_limiter import get_rate_limiter
+
+    agents = build_agents(shards=shards, fan_out=fan_out, split_by_type=split_by_type)
+    t0 = time.perf_counter()
+    started = datetime.datetime.utcnow().isoformat() + "Z"
+    trace(f"Batch: {len(stories)} stories, {workers} workers")
 
+    # Threads rather than processes: stages mostly wait on the LLM or pytest,
+    # and threads share one rate limiter, response cache and memory DB.
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="story") as pool:
+        results = list(pool.map(lambda p: run_story(p, agents, issue_key=issue_key, unique_id=True, fresh=fresh,
+                                                   incremental=incremental, reuse_runs=reuse_runs), stories))
+
+    stage_totals = {}
+    for r in results:
+        for label, ms in r["stages"].items():
+            stage_totals[label] = round(stage_totals.get(label, 0) + ms, 1)
+
+    summary = {
+        "started": started,
+        "duration_ms": round((time.perf_counter() - t0) * 1000, 1),
+        "workers": workers,
+        "stories": len(results),
+        "succeeded": sum(1 for r in results if r["status"] == "ok"),
+        "failed": sum(1 for r in results if r["status"] != "ok"),
+        "tests_failed": sum(1 for r in results if r.get("exit_code") not in (None, 0)),
+        "stage_totals_ms": stage_totals,
+        "rate_limiter": dict(get_rate_limiter().stats),
+        "llm_cache": agents["lm"].cache_stats(),
+        "results": results,
+    }
+    summary_path = Path(summary_path or LOGS / "batch_summary.json")
+    summary_path.parent.mkdir(parents=True, exist_ok=True)
+    summary_path.write_text(json.dumps(summary, indent=2, default=str))
+    trace(f"Batch complete: {summary['succeeded']}/{summary['stories']} ok in {summary['duration_ms'] / 1000:.1f}s "
+          f"-> {summary_path}")
+    return summary
+
+
+def main(argv=None):
+    # Before anything reads the environment (argument defaults, rate limiter,
+    # XRAY_MOCK_URL); the agents are imported later, inside build_agents()
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Story -> test cases -> automation -> execution pipeline")
+    parser.add_argument("--stories", help="directory or glob of story files; runs in batch mode")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("PIPELINE_WORKERS", "4")),
+                        help="stories processed concurrently in batch mode")
+    parser.add_argument("--summary", help="batch summary JSON path (default logs/batch_summary.json)")
+    parser.add_argument("--rpm", type=int, help="global LLM requests/minute (overrides LLM_RPM)")
+    parser.add_argument("--tpm", type=int, help="global LLM tokens/minute (overrides LLM_TPM)")
+    parser.add_argument("--issue", default="STORY-101", help="Jira issue to attach test cases to")
+    parser.add_argument("--shards", type=int, help="split each suite across N pytest processes (overrides PYTEST_SHARDS)")
+    parser.add_argument("--fan-out", action="store_true", default=None,
+                        help="generate test cases with one concurrent prompt per flow/screen (overrides TESTCASE_FAN_OUT)")
+    parser.add_argument("--split-by-type", action="store_true", default=None,
+                        help="with --fan-out, also split each flow/screen by test type (overrides TESTCASE_SPLIT_BY_TYPE)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="regenerate only the test cases of flows/screens affected by story edits")
+    parser.add_argument("--fresh", action="store_true", help="ignore stage checkpoints and rerun every stage")
+    parser.add_argument("--reuse-passing-runs", action="store_true",
+                        help="skip executing an unchanged suite whose last run passed (by default every run executes)")
+    args = parser.parse_args(argv)
+
+    if args.rpm is not None or args.tpm is not None:
+        from agents.rate_limiter import configure_rate_limiter
+        configure_rate_limiter(rpm=args.rpm, tpm=args.tpm)
+
+    if args.stories:
+        stories = find_stories(args.stories)
+        if not stories:
+            print(f"No stories found for {args.stories}")
+            return 1
+        summary = run_batch(stories, workers=args.workers, summary_path=args.summary, issue_key=args.issue,
+                            fresh=args.fresh, incremental=args.incremental, shards=args.shards,
+                            reuse_runs=args.reuse_passing_runs, fan_out=args.fan_out,
+                            split_by_type=args.split_by_type)
+        return 1 if summary["failed"] else 0
+
+    trace("Starting enhanced pipeline")
+    if not SAMPLE.exists():
+        print("Create sample_data/story_login.md first")
+        return
+    agents = build_agents(shards=args.shards, fan_out=args.fan_out, split_by_type=args.split_by_type)
+    result = run_story(SAMPLE, agents, issue_key=args.issue, fresh=args.fresh,
+                       incremental=args.incremental, reuse_runs=args.reuse_passing_runs)
+    trace(f"Stage timings (ms): {result['stages']}")
+    trace(f"Stage status: {result['stage_status']}")
     trace("Pipeline complete")
+    return 1 if result["status"] != "ok" else 0
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    raise SystemExit(main())
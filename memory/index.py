@@ -0,0 +1,317 @@
+import hashlib
+import re
+import sqlite3
+import struct
+from typing import Any, Dict, List, Optional
+
+# MinHash signature: NUM_PERM hashes split into BANDS bands for LSH lookup.
+# 32 bands of 2 rows puts the LSH threshold around 0.2 Jaccard, which suits
+# "related story" retrieval better than near-duplicate detection.
+NUM_PERM = 64
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 64) - 1
+
+
+def _perm_params():
+    params = []
+    for i in range(NUM_PERM):
+        d = hashlib.blake2b(f"minhash-{i}".encode(), digest_size=16).digest()
+        a, b = struct.unpack("<QQ", d)
+        params.append(((a % (_PRIME - 1)) + 1, b % _PRIME))
+    return params
+
+
+_PERMS = _perm_params()
+_WORD = re.compile(r"[a-z0-9]+")
+
+# save_feature keys TestCaseAgent uses for its own state next to a feature:
+# "<id>_tcs" holds the generated test cases, "<id>_manifest" the incremental
+# bookkeeping. Neither is a feature in its own right.
+RESERVED_SUFFIXES = ("_tcs", "_manifest")
+
+# Rows indexed as "feature" documents from reserved keys (databases indexed
+# before the keys were skipped) stay out of query results
+_PUBLIC_SQL = (
+    " AND NOT (d.kind = 'feature' AND (d.source_key LIKE '%\\_tcs' ESCAPE '\\'"
+    " OR d.source_key LIKE '%\\_manifest' ESCAPE '\\'))"
+)
+
+
+def is_reserved_key(key: str) -> bool:
+    return key.endswith(RESERVED_SUFFIXES)
+
+
+def tokenize(text: str) -> List[str]:
+    return _WORD.findall((text or "").lower())
+
+
+def shingles(text: str) -> set:
+    """Word unigrams + bigrams."""
+    words = tokenize(text)
+    out = set(words)
+    out.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    return out
+
+
+def minhash(text: str) -> Optional[List[int]]:
+    items = shingles(text)
+    if not items:
+        return None
+    hashed = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), "little") for s in items]
+    return [min((a * x + b) % _PRIME for x in hashed) for a, b in _PERMS]
+
+
+def _bands(sig: List[int]) -> List[int]:
+    keys = []
+    for band in range(BANDS):
+        chunk = struct.pack(f"<{ROWS}Q", *(v & _MASK for v in sig[band * ROWS:(band + 1) * ROWS]))
+        keys.append(int.from_bytes(hashlib.blake2b(chunk, digest_size=7).digest(), "little"))
+    return keys
+
+
+def _pack(sig: List[int]) -> bytes:
+    return struct.pack(f"<{NUM_PERM}Q", *sig)
+
+
+def _unpack(blob: bytes) -> List[int]:
+    return list(struct.unpack(f"<{NUM_PERM}Q", blob))
+
+
+def as_text(value: Any) -> str:
+    """Flatten nested values (dicts, lists) into the plain text that gets indexed."""
+    if value is None:
+        return ""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return " ".join(t for t in (as_text(v) for v in value) if t)
+    return str(value)
+
+
+class FeatureIndex:
+    """
+    Search index over stored features and test cases, living in the same
+    SQLite file as PersistentMemory.
+
+    - full text: FTS5 over title / flows / steps / expected (falls back to
+      LIKE matching when the SQLite build has no FTS5)
+    - similarity: MinHash signatures with LSH banding, so a top-k lookup only
+      scores the candidates that share a band instead of every row
+    """
+
+    def __init__(self, mem):
+        self.mem = mem
+        self.fts = True
+
+    @property
+    def conn(self):
+        return self.mem.conn
+
+    def ensure_tables(self, cur):
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS search_docs (
+                id INTEGER PRIMARY KEY,
+                source_key TEXT NOT NULL,   -- key passed to save_feature
+                feature_id TEXT,
+                kind TEXT,                  -- feature | test_case
+                ref TEXT,                   -- test case id (or feature id)
+                title TEXT,
+                flows TEXT,
+                steps TEXT,
+                expected TEXT,
+                minhash BLOB
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_search_docs_source ON search_docs (source_key)")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS minhash_bands (
+                band INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                doc INTEGER NOT NULL
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_minhash_bucket ON minhash_bands (band, bucket)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_minhash_doc ON minhash_bands (doc)")
+        try:
+            cur.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts "
+                "USING fts5(title, flows, steps, expected, tokenize='porter unicode61')"
+            )
+        except sqlite3.OperationalError:
+            self.fts = False
+
+    # ---------------------------------------------------------
+    # INDEXING
+    # ---------------------------------------------------------
+    def _docs_for(self, source_key: str, data: Any) -> List[Dict[str, Any]]:
+        if not isinstance(data, dict) or source_key.endswith("_manifest"):
+            return []
+        if source_key.endswith("_tcs"):
+            if not isinstance(data.get("test_cases"), list):
+                return []
+            feature_id = data.get("feature_id") or source_key[:-len("_tcs")]
+        else:
+            feature_id = data.get("feature_id") or source_key
+        if isinstance(data.get("test_cases"), list):
+            docs = []
+            for i, tc in enumerate(data["test_cases"]):
+                if not isinstance(tc, dict):
+                    continue
+                docs.append({
+                    "kind": "test_case",
+                    "feature_id": feature_id,
+                    "ref": str(tc.get("id") or i),
+                    "title": as_text(tc.get("title")),
+                    "flows": as_text([tc.get("flow"), tc.get("screen"), tc.get("type")]),
+                    "steps": as_text(tc.get("steps")),
+                    "expected": as_text(tc.get("expected")),
+                })
+            return docs
+        return [{
+            "kind": "feature",
+            "feature_id": feature_id,
+            "ref": feature_id,
+            "title": as_text(data.get("title")),
+            "flows": as_text([data.get("flows"), data.get("screens")]),
+            "steps": as_text([data.get("api_endpoints"), data.get("risks")]),
+            "expected": "",
+        }]
+
+    def index_document(self, source_key: str, data: Any):
+        """Replace the index entries for one save_feature key (caller commits)."""
+        cur = self.conn.cursor()
+        self._remove(cur, source_key)
+        for doc in self._docs_for(source_key, data):
+            text = " ".join((doc["title"], doc["flows"], doc["steps"], doc["expected"]))
+            sig = minhash(text)
+            cur.execute(
+                "INSERT INTO search_docs (source_key, feature_id, kind, ref, title, flows, steps, expected, minhash) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (source_key, doc["feature_id"], doc["kind"], doc["ref"], doc["title"],
+                 doc["flows"], doc["steps"], doc["expected"], _pack(sig) if sig else None),
+            )
+            doc_id = cur.lastrowid
+            if self.fts:
+                cur.execute(
+                    "INSERT INTO search_fts (rowid, title, flows, steps, expected) VALUES (?, ?, ?, ?, ?)",
+                    (doc_id, doc["title"], doc["flows"], doc["steps"], doc["expected"]),
+                )
+            if sig:
+                cur.executemany(
+                    "INSERT INTO minhash_bands (band, bucket, doc) VALUES (?, ?, ?)",
+                    [(band, bucket, doc_id) for band, bucket in enumerate(_bands(sig))],
+                )
+
+    def _remove(self, cur, source_key: str):
+        ids = [r[0] for r in cur.execute("SELECT id FROM search_docs WHERE source_key = ?", (source_key,))]
+        if not ids:
+            return
+        cur.executemany("DELETE FROM minhash_bands WHERE doc = ?", [(i,) for i in ids])
+        if self.fts:
+            cur.executemany("DELETE FROM search_fts WHERE rowid = ?", [(i,) for i in ids])
+        cur.execute("DELETE FROM search_docs WHERE source_key = ?", (source_key,))
+
+    def is_empty(self) -> bool:
+        return self.conn.execute("SELECT 1 FROM search_docs LIMIT 1").fetchone() is None
+
+    # ---------------------------------------------------------
+    # QUERIES
+    # ---------------------------------------------------------
+    def _row_to_hit(self, row, score: float) -> Dict[str, Any]:
+        doc_id, source_key, feature_id, kind, ref, title, flows, steps, expected = row[:9]
+        return {
+            "source_key": source_key,
+            "feature_id": feature_id,
+            "kind": kind,
+            "ref": ref,
+            "title": title,
+            "flows": flows,
+            "steps": steps,
+            "expected": expected,
+            "score": round(score, 4),
+        }
+
+    def search(self, query: str, limit: int = 10, kind: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Full-text search, best matches first."""
+        words = tokenize(query)
+        if not words:
+            return []
+        cols = "d.id, d.source_key, d.feature_id, d.kind, d.ref, d.title, d.flows, d.steps, d.expected"
+        kind_sql = (" AND d.kind = ?" if kind else "") + _PUBLIC_SQL
+        kind_args = [kind] if kind else []
+        if self.fts:
+            match = " OR ".join(f'"{w}"' for w in words)
+            rows = self.conn.execute(
+                f"SELECT {cols}, bm25(search_fts) AS rank FROM search_fts "
+                f"JOIN search_docs d ON d.id = search_fts.rowid "
+                f"WHERE search_fts MATCH ?{kind_sql} ORDER BY rank LIMIT ?",
+                [match] + kind_args + [limit],
+            ).fetchall()
+            return [self._row_to_hit(r, -r[9]) for r in rows]
+
+        like = " OR ".join(["(d.title || ' ' || d.flows || ' ' || d.steps || ' ' || d.expected) LIKE ?"] * len(words))
+        rows = self.conn.execute(
+            f"SELECT {cols} FROM search_docs d WHERE ({like}){kind_sql} LIMIT ?",
+            [f"%{w}%" for w in words] + kind_args + [limit],
+        ).fetchall()
+        return [self._row_to_hit(r, 0.0) for r in rows]
+
+    def similar(
+        self,
+        text: str,
+        k: int = 5,
+        kind: Optional[str] = None,
+        exclude_feature_id: Optional[str] = None,
+        max_candidates: int = 500,
+    ) -> List[Dict[str, Any]]:
+        """
+        Top-k documents by estimated Jaccard similarity to `text`.
+
+        Candidates are the documents sharing the most LSH bands with `text`,
+        ranked and capped in SQL (at most `max_candidates` rows come back);
+        only those get their full signature compared.
+        """
+        sig = minhash(text)
+        if not sig:
+            return []
+        cols = "d.id, d.source_key, d.feature_id, d.kind, d.ref, d.title, d.flows, d.steps, d.expected, d.minhash"
+        filters = " AND d.minhash IS NOT NULL" + _PUBLIC_SQL
+        filter_args: List[Any] = []
+        if kind:
+            filters += " AND d.kind = ?"
+            filter_args.append(kind)
+        if exclude_feature_id:
+            filters += " AND d.feature_id IS NOT ?"
+            filter_args.append(exclude_feature_id)
+
+        pairs = " OR ".join(["(band = ? AND bucket = ?)"] * BANDS)
+        band_args = [v for pair in enumerate(_bands(sig)) for v in pair]
+        rows = self.conn.execute(
+            f"SELECT {cols} FROM ("
+            f"  SELECT doc, COUNT(*) AS shared FROM minhash_bands WHERE {pairs} GROUP BY doc"
+            f") c JOIN search_docs d ON d.id = c.doc WHERE 1{filters} "
+            f"ORDER BY c.shared DESC, d.id LIMIT ?",
+            band_args + filter_args + [max_candidates],
+        ).fetchall()
+        if len(rows) < k * 4 and self.fts:
+            # Too few LSH candidates (short or loosely related text): add FTS hits
+            words = list(dict.fromkeys(tokenize(text)))[:32]
+            if words:
+                seen = {r[0] for r in rows}
+                rows += [r for r in self.conn.execute(
+                    f"SELECT {cols} FROM search_fts JOIN search_docs d ON d.id = search_fts.rowid "
+                    f"WHERE search_fts MATCH ?{filters} ORDER BY bm25(search_fts) LIMIT ?",
+                    [" OR ".join(f'"{w}"' for w in words)] + filter_args + [k * 4],
+                ) if r[0] not in seen]
+
+        scored = []
+        for row in rows:
+            other = _unpack(row[9])
+            score = sum(1 for a, b in zip(sig, other) if a == b) / NUM_PERM
+            scored.append((score, row))
+        scored.sort(key=lambda t: (-t[0], t[1][0]))
+        return [self._row_to_hit(row, score) for score, row in scored[:k]]
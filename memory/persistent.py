@@ -1,16 +1,123 @@
 import sqlite3
 import json
+import hashlib
+import threading
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
 
+from memory.index import FeatureIndex, as_text, is_reserved_key
+
 DB_PATH = Path("memory_store.db")
 
+try:
+    import zstandard as _zstd
+except ImportError:  # optional dependency; zlib is always available
+    _zstd = None
+
+# Applied to every connection; WAL lets readers proceed while a writer commits
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA cache_size=-8000",      # ~8 MB page cache
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA busy_timeout=5000",
+)
+
+
+def _canonical(obj) -> bytes:
+    """Key-sorted compact JSON, used for content hashes."""
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _compact(obj) -> bytes:
+    """Compact JSON that keeps key order, used for stored payloads."""
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _compress(raw: bytes):
+    """Return (codec, blob): zstd when installed, else zlib."""
+    if _zstd is not None:
+        return "zstd", _zstd.ZstdCompressor(level=6).compress(raw)
+    return "zlib", zlib.compress(raw, 6)
+
+
+def _decompress(codec: str, blob: bytes) -> bytes:
+    if codec == "zstd":
+        if _zstd is None:
+            raise RuntimeError("zstandard is required to read this revision")
+        return _zstd.ZstdDecompressor().decompress(blob)
+    if codec == "zlib":
+        return zlib.decompress(blob)
+    return bytes(blob)
+
 
 class PersistentMemory:
-    def __init__(self, db_path: str = None):
+    """
+    SQLite-backed memory shared by the UI, the CLI and parallel workers.
+
+    Each thread gets its own connection (WAL journal, tuned pragmas), so
+    one instance can be shared safely. Writes commit immediately unless
+    they run inside a batch() block, which groups them in one transaction.
+    """
+
+    def __init__(self, db_path: str = None, feature_cache_size: int = 256):
         self.db_path = db_path or str(DB_PATH)
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.feature_cache_size = feature_cache_size
+        self._feature_cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._feature_cache_lock = threading.Lock()
+        self.feature_cache_stats = {"hits": 0, "misses": 0, "stale": 0}
+        self._local = threading.local()
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        # An in-memory DB exists per connection, so it cannot be pooled per thread
+        self._shared_conn = self._open() if self.db_path == ":memory:" else None
+        self.index = FeatureIndex(self)
         self._ensure_tables()
 
+    # ---------------------------------------------------------
+    # CONNECTIONS / TRANSACTIONS
+    # ---------------------------------------------------------
+    def _open(self):
+        conn = sqlite3.connect(self.db_path, timeout=5.0, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        with self._conns_lock:
+            self._conns.append(conn)
+        return conn
+
+    @property
+    def conn(self):
+        """Connection for the calling thread."""
+        if self._shared_conn is not None:
+            return self._shared_conn
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._open()
+        return conn
+
+    def _commit(self):
+        if not getattr(self._local, "batch_depth", 0):
+            self.conn.commit()
+
+    @contextmanager
+    def batch(self):
+        """Group all writes in the block into one transaction (nestable)."""
+        depth = getattr(self._local, "batch_depth", 0)
+        self._local.batch_depth = depth + 1
+        try:
+            yield self
+        except BaseException:
+            self._local.batch_depth = depth
+            if depth == 0:
+                self.conn.rollback()
+            raise
+        else:
+            self._local.batch_depth = depth
+            if depth == 0:
+                self.conn.commit()
+
     def _ensure_tables(self):
         cur = self.conn.cursor()
 
@@ -22,8 +129,40 @@ class PersistentMemory:
                 updated_ts TEXT
             )
         """)
+        # version is bumped on every save; (version, updated_ts) is the cache etag
+        columns = {row[1] for row in cur.execute("PRAGMA table_info(features)")}
+        if "version" not in columns:
+            cur.execute("ALTER TABLE features ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_features_updated ON features (updated_ts)")
+
+        # Version history. features holds the head pointer (data is NULL
+        # for rows written by the versioned store); each revision stores a
+        # compressed manifest whose test cases reference content_blobs.
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS feature_revisions (
+                feature_id TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                codec TEXT,
+                manifest BLOB,
+                content_hash TEXT,
+                created_ts TEXT,
+                PRIMARY KEY (feature_id, version)
+            )
+        """)
+        # Test case bodies, content-addressed so identical ones are stored once
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS content_blobs (
+                hash TEXT PRIMARY KEY,
+                codec TEXT,
+                data BLOB
+            )
+        """)
 
-        # Conversation table
+        # Full-text / similarity index over features and test cases
+        self.index.ensure_tables(cur)
+
+        # Legacy conversation table (one JSON blob per conversation);
+        # rows are migrated into conversation_turns on startup
         cur.execute("""
             CREATE TABLE IF NOT EXISTS conversations (
                 conv_id TEXT PRIMARY KEY,
@@ -32,52 +171,466 @@ class PersistentMemory:
             )
         """)
 
+        # Append-only conversation log, one row per turn
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_turns (
+                conv_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT,
+                text TEXT,
+                ts TEXT,
+                PRIMARY KEY (conv_id, seq)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_turns_ts ON conversation_turns (conv_id, ts)")
+
+        # Per-test execution results (one row per test per run)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS test_results (
+                run_id TEXT NOT NULL,
+                feature_id TEXT,
+                testcase_id TEXT,          -- generated test case this test implements, if known
+                test_key TEXT NOT NULL,    -- JUnit classname::name
+                outcome TEXT,              -- passed | failed | error | skipped
+                duration REAL,
+                message TEXT,
+                ts TEXT,
+                PRIMARY KEY (run_id, test_key)
+            )
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_results_key ON test_results (test_key, ts)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_results_testcase ON test_results (testcase_id, ts)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_results_feature ON test_results (feature_id, ts)")
+
+        # Learned code for Gherkin / test case steps without a step definition,
+        # keyed by the step's normalized template (agents.step_snippets)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS step_snippets (
+                fingerprint TEXT PRIMARY KEY,   -- step_fingerprint(step text)
+                step_text TEXT,                 -- first step text seen for this template
+                code TEXT NOT NULL,             -- Python statements using page / base_url / arg0..
+                created_ts TEXT
+            )
+        """)
+        columns = {row[1] for row in cur.execute("PRAGMA table_info(step_snippets)")}
+        for column, ddl in (("template", "TEXT"), ("uses", "INTEGER NOT NULL DEFAULT 0"), ("last_used_ts", "TEXT")):
+            if column not in columns:
+                cur.execute(f"ALTER TABLE step_snippets ADD COLUMN {column} {ddl}")
+
         self.conn.commit()
+        self._migrate_conversation_blobs()
+
+        if self.index.is_empty() and cur.execute("SELECT 1 FROM features LIMIT 1").fetchone():
+            self.rebuild_index()
+
+    def _migrate_conversation_blobs(self):
+        """Move legacy JSON-blob histories into conversation_turns (runs once per row)."""
+        cur = self.conn.cursor()
+        rows = cur.execute("SELECT conv_id, history, updated_ts FROM conversations").fetchall()
+        for conv_id, history, updated_ts in rows:
+            try:
+                turns = json.loads(history) if history else []
+            except Exception:
+                turns = []
+            exists = cur.execute(
+                "SELECT 1 FROM conversation_turns WHERE conv_id = ? LIMIT 1", (conv_id,)
+            ).fetchone()
+            if not exists:
+                cur.executemany(
+                    "INSERT INTO conversation_turns (conv_id, seq, role, text, ts) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (conv_id, i, t.get("role", "user"), t.get("text", ""), updated_ts)
+                        for i, t in enumerate(turns, start=1)
+                        if isinstance(t, dict)
+                    ],
+                )
+            cur.execute("DELETE FROM conversations WHERE conv_id = ?", (conv_id,))
+        if rows:
+            self.conn.commit()
+
+    def close(self):
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            conn.close()
+        self._local = threading.local()
+        self._shared_conn = None
 
     # ---------------------------------------------------------
     # FEATURE MEMORY
     # ---------------------------------------------------------
     def save_feature(self, feature_id: str, data: dict):
+        """
+        Store a new revision of a feature (or testcase set).
+
+        Saving content identical to the latest revision is a no-op. Test
+        case bodies are stored once in content_blobs and shared between
+        revisions and features; everything is compressed.
+        """
+        content_hash = hashlib.sha256(_canonical(data)).hexdigest()
         cur = self.conn.cursor()
+        head = cur.execute(
+            "SELECT f.data, f.version, r.content_hash FROM features f "
+            "LEFT JOIN feature_revisions r ON r.feature_id = f.feature_id AND r.version = f.version "
+            "WHERE f.feature_id = ?",
+            (feature_id,),
+        ).fetchone()
+        if head and head[2] == content_hash:
+            return
+
+        if head and head[0] is not None and head[2] is None:
+            # Legacy plain-JSON row: keep it as the first revision of the history
+            self._insert_revision(cur, feature_id, json.loads(head[0]), version=head[1])
+
+        self._insert_revision(cur, feature_id, data, content_hash=content_hash)
         cur.execute(
-            "REPLACE INTO features (feature_id, data, updated_ts) "
-            "VALUES (?, ?, datetime('now'))",
-            (feature_id, json.dumps(data)),
+            "INSERT INTO features (feature_id, data, updated_ts, version) "
+            "SELECT ?, NULL, datetime('now'), MAX(version) FROM feature_revisions WHERE feature_id = ? "
+            "ON CONFLICT(feature_id) DO UPDATE SET "
+            "data = NULL, updated_ts = excluded.updated_ts, version = excluded.version",
+            (feature_id, feature_id),
         )
-        self.conn.commit()
+        self.index.index_document(feature_id, data)
+        self._commit()
+        self._invalidate_feature(feature_id)
+
+    def _insert_revision(self, cur, feature_id: str, data, version: int = None, content_hash: str = None):
+        manifest = data
+        if isinstance(data, dict) and isinstance(data.get("test_cases"), list):
+            refs = [self._put_blob(cur, tc) for tc in data["test_cases"]]
+            manifest = {"doc": {k: v for k, v in data.items() if k != "test_cases"}, "test_case_refs": refs}
+        codec, blob = _compress(_compact(manifest))
+        content_hash = content_hash or hashlib.sha256(_canonical(data)).hexdigest()
+        if version is None:
+            cur.execute(
+                "INSERT INTO feature_revisions (feature_id, version, codec, manifest, content_hash, created_ts) "
+                "SELECT ?, COALESCE(MAX(version), 0) + 1, ?, ?, ?, datetime('now') "
+                "FROM feature_revisions WHERE feature_id = ?",
+                (feature_id, codec, blob, content_hash, feature_id),
+            )
+        else:
+            cur.execute(
+                "INSERT OR IGNORE INTO feature_revisions (feature_id, version, codec, manifest, content_hash, created_ts) "
+                "VALUES (?, ?, ?, ?, ?, datetime('now'))",
+                (feature_id, version, codec, blob, content_hash),
+            )
+
+    def _put_blob(self, cur, obj) -> str:
+        h = hashlib.sha256(_canonical(obj)).hexdigest()
+        if not cur.execute("SELECT 1 FROM content_blobs WHERE hash = ?", (h,)).fetchone():
+            codec, blob = _compress(_compact(obj))
+            cur.execute("INSERT OR IGNORE INTO content_blobs (hash, codec, data) VALUES (?, ?, ?)", (h, codec, blob))
+        return h
+
+    def _load_revision(self, feature_id: str, version: int):
+        cur = self.conn.cursor()
+        row = cur.execute(
+            "SELECT codec, manifest FROM feature_revisions WHERE feature_id = ? AND version = ?",
+            (feature_id, version),
+        ).fetchone()
+        if not row:
+            return None
+        manifest = json.loads(_decompress(row[0], row[1]))
+        if isinstance(manifest, dict) and "test_case_refs" in manifest and "doc" in manifest:
+            refs = manifest["test_case_refs"]
+            blobs = {}
+            for i in range(0, len(refs), 500):
+                chunk = refs[i:i + 500]
+                q = "SELECT hash, codec, data FROM content_blobs WHERE hash IN (%s)" % ",".join("?" * len(chunk))
+                for h, codec, data in cur.execute(q, chunk):
+                    blobs[h] = json.loads(_decompress(codec, data))
+            data = dict(manifest["doc"])
+            data["test_cases"] = [blobs[h] for h in refs if h in blobs]
+            return data
+        return manifest
 
     def get_feature(self, feature_id: str):
+        """
+        Return the latest stored feature dict, or None.
+
+        Parsed dicts are served from an in-process LRU cache after a cheap
+        etag check, so writes from other processes are still seen. The
+        returned dict is shared with the cache: treat it as read-only.
+        """
         cur = self.conn.cursor()
-        cur.execute("SELECT data FROM features WHERE feature_id = ?", (feature_id,))
-        row = cur.fetchone()
-        return json.loads(row[0]) if row else None
+        row = cur.execute(
+            "SELECT version, updated_ts FROM features WHERE feature_id = ?", (feature_id,)
+        ).fetchone()
+        if not row:
+            self._invalidate_feature(feature_id)
+            return None
+        etag = (row[0], row[1])
+
+        with self._feature_cache_lock:
+            entry = self._feature_cache.get(feature_id)
+            if entry is not None and entry[0] == etag:
+                self._feature_cache.move_to_end(feature_id)
+                self.feature_cache_stats["hits"] += 1
+                return entry[1]
+            self.feature_cache_stats["stale" if entry is not None else "misses"] += 1
+
+        row = cur.execute(
+            "SELECT data, version, updated_ts FROM features WHERE feature_id = ?", (feature_id,)
+        ).fetchone()
+        if not row:
+            return None
+        data = json.loads(row[0]) if row[0] is not None else self._load_revision(feature_id, row[1])
+        self._cache_feature(feature_id, (row[1], row[2]), data)
+        return data
+
+    def get_feature_version(self, feature_id: str, version: int):
+        """Return a specific revision, or None."""
+        data = self._load_revision(feature_id, version)
+        if data is None:
+            # Legacy row that was never re-saved: its only version is the head
+            row = self.conn.execute(
+                "SELECT data FROM features WHERE feature_id = ? AND version = ?", (feature_id, version)
+            ).fetchone()
+            if row and row[0] is not None:
+                data = json.loads(row[0])
+        return data
+
+    def list_versions(self, feature_id: str):
+        """Return [(version, created_ts, content_hash)] newest first."""
+        return self.conn.execute(
+            "SELECT version, created_ts, content_hash FROM feature_revisions "
+            "WHERE feature_id = ? ORDER BY version DESC",
+            (feature_id,),
+        ).fetchall()
+
+    def diff_versions(self, feature_id: str, old_version: int, new_version: int) -> dict:
+        """
+        Compare two revisions: top-level fields that changed, and test cases
+        added / removed / changed (matched by id, else title).
+        """
+        old = self.get_feature_version(feature_id, old_version) or {}
+        new = self.get_feature_version(feature_id, new_version) or {}
+
+        def keyed(doc):
+            out = {}
+            for tc in (doc.get("test_cases") or []) if isinstance(doc, dict) else []:
+                if isinstance(tc, dict):
+                    out[str(tc.get("id") or tc.get("title"))] = tc
+            return out
+
+        old_tcs, new_tcs = keyed(old), keyed(new)
+        fields = sorted(
+            k for k in set(old) | set(new)
+            if k != "test_cases" and old.get(k) != new.get(k)
+        ) if isinstance(old, dict) and isinstance(new, dict) else []
+        return {
+            "feature_id": feature_id,
+            "from": old_version,
+            "to": new_version,
+            "fields_changed": fields,
+            "added": [k for k in new_tcs if k not in old_tcs],
+            "removed": [k for k in old_tcs if k not in new_tcs],
+            "changed": [k for k in new_tcs if k in old_tcs and _canonical(new_tcs[k]) != _canonical(old_tcs[k])],
+        }
+
+    def _cache_feature(self, feature_id: str, etag: tuple, data):
+        with self._feature_cache_lock:
+            self._feature_cache[feature_id] = (etag, data)
+            self._feature_cache.move_to_end(feature_id)
+            while len(self._feature_cache) > self.feature_cache_size:
+                self._feature_cache.popitem(last=False)
+
+    def _invalidate_feature(self, feature_id: str):
+        with self._feature_cache_lock:
+            self._feature_cache.pop(feature_id, None)
+
+    def cache_stats(self) -> dict:
+        """Read-through cache counters for get_feature (stale = etag changed since cached)."""
+        with self._feature_cache_lock:
+            stats = dict(self.feature_cache_stats, size=len(self._feature_cache))
+        lookups = stats["hits"] + stats["misses"] + stats["stale"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    # ---------------------------------------------------------
+    # SEARCH
+    # ---------------------------------------------------------
+    def search_features(self, query: str, limit: int = 10, kind: str = None):
+        """Full-text search over titles, flows, steps and expected results."""
+        return self.index.search(query, limit=limit, kind=kind)
+
+    def similar_features(self, query, k: int = 5, kind: str = None, exclude_feature_id: str = None):
+        """Top-k stored features / test cases most similar to `query` (text or dict)."""
+        text = query if isinstance(query, str) else as_text(query)
+        return self.index.similar(text, k=k, kind=kind, exclude_feature_id=exclude_feature_id)
+
+    def rebuild_index(self):
+        # Every key, reserved ones included: "<id>_tcs" carries the test cases
+        keys = [r[0] for r in self.conn.execute("SELECT feature_id FROM features")]
+        with self.batch():
+            for feature_id in keys:
+                self.index.index_document(feature_id, self.get_feature(feature_id))
 
     def list_features(self):
+        """(feature_id, updated_ts) of stored features, newest first; internal "<id>_tcs" / "<id>_manifest" keys are left out."""
         cur = self.conn.cursor()
         cur.execute("SELECT feature_id, updated_ts FROM features ORDER BY updated_ts DESC")
-        return cur.fetchall()
+        return [row for row in cur.fetchall() if not is_reserved_key(row[0])]
 
     # ---------------------------------------------------------
     # CONVERSATION MEMORY
     # ---------------------------------------------------------
-    def save_conversation(self, conv_id: str, history: list):
-        """Store entire conversation history as JSON."""
+    def append_turn(self, conv_id: str, role: str, text: str) -> int:
+        """Append one turn to a conversation and return its sequence number."""
         cur = self.conn.cursor()
         cur.execute(
-            "REPLACE INTO conversations (conv_id, history, updated_ts) "
-            "VALUES (?, ?, datetime('now'))",
-            (conv_id, json.dumps(history)),
+            "INSERT INTO conversation_turns (conv_id, seq, role, text, ts) "
+            "SELECT ?, COALESCE(MAX(seq), 0) + 1, ?, ?, datetime('now') "
+            "FROM conversation_turns WHERE conv_id = ?",
+            (conv_id, role, text, conv_id),
         )
-        self.conn.commit()
+        seq = cur.execute(
+            "SELECT MAX(seq) FROM conversation_turns WHERE conv_id = ?", (conv_id,)
+        ).fetchone()[0]
+        self._commit()
+        return seq
 
-    def load_conversation(self, conv_id: str):
-        """Return list of past messages, or empty list."""
+    def save_conversation(self, conv_id: str, history: list):
+        """Replace the stored conversation with `history` (list of {role, text})."""
         cur = self.conn.cursor()
-        cur.execute("SELECT history FROM conversations WHERE conv_id = ?", (conv_id,))
-        row = cur.fetchone()
-        if not row:
-            return []
-        try:
-            return json.loads(row[0])
-        except Exception:
-            return []
\ No newline at end of file
+        cur.execute("DELETE FROM conversation_turns WHERE conv_id = ?", (conv_id,))
+        cur.executemany(
+            "INSERT INTO conversation_turns (conv_id, seq, role, text, ts) "
+            "VALUES (?, ?, ?, ?, datetime('now'))",
+            [(conv_id, i, t.get("role", "user"), t.get("text", "")) for i, t in enumerate(history, start=1)],
+        )
+        self._commit()
+
+    def clear_conversation(self, conv_id: str):
+        self.conn.execute("DELETE FROM conversation_turns WHERE conv_id = ?", (conv_id,))
+        self._commit()
+
+    def load_conversation(self, conv_id: str, limit: int = None, before_seq: int = None):
+        """
+        Return past messages (oldest first) as {role, text, seq}, or empty list.
+
+        limit returns only the last N turns; before_seq pages further back.
+        """
+        sql = "SELECT seq, role, text FROM conversation_turns WHERE conv_id = ?"
+        params = [conv_id]
+        if before_seq is not None:
+            sql += " AND seq < ?"
+            params.append(before_seq)
+        sql += " ORDER BY seq DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        rows = self.conn.execute(sql, params).fetchall()
+        return [{"role": role, "text": text, "seq": seq} for seq, role, text in reversed(rows)]
+
+    def count_turns(self, conv_id: str) -> int:
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM conversation_turns WHERE conv_id = ?", (conv_id,)
+        ).fetchone()[0]
+
+    # ---------------------------------------------------------
+    # TEST RESULTS
+    # ---------------------------------------------------------
+    def save_test_results(self, run_id: str, feature_id: str, records: list):
+        """Store per-test records ({key, testcase_id, outcome, duration, message}) for one run."""
+        cur = self.conn.cursor()
+        cur.executemany(
+            "INSERT OR REPLACE INTO test_results "
+            "(run_id, feature_id, testcase_id, test_key, outcome, duration, message, ts) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, strftime('%Y-%m-%d %H:%M:%f', 'now'))",
+            [
+                (run_id, feature_id, r.get("testcase_id"), r["key"], r.get("outcome"), r.get("duration"), r.get("message"))
+                for r in records
+            ],
+        )
+        self._commit()
+
+    def load_test_results(self, run_id: str = None, feature_id: str = None, testcase_id: str = None, limit: int = 500):
+        """Most recent result rows, optionally filtered by run, feature or test case."""
+        sql = ("SELECT run_id, feature_id, testcase_id, test_key, outcome, duration, message, ts "
+               "FROM test_results WHERE 1 = 1")
+        params = []
+        for column, value in (("run_id", run_id), ("feature_id", feature_id), ("testcase_id", testcase_id)):
+            if value is not None:
+                sql += f" AND {column} = ?"
+                params.append(value)
+        sql += " ORDER BY ts DESC, test_key LIMIT ?"
+        params.append(limit)
+        cols = ("run_id", "feature_id", "testcase_id", "key", "outcome", "duration", "message", "ts")
+        return [dict(zip(cols, row)) for row in self.conn.execute(sql, params).fetchall()]
+
+    def test_durations(self, last_runs: int = 5) -> dict:
+        """Average duration per test key over its last N non-skipped results."""
+        rows = self.conn.execute(
+            "SELECT test_key, AVG(duration) FROM ("
+            "  SELECT test_key, duration, ROW_NUMBER() OVER (PARTITION BY test_key ORDER BY ts DESC) AS n "
+            "  FROM test_results WHERE outcome != 'skipped' AND duration IS NOT NULL"
+            ") WHERE n <= ? GROUP BY test_key",
+            (last_runs,),
+        ).fetchall()
+        return {key: avg for key, avg in rows}
+
+    def flaky_tests(self, last_runs: int = 10) -> list:
+        """Tests that both passed and failed within their last N results, most unstable first."""
+        rows = self.conn.execute(
+            "SELECT test_key, MAX(testcase_id), "
+            "       SUM(outcome = 'passed'), SUM(outcome IN ('failed', 'error')), COUNT(*) FROM ("
+            "  SELECT test_key, testcase_id, outcome, "
+            "         ROW_NUMBER() OVER (PARTITION BY test_key ORDER BY ts DESC) AS n "
+            "  FROM test_results WHERE outcome != 'skipped'"
+            ") WHERE n <= ? GROUP BY test_key "
+            "HAVING SUM(outcome = 'passed') > 0 AND SUM(outcome IN ('failed', 'error')) > 0",
+            (last_runs,),
+        ).fetchall()
+        flaky = [
+            {"key": key, "testcase_id": tc_id, "passed": passed, "failed": failed, "runs": runs,
+             "fail_rate": round(failed / runs, 3)}
+            for key, tc_id, passed, failed, runs in rows
+        ]
+        return sorted(flaky, key=lambda r: -min(r["passed"], r["failed"]))
+
+    # ---------------------------------------------------------
+    # STEP SNIPPETS
+    # ---------------------------------------------------------
+    def get_step_snippets(self, fingerprints: list) -> dict:
+        """{fingerprint: code} for the fingerprints that have a stored snippet."""
+        fingerprints = list(dict.fromkeys(fingerprints))
+        found = {}
+        # Stay well below SQLite's bound-parameter limit
+        for i in range(0, len(fingerprints), 500):
+            chunk = fingerprints[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT fingerprint, code FROM step_snippets WHERE fingerprint IN ({','.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+            found.update(rows)
+        return found
+
+    def save_step_snippets(self, snippets: list):
+        """Store [{fingerprint, template, step_text, code}], replacing existing fingerprints."""
+        self.conn.executemany(
+            "INSERT INTO step_snippets (fingerprint, template, step_text, code, created_ts) "
+            "VALUES (?, ?, ?, ?, datetime('now')) ON CONFLICT(fingerprint) DO UPDATE SET "
+            "template = excluded.template, step_text = excluded.step_text, code = excluded.code, "
+            "created_ts = excluded.created_ts",
+            [(s["fingerprint"], s.get("template"), s.get("step_text"), s["code"]) for s in snippets],
+        )
+        self._commit()
+
+    def record_step_uses(self, counts: dict):
+        """Add {fingerprint: n} to the snippets' usage counters."""
+        self.conn.executemany(
+            "UPDATE step_snippets SET uses = uses + ?, last_used_ts = datetime('now') WHERE fingerprint = ?",
+            [(n, fp) for fp, n in counts.items()],
+        )
+        self._commit()
+
+    def top_step_snippets(self, limit: int = 50) -> list:
+        """Most used snippets first."""
+        rows = self.conn.execute(
+            "SELECT fingerprint, template, step_text, code, uses, last_used_ts FROM step_snippets "
+            "ORDER BY uses DESC, fingerprint LIMIT ?",
+            (limit,),
+        ).fetchall()
+        cols = ("fingerprint", "template", "step_text", "code", "uses", "last_used_ts")
+        return [dict(zip(cols, row)) for row in rows]
@@ -0,0 +1,183 @@
+import json
+import os
+import re
+
+import pytest
+
+from agents.automation_agent import (
+    AutomationAgent,
+    assemble_module,
+    case_function_name,
+    case_function_names,
+    case_steps,
+    check_python,
+    split_feature_blocks,
+)
+from memory.persistent import PersistentMemory
+
+
+class PerCaseLM:
+    """Valid code for TC_01, broken code once for TC_02, never anything usable for TC_03."""
+
+    def __init__(self):
+        self.prompts = []
+
+    async def agenerate(self, prompt, max_output_tokens=None):
+        self.prompts.append(prompt)
+        name = re.search(r"Name the function exactly (\w+)", prompt).group(1)
+        if name == "test_tc_02" and "previous answer was rejected" not in prompt:
+            return f"def {name}(page:\n    pass"
+        if name == "test_tc_03":
+            return "[genai_error] quota"
+        return "```python\nimport pytest\n\ndef test_something(page, base_url):\n    page.goto(base_url)\n```"
+
+
+class StepLM:
+    """Answers a learn_steps request with a snippet per step; "broken" steps get code that does not compile."""
+
+    def __init__(self):
+        self.calls = []
+
+    def generate(self, prompt, max_output_tokens=None):
+        steps = json.loads(prompt.split("Steps:\n", 1)[1])
+        self.calls.append([s["step"] for s in steps])
+        mapping = {
+            s["step"]: "page.fill(arg1, arg0" if "broken" in s["step"] else "page.fill(arg1, arg0)"
+            for s in steps
+        }
+        return "```json\n" + json.dumps(mapping) + "\n```"
+
+
+class ScenarioLM:
+    """Streams one scenario per requested test case; the one titled "bad" gets text that is not Gherkin."""
+
+    def __init__(self):
+        self.requested = []
+
+    def generate_stream(self, prompt, max_output_tokens=None):
+        cases = json.loads(prompt.split("Testcases JSON:\n", 1)[1])
+        self.requested.append([tc["id"] for tc in cases])
+        for tc in cases:
+            body = "    this is not gherkin" if tc["title"] == "bad" else f"    Scenario: {tc['title']}\n      Given step {tc['id']}"
+            yield f"# tc: {tc['id']}\n"
+            yield body + "\n"
+
+
+@pytest.fixture
+def mem(tmp_path):
+    m = PersistentMemory(str(tmp_path / "memory.db"))
+    yield m
+    m.close()
+
+
+def test_case_function_names():
+    assert case_function_name("TC-01") == "test_tc_01"
+    assert case_function_name("") == "test_case"
+    assert case_function_names([{"id": "TC 1"}, {"id": "tc-1"}, {}]) == ["test_tc_1", "test_tc_1_x", "test_case_03"]
+
+
+def test_case_steps_flattens_steps_and_expected():
+    tc = {"steps": ["Open  the\npage", {"action": "Click login"}, ""], "expected": "Dashboard shown"}
+    assert case_steps(tc) == ["Open the page", "Click login", "Dashboard shown"]
+
+
+def test_check_python():
+    assert check_python("x = 1\n") is None
+    assert check_python("def f(:\n").startswith("line 1:")
+
+
+def test_assemble_module_hoists_and_dedupes_imports():
+    code = assemble_module([
+        '"""doc"""\nimport pytest\nfrom __future__ import annotations\n\n@pytest.mark.ui\ndef test_a():\n    pass\n',
+        "import pytest\nimport os\n\ndef test_b():\n    assert os\n",
+    ])
+    assert code.startswith("from __future__ import annotations\nimport pytest\nimport os\n")
+    assert code.count("import pytest") == 1
+    assert "@pytest.mark.ui\ndef test_a():" in code and '"""doc"""' not in code
+    assert check_python(code) is None
+
+
+def test_per_case_retries_failures_and_skips_what_never_compiles(tmp_path):
+    lm = PerCaseLM()
+    agent = AutomationAgent(lm=lm, mode="per_case", case_retries=1)
+    cases = [{"id": "TC_01", "title": "a"}, {"id": "TC_02", "title": "b"}, {"id": "TC_03", "title": "c"}]
+    out = agent.synthesize_pytests({"feature_id": "feat", "test_cases": cases}, str(tmp_path / "test_feat.py"))
+
+    code = open(out, encoding="utf-8").read()
+    assert check_python(code) is None
+    assert "def test_tc_01(page, base_url):" in code and "def test_tc_02(page, base_url):" in code
+    assert "@pytest.mark.skip(reason='synthesis failed: no code returned')\ndef test_tc_03():" in code
+    assert agent.last_synthesis_report == {
+        "mode": "per_case", "cases": 3, "retried": ["test_tc_02", "test_tc_03"], "failed": ["test_tc_03"]
+    }
+    # TC_01 is asked once, the others once more after failing
+    assert len(lm.prompts) == 5
+
+
+def test_learn_steps_asks_once_per_template_and_reuses_stored_snippets(mem):
+    steps = ['I type "alice" into "user"', 'I type "bob" into "user"', 'I type "x" into "search"']
+    first = AutomationAgent(lm=StepLM(), memory=mem)
+    learned = first.learn_steps(steps)
+
+    assert first.lm.calls == [['I type "alice" into "user"']]   # one template, one example step
+    assert learned == {
+        'I type "alice" into "user"': "page.fill('user', 'alice')",
+        'I type "bob" into "user"': "page.fill('user', 'bob')",
+        'I type "x" into "search"': "page.fill('search', 'x')",
+    }
+    assert first.last_learn_report == {
+        "steps": 3, "templates": 1, "cached": 0, "generated": 1, "model_calls": 1, "undefined": 0
+    }
+
+    # A new agent on the same memory needs no model call
+    second = AutomationAgent(lm=StepLM(), memory=mem)
+    assert second.learn_steps(['When I type "carol" into "pass"']) == {
+        'When I type "carol" into "pass"': "page.fill('pass', 'carol')"
+    }
+    assert second.lm.calls == [] and second.last_learn_report["cached"] == 1
+
+
+def test_learn_steps_drops_snippets_that_do_not_compile(mem):
+    agent = AutomationAgent(lm=StepLM(), memory=mem)
+    assert agent.learn_steps(['I click the broken "save" button']) == {}
+    assert agent.last_learn_report["undefined"] == 1
+    # Nothing was stored, so the next call asks again
+    agent.learn_steps(['I click the broken "save" button'])
+    assert len(agent.lm.calls) == 2
+
+
+def test_split_feature_blocks():
+    text = "Feature: F\n\n  # tc: TC_01 fp: abc\n  Scenario: A\n\n\n  # tc: TC_02\n  Scenario: B\n"
+    header, blocks = split_feature_blocks(text)
+    assert header == "Feature: F\n"
+    assert blocks == [("TC_01", "abc", "  # tc: TC_01 fp: abc\n  Scenario: A\n"),
+                      ("TC_02", None, "  # tc: TC_02\n  Scenario: B\n")]
+    assert split_feature_blocks("Feature: F\n") == ("Feature: F\n", [])
+
+
+def test_behave_feature_regenerates_only_changed_cases(tmp_path):
+    path = str(tmp_path / "features" / "feat.feature")
+    cases = [{"id": f"TC_0{i}", "title": f"case {i}", "steps": [f"do {i}"]} for i in (1, 2, 3)]
+    agent = AutomationAgent(lm=ScenarioLM())
+    chunks = []
+    agent.synthesize_behave_feature({"feature_id": "feat_cart", "test_cases": cases}, path, on_chunk=chunks.append)
+    first = open(path, encoding="utf-8").read()
+    assert first.startswith("Feature: feat cart\n")
+    assert "".join(chunks).count("# tc:") == 3
+    assert agent.last_feature_report == {"kept": 0, "generated": 3, "fallback": 0, "removed": 0, "model_calls": 1}
+
+    # Change TC_02, drop TC_03, add TC_04 (which the model gets wrong)
+    changed = [cases[0], dict(cases[1], title="case 2 edited"), {"id": "TC_04", "title": "bad", "steps": ["x"]}]
+    agent.synthesize_behave_feature({"feature_id": "feat_cart", "test_cases": changed}, path, on_chunk=chunks.append)
+    second = open(path, encoding="utf-8").read()
+    assert agent.lm.requested[-1] == ["TC_02", "TC_04"]
+    assert agent.last_feature_report == {"kept": 1, "generated": 1, "fallback": 1, "removed": 1, "model_calls": 1}
+    assert split_feature_blocks(second)[1][0] == split_feature_blocks(first)[1][0]
+    assert "Scenario: case 2 edited" in second and "case 3" not in second
+    assert "  Scenario: bad\n    When x\n" in second
+
+    # Nothing changed: no model call and the file is left alone
+    mtime = os.stat(path).st_mtime_ns
+    agent.synthesize_behave_feature({"feature_id": "feat_cart", "test_cases": changed}, path)
+    assert len(agent.lm.requested) == 2 and agent.last_feature_report["kept"] == 3
+    assert os.stat(path).st_mtime_ns == mtime
@@ -0,0 +1,44 @@
+import pytest
+
+from agents.conversation_agent import ConversationAgent
+from memory.persistent import PersistentMemory
+
+
+@pytest.fixture
+def mem(tmp_path):
+    m = PersistentMemory(str(tmp_path / "memory.db"))
+    yield m
+    m.close()
+
+
+def test_messages_are_persisted_as_they_are_added(mem):
+    conv = ConversationAgent(mem, "c1")
+    conv.add_user_msg("hi")
+    conv.add_agent_msg("hello")
+    assert ConversationAgent(mem, "c1").get_context() == "USER: hi\nAGENT: hello"
+
+
+def test_history_limit_loads_recent_turns_and_pages_back(mem):
+    conv = ConversationAgent(mem, "c1")
+    for i in range(5):
+        conv.add_user_msg(f"m{i}")
+
+    recent = ConversationAgent(mem, "c1", history_limit=2)
+    assert [t["text"] for t in recent.history] == ["m3", "m4"] and recent.has_older
+    assert [t["text"] for t in recent.load_older(2)] == ["m1", "m2"]
+    assert recent.has_older
+    recent.load_older(2)
+    assert [t["text"] for t in recent.history] == ["m0", "m1", "m2", "m3", "m4"]
+    assert not recent.has_older and recent.load_older() == []
+
+
+def test_save_is_skipped_while_older_turns_are_not_loaded(mem):
+    conv = ConversationAgent(mem, "c1")
+    for i in range(3):
+        conv.add_user_msg(f"m{i}")
+    partial = ConversationAgent(mem, "c1", history_limit=1)
+    partial.save()
+    assert mem.count_turns("c1") == 3
+
+    partial.reset()
+    assert mem.count_turns("c1") == 0
@@ -0,0 +1,108 @@
+import pytest
+
+from agents.execution_agent import (
+    ExecutionAgent,
+    junit_key,
+    map_testcase_ids,
+    merge_junit,
+    parse_junit,
+    write_error_junit,
+)
+
+plan_shards = ExecutionAgent.plan_shards
+
+
+@pytest.mark.parametrize("nodeid, key", [
+    ("tests/test_login.py::test_ok", "tests.test_login::test_ok"),
+    ("tests/test_login.py::TestLogin::test_ok[a]", "tests.test_login.TestLogin::test_ok[a]"),
+    ("test_x.py", "test_x::"),
+])
+def test_junit_key(nodeid, key):
+    assert junit_key(nodeid) == key
+
+
+def test_plan_shards_balances_by_duration():
+    ids = [f"t.py::test_{c}" for c in "abcde"]
+    durations = {junit_key(ids[0]): 10.0, junit_key(ids[1]): 6.0, junit_key(ids[2]): 4.0,
+                 junit_key(ids[3]): 3.0, junit_key(ids[4]): 3.0}
+    shards = plan_shards(ids, 2, durations)
+    loads = sorted(sum(durations[junit_key(t)] for t in s) for s in shards)
+    assert loads == [13.0, 13.0]
+    # Every test lands in exactly one shard, kept in collection order
+    assert sorted(t for s in shards for t in s) == ids
+    for s in shards:
+        assert s == sorted(s, key=ids.index)
+
+
+def test_plan_shards_unknown_tests_use_the_median():
+    ids = ["t.py::test_big", "t.py::test_a", "t.py::test_b", "t.py::test_new"]
+    durations = {junit_key(ids[0]): 3.0, junit_key(ids[1]): 1.0, junit_key(ids[2]): 1.0}
+    # test_new weighs the 1.0 s median, not DEFAULT_TEST_SECONDS, so it joins the short tests
+    assert plan_shards(ids, 2, durations) == [["t.py::test_big"], ["t.py::test_a", "t.py::test_b", "t.py::test_new"]]
+
+
+def test_plan_shards_never_returns_empty_shards():
+    assert plan_shards(["t.py::test_a"], 4, {}) == [["t.py::test_a"]]
+    assert plan_shards(["t.py::test_a", "t.py::test_b"], 0, {}) == [["t.py::test_a", "t.py::test_b"]]
+
+
+def test_map_testcase_ids_matches_whole_tokens():
+    cases = [{"name": n} for n in ("test_tc_01_login", "test_tc_010[chromium]", "test_login_tc_01", "test_other")]
+    map_testcase_ids(cases, [{"id": "TC_01"}, {"id": "TC-010"}, {"title": "no id"}])
+    assert [c["testcase_id"] for c in cases] == ["TC_01", "TC-010", "TC_01", None]
+
+
+def test_map_testcase_ids_prefers_the_longest_id():
+    cases = [{"name": "test_feat_tc_01_2"}]
+    map_testcase_ids(cases, [{"id": "TC_01"}, {"id": "TC_01_2"}])
+    assert cases[0]["testcase_id"] == "TC_01_2"
+
+
+def test_parse_and_merge_junit(tmp_path):
+    a, b = tmp_path / "a.xml", tmp_path / "b.xml"
+    a.write_text(
+        '<testsuites><testsuite name="pytest">'
+        '<testcase classname="t" name="test_ok" time="0.5"/>'
+        '<testcase classname="t" name="test_bad" time="1"><failure message="boom">trace</failure></testcase>'
+        '</testsuite></testsuites>'
+    )
+    b.write_text('<testsuite name="pytest"><testcase classname="u" name="test_skip"><skipped/></testcase></testsuite>')
+    merged = tmp_path / "merged.xml"
+    merge_junit([str(a), str(b), str(tmp_path / "missing.xml")], str(merged))
+
+    records = parse_junit(str(merged))
+    assert [(r["key"], r["outcome"]) for r in records] == [
+        ("t::test_ok", "passed"), ("t::test_bad", "failed"), ("u::test_skip", "skipped")
+    ]
+    assert records[1]["message"] == "boom"
+    assert records[1]["duration"] == 1.0
+    assert parse_junit(str(tmp_path / "missing.xml")) == []
+
+
+def test_timed_out_shard_reports_its_tests_as_errors(tmp_path):
+    suite = tmp_path / "test_slow.py"
+    suite.write_text(
+        "import time\n\n"
+        "def test_fast():\n    pass\n\n"
+        "def test_slow():\n    time.sleep(30)\n"
+    )
+    agent = ExecutionAgent(shard_timeout=3, durations_path=str(tmp_path / "durations.json"),
+                           results_dir=str(tmp_path / "results"))
+    report = agent.run(str(suite))
+
+    assert report["returncode"] != 0
+    assert report["shards"][0]["timed_out"]
+    assert report["tests"] == {"error": 2}
+    assert sorted(c["name"] for c in report["cases"]) == ["test_fast", "test_slow"]
+    assert all("exceeded 3s" in c["message"] for c in report["cases"])
+    assert [r["outcome"] for r in parse_junit(report["junit"])] == ["error", "error"]
+
+
+def test_write_error_junit(tmp_path):
+    path = tmp_path / "timeout.xml"
+    write_error_junit(str(path), ["t/test_a.py::test_one", "t/test_a.py::TestB::test_two"], "killed", 4.0)
+    records = parse_junit(str(path))
+    assert [(r["key"], r["outcome"], r["duration"]) for r in records] == [
+        ("t.test_a::test_one", "error", 2.0), ("t.test_a.TestB::test_two", "error", 2.0)
+    ]
+    assert records[0]["message"] == "killed"
@@ -0,0 +1,144 @@
+import pytest
+
+from agents.gherkin import (
+    GherkinError,
+    StepRegistry,
+    compile_feature,
+    default_registry,
+    expand_scenarios,
+    parse_feature,
+    undefined_steps,
+)
+
+FEATURE = '''@web
+Feature: Login
+  Users sign in with email.
+
+  Background:
+    Given I open the "/login" page
+
+  @smoke
+  Scenario: Valid login
+    When I enter "bob@example.com" into "Email"
+    And I click "Sign in" button
+    Then I should see "Welcome"
+
+  Scenario Outline: Bad password for <user>
+    When I enter "<user>" into "Email"
+    Then the user is told "<message>"
+
+    @negative
+    Examples: Wrong
+      | user | message       |
+      | ann  | Wrong password |
+      | bob  | Locked         |
+'''
+
+
+def test_parse_feature_structure():
+    feature = parse_feature(FEATURE)
+    assert feature["name"] == "Login"
+    assert feature["description"] == "Users sign in with email."
+    assert [st["text"] for st in feature["background"]] == ['I open the "/login" page']
+    valid, outline = feature["scenarios"]
+    assert valid["tags"] == ["web", "smoke"]
+    assert [st["type"] for st in valid["steps"]] == ["When", "When", "Then"]
+    assert outline["outline"]
+    assert outline["examples"][0]["header"] == ["user", "message"]
+
+
+def test_expand_scenarios_fills_outline_rows():
+    scenarios = expand_scenarios(parse_feature(FEATURE))
+    assert [sc["name"] for sc in scenarios] == ["Valid login", "Bad password for ann", "Bad password for bob"]
+    ann = scenarios[1]
+    assert ann["example"] == ("Wrong", 1)
+    assert ann["tags"] == ["web", "negative"]
+    # Background first, then the scenario's own steps with placeholders filled
+    assert [st["text"] for st in ann["steps"]] == [
+        'I open the "/login" page', 'I enter "ann" into "Email"', 'the user is told "Wrong password"'
+    ]
+
+
+def test_doc_strings_and_tables_attach_to_the_previous_step():
+    feature = parse_feature('''Feature: F
+  Scenario: S
+    When I fill in the form:
+      | field | value |
+      | Name  | a \\| b |
+    And I enter the following into "Bio":
+      """
+      line one
+        indented
+      """
+''')
+    fill, bio = feature["scenarios"][0]["steps"]
+    assert fill["table"] == [["field", "value"], ["Name", "a | b"]]
+    assert bio["doc"] == "line one\n  indented"
+
+
+@pytest.mark.parametrize("text, message", [
+    ("Scenario: no feature", "before Feature"),
+    ("Feature: F\n  Given a step", "step outside"),
+    ("Feature: F\n  Scenario Outline: O\n    Given <x>", "no Examples rows"),
+    ("Feature: F\n  Scenario: S\n    Given x\n    \"\"\"\n    open", "unterminated doc string"),
+])
+def test_malformed_features_raise(text, message):
+    with pytest.raises(GherkinError, match=message):
+        parse_feature(text)
+
+
+def test_registry_first_match_wins_and_decorator_form():
+    registry = StepRegistry(defaults=False)
+
+    @registry.register(r"the user is told (.+)")
+    def told(step, message):
+        return f"assert {message}"
+
+    registry.register(r"the user is (.+)", lambda step, rest: "pass")
+    assert registry.compile_step({"text": "The user is told x"}) == ["assert x"]
+    assert registry.compile_step({"text": "something else"}) is None
+
+
+def test_undefined_steps_are_distinct_and_expanded():
+    assert undefined_steps(parse_feature(FEATURE), default_registry()) == [
+        'the user is told "Wrong password"', 'the user is told "Locked"'
+    ]
+
+
+def test_compile_feature_builds_a_valid_module():
+    feature = parse_feature(FEATURE)
+    code = compile_feature(feature, default_registry(), {'the user is told "Locked"': "assert True"}, source="login.feature")
+    compile(code, "test_login.py", "exec")
+    assert "def test_valid_login(page, base_url):" in code
+    assert "def test_bad_password_for_ann_1(page, base_url):" in code
+    assert "@pytest.mark.smoke" in code and "@pytest.mark.negative" in code
+    assert "page.goto(base_url.rstrip('/') + '/login')" in code
+    assert "page.get_by_role('button', name='Sign in').click()" in code
+    # A step with neither a definition nor learned code skips its test
+    assert "pytest.skip('undefined step: the user is told \"Wrong password\"')" in code
+    assert "    assert True" in code
+
+
+def test_tags_become_valid_marker_names():
+    feature = parse_feature("Feature: F\n  @JIRA-12 @2fa @xfail\n  Scenario: S\n    Given I go back\n")
+    code = compile_feature(feature, default_registry())
+    assert "@pytest.mark.JIRA_12" in code
+    assert "@pytest.mark.tag_2fa" in code
+    assert "@pytest.mark.xfail" in code
+    assert code.splitlines()[1] == "# pytest markers: JIRA_12 tag_2fa"
+
+
+def test_tags_named_like_builtin_marks_are_escaped():
+    feature = parse_feature("Feature: F\n  @parametrize @skipif @usefixtures @skip @smoke\n  Scenario: S\n    Given I go back\n")
+    code = compile_feature(feature, default_registry())
+    compile(code, "test_f.py", "exec")
+    for tag in ("parametrize", "skipif", "usefixtures"):
+        assert f"@pytest.mark.tag_{tag}\n" in code
+        assert f"@pytest.mark.{tag}\n" not in code
+    assert "@pytest.mark.skip\n" in code
+    assert code.splitlines()[1] == "# pytest markers: tag_parametrize tag_skipif tag_usefixtures smoke"
+
+
+def test_untagged_feature_has_no_markers_header():
+    code = compile_feature(parse_feature("Feature: F\n  Scenario: S\n    Given I go back\n"), default_registry())
+    assert "# pytest markers:" not in code
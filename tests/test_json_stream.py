@@ -0,0 +1,52 @@
+import pytest
+
+from agents.json_stream import TestCaseStreamParser, iter_test_cases, parse_json_value, parse_test_cases
+
+DOC = '{"feature_id": "feat_login", "test_cases": [{"id": "TC_01", "title": "a {brace}"}, {"id": "TC_02", "steps": ["x"]}]}'
+
+
+def test_items_are_emitted_as_they_close():
+    parser = TestCaseStreamParser()
+    seen = []
+    for i in range(0, len(DOC), 7):
+        seen += [tc["id"] for tc in parser.feed(DOC[i:i + 7])]
+    assert seen == ["TC_01", "TC_02"]
+    assert parser.complete
+    assert parser.meta == {"feature_id": "feat_login"}
+    assert parser.result()["feature_id"] == "feat_login"
+
+
+def test_iter_test_cases_skips_fences_and_prose():
+    chunks = ["Here you go:\n```json\n", DOC[:40], DOC[40:], "\n```"]
+    assert [tc["id"] for tc in iter_test_cases(chunks)] == ["TC_01", "TC_02"]
+
+
+def test_truncated_output_keeps_completed_items():
+    result = parse_test_cases(DOC[:DOC.index('{"id": "TC_02"') + 10])
+    assert [tc["id"] for tc in result["test_cases"]] == ["TC_01"]
+    assert result["feature_id"] == "feat_login"
+
+
+def test_trailing_commas_are_tolerated():
+    result = parse_test_cases('{"test_cases": [{"id": "TC_01",},]}')
+    assert result["test_cases"] == [{"id": "TC_01"}]
+
+
+def test_bare_list():
+    assert parse_test_cases('[{"id": "A"}, {"id": "B"}]')["test_cases"] == [{"id": "A"}, {"id": "B"}]
+
+
+@pytest.mark.parametrize("raw", ["", "no json here", '{"test_cases": [{"id": '])
+def test_unusable_output_raises(raw):
+    with pytest.raises(ValueError):
+        parse_test_cases(raw)
+
+
+def test_parse_json_value_ignores_braces_outside_the_value():
+    raw = 'Sure: {"i click {0}": "page.click(arg0)  # }",}\nUse {braces} with care.'
+    assert parse_json_value(raw) == {"i click {0}": "page.click(arg0)  # }"}
+
+
+@pytest.mark.parametrize("raw", [None, "", "prose only", '{"a": 1'])
+def test_parse_json_value_none_without_a_complete_value(raw):
+    assert parse_json_value(raw) is None
@@ -0,0 +1,37 @@
+from types import SimpleNamespace
+
+from agents import rate_limiter
+from agents.llm_client import LMClient
+from agents.rate_limiter import RateLimiter
+from agents.response_cache import ResponseCache
+
+
+class StreamingModel:
+    def generate_content(self, prompt, generation_config=None, stream=False):
+        return iter([SimpleNamespace(text="one "), SimpleNamespace(text="two")])
+
+
+def _client(limiter, tmp_path):
+    # A cache of its own: with an API key in the environment the default is the shared disk cache
+    lm = LMClient(cache=ResponseCache(db_path=str(tmp_path / "llm_cache.db")), limiter=limiter)
+    lm.use_mock = False
+    lm.model = StreamingModel()
+    return lm
+
+
+def test_generate_stream_holds_no_slot_while_suspended(tmp_path):
+    limiter = RateLimiter(max_concurrency=1)
+    stream = _client(limiter, tmp_path).generate_stream("prompt")
+
+    assert next(stream) == "one "
+    # Suspended at a yield: the slot is free and the flag is not set here
+    assert limiter._slots.in_use == 0
+    assert rate_limiter._holding_slot.get() is False
+    with limiter.slot():
+        assert limiter._slots.in_use == 1
+    del stream   # abandoned mid-stream
+    assert limiter._slots.in_use == 0
+
+
+def test_generate_stream_yields_every_chunk(tmp_path):
+    assert list(_client(RateLimiter(max_concurrency=1), tmp_path).generate_stream("prompt")) == ["one ", "two"]
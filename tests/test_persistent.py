@@ -0,0 +1,147 @@
+import sqlite3
+
+import pytest
+
+from memory.persistent import PersistentMemory
+
+FEATURE = {
+    "feature_id": "feat_login",
+    "title": "Login",
+    "test_cases": [
+        {"id": "TC_01", "title": "valid login", "steps": ["enter email", "submit"]},
+        {"id": "TC_02", "title": "wrong password", "steps": ["enter bad password"]},
+    ],
+}
+
+
+@pytest.fixture
+def mem(tmp_path):
+    m = PersistentMemory(str(tmp_path / "memory.db"))
+    yield m
+    m.close()
+
+
+def _edited(**changes):
+    doc = dict(FEATURE, test_cases=[dict(tc) for tc in FEATURE["test_cases"]])
+    doc.update(changes)
+    return doc
+
+
+def test_every_change_is_a_new_revision(mem):
+    mem.save_feature("feat_login", FEATURE)
+    changed = _edited(title="Sign in")
+    mem.save_feature("feat_login", changed)
+
+    assert [v[0] for v in mem.list_versions("feat_login")] == [2, 1]
+    assert mem.get_feature("feat_login") == changed
+    assert mem.get_feature_version("feat_login", 1) == FEATURE
+    assert mem.get_feature_version("feat_login", 3) is None
+
+
+def test_saving_identical_content_is_a_no_op(mem):
+    mem.save_feature("feat_login", FEATURE)
+    mem.save_feature("feat_login", _edited())
+    assert len(mem.list_versions("feat_login")) == 1
+
+
+def test_test_case_bodies_are_stored_once(mem):
+    mem.save_feature("feat_login", FEATURE)
+    mem.save_feature("feat_login", _edited(title="Sign in"))
+    mem.save_feature("feat_copy", _edited(feature_id="feat_copy"))
+    assert mem.conn.execute("SELECT COUNT(*) FROM content_blobs").fetchone()[0] == 2
+
+
+def test_diff_versions(mem):
+    mem.save_feature("feat_login", FEATURE)
+    new = _edited(title="Sign in")
+    new["test_cases"][0]["steps"] = ["enter email", "press enter"]
+    new["test_cases"][1:] = [{"id": "TC_03", "title": "locked account"}]
+    mem.save_feature("feat_login", new)
+
+    assert mem.diff_versions("feat_login", 1, 2) == {
+        "feature_id": "feat_login",
+        "from": 1,
+        "to": 2,
+        "fields_changed": ["title"],
+        "added": ["TC_03"],
+        "removed": ["TC_02"],
+        "changed": ["TC_01"],
+    }
+
+
+def test_legacy_row_becomes_the_first_revision(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE features (feature_id TEXT PRIMARY KEY, data TEXT, updated_ts TEXT)")
+    conn.execute("INSERT INTO features VALUES ('feat_old', '{\"title\": \"Old\"}', datetime('now'))")
+    conn.commit()
+    conn.close()
+
+    mem = PersistentMemory(path)
+    try:
+        assert mem.get_feature("feat_old") == {"title": "Old"}
+        assert mem.get_feature_version("feat_old", 1) == {"title": "Old"}
+        mem.save_feature("feat_old", {"title": "New"})
+        assert [v[0] for v in mem.list_versions("feat_old")] == [2, 1]
+        assert mem.get_feature_version("feat_old", 1) == {"title": "Old"}
+        assert mem.diff_versions("feat_old", 1, 2)["fields_changed"] == ["title"]
+    finally:
+        mem.close()
+
+
+def test_read_cache_follows_new_revisions(mem):
+    mem.save_feature("feat_login", FEATURE)
+    mem.get_feature("feat_login")
+    mem.get_feature("feat_login")
+    mem.save_feature("feat_login", _edited(title="Sign in"))
+    assert mem.get_feature("feat_login")["title"] == "Sign in"
+    stats = mem.cache_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 2
+
+
+def test_internal_keys_stay_out_of_listings_and_search(mem):
+    mem.save_feature("feat_login", {"title": "Login"})
+    mem.save_feature("feat_login_tcs", FEATURE)
+    mem.save_feature("feat_login_manifest", {"title": "Login manifest", "slices": {}})
+
+    assert [row[0] for row in mem.list_features()] == ["feat_login"]
+    hits = mem.search_features("login")
+    assert {(h["source_key"], h["kind"]) for h in hits} == {
+        ("feat_login", "feature"), ("feat_login_tcs", "test_case")
+    }
+    assert all(h["feature_id"] == "feat_login" for h in hits)
+
+
+def test_conversation_turns_are_appended_and_paged(mem):
+    seqs = [mem.append_turn("c1", "user" if i % 2 == 0 else "agent", f"msg {i}") for i in range(5)]
+    mem.append_turn("c2", "user", "other")
+    assert seqs == [1, 2, 3, 4, 5]
+    assert mem.count_turns("c1") == 5
+
+    last = mem.load_conversation("c1", limit=2)
+    assert [t["text"] for t in last] == ["msg 3", "msg 4"]
+    older = mem.load_conversation("c1", limit=2, before_seq=last[0]["seq"])
+    assert [(t["seq"], t["role"]) for t in older] == [(2, "agent"), (3, "user")]
+
+    mem.save_conversation("c1", [{"role": "user", "text": "edited"}])
+    assert mem.load_conversation("c1") == [{"role": "user", "text": "edited", "seq": 1}]
+    mem.clear_conversation("c1")
+    assert mem.load_conversation("c1") == [] and mem.count_turns("c2") == 1
+
+
+def test_legacy_conversation_blob_is_migrated(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE conversations (conv_id TEXT PRIMARY KEY, history TEXT, updated_ts TEXT)")
+    conn.execute("INSERT INTO conversations VALUES ('c1', '[{\"role\": \"user\", \"text\": \"hi\"}, "
+                 "{\"role\": \"agent\", \"text\": \"hello\"}]', datetime('now'))")
+    conn.commit()
+    conn.close()
+
+    mem = PersistentMemory(path)
+    try:
+        assert [t["text"] for t in mem.load_conversation("c1")] == ["hi", "hello"]
+        assert mem.append_turn("c1", "user", "again") == 3
+    finally:
+        mem.close()
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+
+from agents.gherkin import compile_feature, default_registry, parse_feature
+from agents.playwright_conftest import MARKER, write_conftest
+
+
+def test_writes_a_valid_conftest(tmp_path):
+    path = write_conftest(str(tmp_path / "generated"), "http://app.local")
+    with open(path, encoding="utf-8") as f:
+        code = f.read()
+    assert code.startswith(MARKER)
+    assert "'http://app.local'" in code
+    compile(code, path, "exec")
+
+
+def test_unchanged_content_is_not_rewritten(tmp_path):
+    path = write_conftest(str(tmp_path), "http://app.local")
+    inode = os.stat(path).st_ino
+    write_conftest(str(tmp_path), "http://app.local")
+    assert os.stat(path).st_ino == inode
+
+    write_conftest(str(tmp_path), "http://other.local")
+    with open(path, encoding="utf-8") as f:
+        assert "'http://other.local'" in f.read()
+    assert os.listdir(tmp_path) == ["conftest.py"]
+
+
+def test_hand_written_conftest_is_kept(tmp_path):
+    path = tmp_path / "conftest.py"
+    path.write_text("# my fixtures\n")
+    write_conftest(str(tmp_path), "http://app.local")
+    assert path.read_text() == "# my fixtures\n"
+
+
+def test_registers_the_markers_of_compiled_modules(tmp_path):
+    feature = parse_feature("Feature: F\n  @smoke @filterwarnings\n  Scenario: S\n    Given I go back\n")
+    (tmp_path / "test_f.py").write_text(compile_feature(feature, default_registry()))
+    write_conftest(str(tmp_path), "http://app.local")
+    p = subprocess.run([sys.executable, "-m", "pytest", "--strict-markers", "--collect-only", "-q",
+                        "-p", "no:cacheprovider", "-m", "smoke and tag_filterwarnings", str(tmp_path)],
+                       capture_output=True, text=True, cwd=str(tmp_path))
+    assert p.returncode == 0, p.stdout + p.stderr
+    assert "test_f.py::test_s" in p.stdout
@@ -0,0 +1,53 @@
+import json
+
+from agents.prompt_budget import PromptBudgeter, PromptSection
+from agents.rate_limiter import estimate_tokens
+
+
+def test_everything_fits():
+    rendered, report = PromptBudgeter(1000).fit([
+        PromptSection("story", "As a user I want to log in", required=True),
+        PromptSection("context", {"a": 1}, priority=2),
+        PromptSection("images", [], priority=3),
+    ], overhead_tokens=50)
+    assert rendered == {"story": "As a user I want to log in", "context": '{"a":1}', "images": "None"}
+    assert all(s["dropped"] == 0 for s in report["sections"].values())
+    assert report["total"] == 50 + estimate_tokens(rendered["story"]) + estimate_tokens(rendered["context"])
+
+
+def test_lower_priority_is_truncated_first():
+    items = [f"item number {i}" for i in range(50)]
+    budgeter = PromptBudgeter(200, min_section_tokens=16)
+    rendered, report = budgeter.fit([
+        PromptSection("story", "x" * 400, required=True),        # 100 tokens
+        PromptSection("late", list(items), priority=5),
+        PromptSection("early", list(items), priority=1),
+    ])
+    assert rendered["story"] == "x" * 400
+    assert json.loads(rendered["early"]) == items[:len(json.loads(rendered["early"]))]
+    assert report["sections"]["early"]["dropped"] > 0
+    # Nothing left for the lower-priority section
+    assert rendered["late"] == "None"
+    assert report["sections"]["late"]["tokens"] == 0
+    assert report["total"] <= 200
+    assert budgeter.last_report is report
+
+
+def test_dict_sections_shrink_their_longest_list():
+    value = {"title": "Login", "flows": [f"flow {i}" for i in range(40)], "tags": ["a"]}
+    rendered, _ = PromptBudgeter(60).fit([PromptSection("feature", value)])
+    kept = json.loads(rendered["feature"])
+    assert kept["title"] == "Login" and kept["tags"] == ["a"]
+    assert 0 < len(kept["flows"]) < 40
+
+
+def test_long_strings_are_cut():
+    rendered, _ = PromptBudgeter(50).fit([PromptSection("notes", "word " * 200)])
+    assert rendered["notes"].endswith(" …[truncated]")
+    assert estimate_tokens(rendered["notes"]) <= 50
+
+
+def test_required_sections_are_never_shortened():
+    rendered, report = PromptBudgeter(10).fit([PromptSection("story", "y" * 400, required=True)])
+    assert rendered["story"] == "y" * 400
+    assert report["total"] > 10
@@ -0,0 +1,114 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from agents import rate_limiter
+from agents.rate_limiter import RateLimiter, SharedSlots, TokenBucket, estimate_tokens
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abc") == 1
+    assert estimate_tokens("x" * 41) == 11
+
+
+def test_token_bucket_books_in_arrival_order(clock):
+    bucket = TokenBucket(60)   # one per second
+    assert bucket.reserve(60) == 0.0
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    assert bucket.reserve(1) == pytest.approx(2.0)
+    clock[0] += 10
+    assert bucket.reserve(1) == 0.0
+
+
+def test_rate_limiter_counts_throttled_requests(clock):
+    limiter = RateLimiter(rpm=1)
+    assert limiter._reserve(0) == 0.0
+    assert limiter._reserve(0) == pytest.approx(60.0)
+    assert limiter.stats["requests"] == 2 and limiter.stats["throttled"] == 1
+
+
+def test_slots_are_shared_by_threads_and_event_loops():
+    slots = SharedSlots(2)
+    in_use, peak = [0], [0]
+    lock = threading.Lock()
+
+    def enter():
+        with lock:
+            in_use[0] += 1
+            peak[0] = max(peak[0], in_use[0])
+
+    def leave():
+        with lock:
+            in_use[0] -= 1
+
+    def worker():
+        slots.acquire()
+        enter()
+        time.sleep(0.02)
+        leave()
+        slots.release()
+
+    async def task():
+        await slots.acquire_async()
+        enter()
+        await asyncio.sleep(0.02)
+        leave()
+        slots.release()
+
+    async def tasks():
+        await asyncio.gather(*(task() for _ in range(4)))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    threads.append(threading.Thread(target=asyncio.run, args=(tasks(),)))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+
+    assert peak[0] == 2
+    assert slots.in_use == 0
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    slots = SharedSlots(1)
+    slots.acquire()
+
+    async def main():
+        waiter = asyncio.ensure_future(slots.acquire_async())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(main())
+    slots.release()
+    assert slots.in_use == 0
+
+
+def test_nested_slots_pass_through():
+    limiter = RateLimiter(max_concurrency=1)
+
+    def nested():
+        with limiter.slot():
+            return limiter._slots.in_use
+
+    async def main():
+        async with limiter.async_slot():
+            # to_thread copies the context, so the worker does not wait for a second slot
+            return await asyncio.wait_for(asyncio.to_thread(nested), 5)
+
+    assert asyncio.run(main()) == 1
+    with limiter.slot():
+        with limiter.slot():
+            assert limiter._slots.in_use == 1
+    assert limiter._slots.in_use == 0
@@ -0,0 +1,38 @@
+import threading
+
+from agents.registry import per_thread
+
+
+class Agent:
+    last_report = per_thread(dict)
+    history = per_thread(list)
+
+
+def test_per_thread_values_are_isolated():
+    agent = Agent()
+    agent.last_report = {"thread": "main"}
+    barrier = threading.Barrier(4)
+    seen = {}
+
+    def worker(i):
+        assert agent.last_report == {}   # fresh default in every thread
+        agent.last_report = {"thread": i}
+        barrier.wait()                   # all threads have written before any reads back
+        seen[i] = agent.last_report
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+
+    assert seen == {i: {"thread": i} for i in range(4)}
+    assert agent.last_report == {"thread": "main"}
+
+
+def test_per_thread_values_are_per_instance():
+    a, b = Agent(), Agent()
+    a.history.append("x")
+    assert b.history == [] and a.history == ["x"]
+    assert isinstance(Agent.__dict__["history"], per_thread)
+
@@ -0,0 +1,67 @@
+import pytest
+
+from agents import response_cache
+from agents.response_cache import ResponseCache, make_cache_key
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "time", lambda: now[0])
+    return now
+
+
+def _cache(tmp_path, **kwargs):
+    return ResponseCache(db_path=str(tmp_path / "llm_cache.db"), **kwargs)
+
+
+def test_cache_key_depends_on_every_request_field():
+    key = make_cache_key("m", "prompt", 100, {"temperature": 0.0})
+    assert key == make_cache_key("m", "prompt", 100, {"temperature": 0.0})
+    assert key != make_cache_key("m2", "prompt", 100, {"temperature": 0.0})
+    assert key != make_cache_key("m", "prompt", 200, {"temperature": 0.0})
+    assert key != make_cache_key("m", "prompt", 100, {"temperature": 0.5})
+
+
+def test_hits_come_from_memory_then_disk(tmp_path, clock):
+    cache = _cache(tmp_path)
+    assert cache.get("k") is None
+    cache.set("k", "answer")
+    assert cache.get("k") == "answer"
+
+    # A new process only has the disk tier
+    reopened = _cache(tmp_path)
+    assert reopened.get("k") == "answer"
+    assert reopened.get("k") == "answer"
+    assert reopened.stats["disk_hits"] == 1 and reopened.stats["memory_hits"] == 1
+    assert cache.stats["misses"] == 1 and cache.hit_rate() == 0.5
+
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = _cache(tmp_path, ttl_seconds=60)
+    cache.set("k", "answer")
+    clock[0] += 61
+    assert cache.get("k") is None
+    assert _cache(tmp_path, ttl_seconds=60).get("k") is None
+
+
+def test_errors_are_never_cached(tmp_path, clock):
+    cache = _cache(tmp_path)
+    cache.set("k", "[genai_error] quota exceeded")
+    assert cache.get("k") is None
+    assert cache.stats["stores"] == 0
+
+
+def test_disk_tier_evicts_least_recently_accessed(tmp_path, clock):
+    cache = _cache(tmp_path, max_memory_items=1, max_disk_items=2)
+    cache.set("a", "1")
+    clock[0] += 1
+    cache.set("b", "2")
+    clock[0] += 1
+    assert cache.get("a") == "1"   # from disk; refreshes its access time
+    clock[0] += 1
+    cache.set("c", "3")
+
+    reopened = _cache(tmp_path)
+    assert reopened.get("b") is None
+    assert reopened.get("a") == "1" and reopened.get("c") == "3"
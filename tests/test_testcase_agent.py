@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+from agents import testcase_agent
+from memory.persistent import PersistentMemory
+
+FEATURE = {
+    "feature_id": "feat_cart",
+    "flows": ["Add to cart", {"name": "Checkout"}],
+    "screens": ["Cart page"],
+}
+
+
+class FakeLM:
+    """Answers every fan-out prompt with the same two test cases."""
+
+    def __init__(self):
+        self.async_calls = 0
+        self.sync_calls = 0
+
+    async def agenerate(self, prompt, max_output_tokens=None):
+        self.async_calls += 1
+        return json.dumps({"test_cases": [{"id": "x", "title": "Empty cart"}, {"id": "y", "title": f"Case {self.async_calls}"}]})
+
+    def generate(self, prompt, max_output_tokens=None):
+        self.sync_calls += 1
+        return json.dumps({"test_cases": [{"id": "TC_01", "title": "Single prompt"}]})
+
+
+@pytest.fixture
+def mem(tmp_path):
+    m = PersistentMemory(str(tmp_path / "memory.db"))
+    yield m
+    m.close()
+
+
+def _agent(mem, **kwargs):
+    return testcase_agent.TestCaseAgent(lm=FakeLM(), memory=mem, **kwargs)
+
+
+def test_plan_slices_one_per_flow_then_screen(mem):
+    slices = _agent(mem)._plan_slices(FEATURE)
+    assert [s["key"] for s in slices] == ["ADD_TO_CART", "CHECKOUT", "CART_PAGE"]
+    assert slices[2]["focus"] == {"screen": "Cart page"}
+
+    by_type = _agent(mem)._plan_slices(FEATURE, split_by_type=True)
+    assert len(by_type) == 3 * len(testcase_agent.TestCaseAgent.FAN_OUT_TYPES)
+    assert all("type" in s["focus"] for s in by_type)
+
+
+def test_merge_slices_drops_duplicate_titles_and_renumbers(mem):
+    agent = _agent(mem)
+    slices = agent._plan_slices(FEATURE)[:2]
+    results = [
+        [{"id": "TC_01", "title": "Add item"}, {"id": "TC_02", "title": "Empty cart"}],
+        [{"id": "TC_01", "title": "  empty   CART "}, {"id": "TC_02", "title": "Pay", "flow": "Payment"}],
+    ]
+    merged = agent._merge_slices("feat_cart", slices, results)
+
+    assert [tc["title"] for tc in merged["test_cases"]] == ["Add item", "Empty cart", "Pay"]
+    assert [tc["id"] for tc in merged["test_cases"]] == [
+        "feat_cart_ADD_TO_CART_TC_01",
+        "feat_cart_ADD_TO_CART_TC_02",
+        "feat_cart_CHECKOUT_TC_01",
+    ]
+    # The slice focus fills in missing keys but never overrides the model's
+    assert merged["test_cases"][0]["flow"] == "Add to cart"
+    assert merged["test_cases"][2]["flow"] == "Payment"
+    # Inputs are not mutated
+    assert results[0][0]["id"] == "TC_01"
+
+
+def test_env_switch_enables_fan_out(mem, monkeypatch):
+    monkeypatch.setenv("TESTCASE_FAN_OUT", "1")
+    agent = _agent(mem)
+    assert agent.fan_out and not agent.split_by_type
+
+    parsed = agent.generate(dict(FEATURE))
+    assert agent.lm.async_calls == 3 and agent.lm.sync_calls == 0
+    assert len(parsed["test_cases"]) == 4  # "Empty cart" is kept once
+    assert mem.get_feature("feat_cart_tcs") == parsed
+
+
+def test_explicit_argument_overrides_agent_default(mem, monkeypatch):
+    monkeypatch.setenv("TESTCASE_FAN_OUT", "1")
+    agent = _agent(mem, fan_out=False)
+    parsed = agent.generate(dict(FEATURE))
+    assert agent.lm.sync_calls == 1 and agent.lm.async_calls == 0
+    assert parsed["test_cases"][0]["title"] == "Single prompt"
+
+    parsed = agent.generate(dict(FEATURE), fan_out=True)
+    assert agent.lm.async_calls == 3
@@ -0,0 +1,89 @@
+# tools/import_budget.py
+"""
+Startup benchmark: fails (exit 1) when importing a module takes longer than
+the budget.
+
+    python tools/import_budget.py                      # agents.testcase_agent
+    python tools/import_budget.py --budget-ms 75 --module agents.requirement_agent
+
+Each run is a fresh interpreter using `python -X importtime`; the module's
+cumulative import time is taken from that report, and the median of --runs
+runs is compared against --budget-ms (default IMPORT_BUDGET_MS or 75: about
+the ~50 ms measured after deferring the SDK imports plus a margin, well
+below the ~84 ms of the old eager imports, so that regression is caught).
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module: str, python: str = sys.executable):
+    """Return (cumulative_us for module, [(cumulative_us, name)] of its top-level imports)."""
+    proc = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr.strip().splitlines()[-1]}")
+
+    total = None
+    rows = []
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if not m:
+            continue
+        cumulative, indent, name = int(m.group(2)), len(m.group(3)), m.group(4)
+        if name == module:
+            total = cumulative
+        rows.append((cumulative, indent, name))
+    if total is None:
+        raise RuntimeError(f"{module} not found in -X importtime output")
+    # -X importtime prints children before their parent: the direct children
+    # are the rows one level deeper, back up to the previous row at its level
+    pos = next(k for k, (_, _, n) in enumerate(rows) if n == module)
+    top_indent = rows[pos][1]
+    children = []
+    for cumulative, indent, name in reversed(rows[:pos]):
+        if indent <= top_indent:
+            break
+        if indent == top_indent + 2:
+            children.append((cumulative, name))
+    return total, sorted(children, reverse=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--module", default="agents.testcase_agent")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "75")))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="show the N slowest direct imports")
+    args = parser.parse_args(argv)
+
+    samples = []
+    children = []
+    for _ in range(max(1, args.runs)):
+        total, children = measure(args.module)
+        samples.append(total / 1000)
+    median = statistics.median(samples)
+
+    print(f"import {args.module}: median {median:.1f} ms over {len(samples)} runs "
+          f"(min {min(samples):.1f}, max {max(samples):.1f}); budget {args.budget_ms:.0f} ms")
+    for cumulative, name in children[:args.top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {name}")
+
+    if median > args.budget_ms:
+        print(f"FAIL: import time exceeds budget by {median - args.budget_ms:.1f} ms")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
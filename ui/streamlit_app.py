@@ -20,30 +20,52 @@ if str(ROOT) not in sys.path:
     sys.path.append(str(ROOT))
 
 # imports
-from agents.requirement_agent import RequirementAgent
-from agents.testcase_agent import TestCaseAgent
-from agents.automation_agent import AutomationAgent
-from agents.execution_agent import ExecutionAgent
-from agents.jira_agent import JiraAgent
-from tools.figma_tool import FigmaTool
-from memory.persistent import PersistentMemory
-from agents.llm_client import LMClient
+from agents import registry as res
 from agents.conversation_agent import ConversationAgent
 from agents.clarifier_agent import ClarifierAgent
+from agents.image_batch import describe_images
+from agents.jira_agent import xray_execution_payload
+from agents.image_cache import sha256_bytes
 
 
 # UI layout settings
 st.set_page_config(page_title="AI QA Co-Pilot — Enterprise UI", layout="wide")
 st.title("AI QA Co-Pilot — Interactive Multi-Agent QA Assistant")
 
+# ------------------------------
+# SHARED RESOURCES (built once per process / config, not per rerun)
+# ------------------------------
+@st.cache_resource
+def load_resources(config_key: str):
+    return {
+        "lm": res.get_llm_client(),
+        "mem": res.get_memory(),
+        "req_agent": res.get_requirement_agent(),
+        "testcase_agent": res.get_testcase_agent(),
+        "auto_agent": res.get_automation_agent(),
+        "exec_agent": res.get_execution_agent(),
+        "jira_agent": res.get_jira_agent(),
+        "figma_tool": res.get_figma_tool(),
+        "clarifier": ClarifierAgent(),
+    }
+
+with st.sidebar:
+    if st.button("Reload configuration"):
+        load_dotenv(override=True)
+        res.registry.invalidate()
+        load_resources.clear()
+
+R = load_resources(res.config_fingerprint())
+
 # ------------------------------
 # INIT CONVERSATION MEMORY
 # ------------------------------
-mem = PersistentMemory()
+mem = R["mem"]
 
 if "conv" not in st.session_state:
-    st.session_state["conv"] = ConversationAgent(mem=mem, conv_id="main_ui_chat")
+    st.session_state["conv"] = ConversationAgent(mem=mem, conv_id="main_ui_chat", history_limit=100)
 conv = st.session_state["conv"]
+conv.mem = mem  # rebind after a config reload replaced the shared memory
 if "clar_questions" not in st.session_state:
     st.session_state["clar_questions"] = []
 if "clar_answers" not in st.session_state:
@@ -86,6 +108,10 @@ with middle:
     analyze_btn = col_a.button("Analyze Feature (Extract Context)")
     gen_tc_btn = col_b.button("Generate Test Cases")
     gen_auto_btn = col_c.button("Generate Automation")
+    fan_out = st.checkbox("Fan out test case generation (one concurrent prompt per flow/screen)",
+                          value=R["testcase_agent"].fan_out)
+    split_by_type = st.checkbox("Also split each flow/screen by test type", value=R["testcase_agent"].split_by_type,
+                                disabled=not fan_out)
     gen_gherkin_btn = st.button("Generate Gherkin Feature")
     sync_btn = st.button("Sync Pytest from Gherkin")
     run_tests_btn = st.button("Run Tests")
@@ -117,7 +143,6 @@ with middle:
 
 with right:
     st.header("Memory")
-    mem = PersistentMemory()
     fid_input = st.text_input("Load feature id", value="")
     if st.button("Load feature from memory"):
         if fid_input.strip():
@@ -135,25 +160,28 @@ with right:
     except Exception:
         st.write("No stored features yet")
 
-# Instantiate agents
-lm = LMClient()
-req_agent = RequirementAgent()
-mem = PersistentMemory()
-testcase_agent = TestCaseAgent(lm=lm, memory=mem)
-auto_agent = AutomationAgent(lm=lm)
-exec_agent = ExecutionAgent()
-jira_agent = JiraAgent()
-figma_tool = FigmaTool(token=os.getenv("FIGMA_TOKEN"))
-clarifier = ClarifierAgent()
+# Shared agents
+lm = R["lm"]
+req_agent = R["req_agent"]
+testcase_agent = R["testcase_agent"]
+auto_agent = R["auto_agent"]
+exec_agent = R["exec_agent"]
+jira_agent = R["jira_agent"]
+figma_tool = R["figma_tool"]
+clarifier = R["clarifier"]
 
 # helper functions
 def save_uploaded_images(files):
+    """Write uploads to uploads/, skipping files whose content is already on disk."""
     paths = []
     for f in files or []:
         tmp = Path("uploads") / f.name
         tmp.parent.mkdir(parents=True, exist_ok=True)
-        with open(tmp, "wb") as out:
-            out.write(f.getbuffer())
+        data = f.getbuffer()
+        if not (tmp.exists() and tmp.stat().st_size == len(data)
+                and sha256_bytes(tmp.read_bytes()) == sha256_bytes(bytes(data))):
+            with open(tmp, "wb") as out:
+                out.write(data)
         paths.append(str(tmp))
     return paths
 
@@ -163,6 +191,22 @@ def show_json_or_text(obj, area):
     else:
         area.text(str(obj))
 
+def stream_code_into(area, language):
+    """Callback for streaming LM chunks: re-renders the accumulated text in `area`."""
+    buf = []
+    def on_chunk(chunk):
+        buf.append(chunk)
+        area.code("".join(buf), language=language)
+    return on_chunk
+
+def stream_test_cases_into(area):
+    """Callback for streamed test cases: re-renders the list so far in `area`."""
+    streamed = []
+    def on_test_case(tc):
+        streamed.append(tc)
+        area.json({"test_cases": streamed, "streaming": True})
+    return on_test_case
+
 # --- Action handlers ---
 
 # Analyze Feature
@@ -243,7 +287,7 @@ if send_chat:
                 feature = req_agent.analyze(story_text) if story_text.strip() else {}
 
             image_paths = save_uploaded_images(images) if images else []
-            image_descs = [lm.describe_image(p) for p in image_paths] if image_paths else []
+            image_descs, _ = describe_images(lm, image_paths)
 
             # Generate test cases
             try:
@@ -252,6 +296,8 @@ if send_chat:
                     image_paths=image_paths,
                     image_descriptions=image_descs,
                     clarifications=clar_map,
+                    fan_out=fan_out,
+                    split_by_type=split_by_type,
                 )
                 tc_placeholder.subheader("Generated Test Cases")
                 tc_placeholder.json(tcs)
@@ -273,13 +319,11 @@ if send_chat:
 # Generate Test Cases (direct button flow)
 if gen_tc_btn:
     image_paths = save_uploaded_images(images) if images else []
-    image_descs = []
-    for p in image_paths:
-        try:
-            d = lm.describe_image(p)
-            image_descs.append(d)
-        except Exception:
-            image_descs.append(f"[desc_failed] {p}")
+    image_descs, image_report = describe_images(lm, image_paths)
+    if image_report:
+        with st.expander(f"Image analysis ({len(image_report)} images)"):
+            st.table([{"image": Path(r["path"]).name, "latency_ms": r["latency_ms"], "error": r["error"] or ""}
+                      for r in image_report])
     try:
         feature = None
         try:
@@ -287,7 +331,14 @@ if gen_tc_btn:
         except Exception:
             feature = req_agent.analyze(story_text) if story_text.strip() else {}
         tc_placeholder.subheader("Generated Test Cases")
-        tcs = testcase_agent.generate(feature=feature, image_paths=image_paths, image_descriptions=image_descs)
+        tcs = testcase_agent.generate(
+            feature=feature,
+            image_paths=image_paths,
+            image_descriptions=image_descs,
+            fan_out=fan_out,
+            split_by_type=split_by_type,
+            on_test_case=stream_test_cases_into(tc_placeholder),
+        )
         tc_placeholder.json(tcs)
         st.success("Test cases generated")
         outdir = Path("generated_tests")
@@ -310,8 +361,8 @@ if gen_auto_btn:
     else:
         tcs = json.loads(last.read_text())
         out_py = gen_dir / f"test_suite_{tcs.get('feature_id','feat_demo')}.py"
-        auto_agent.synthesize_pytests(tcs, str(out_py))
         auto_placeholder.subheader("Generated Automation")
+        auto_agent.synthesize_pytests(tcs, str(out_py), on_chunk=stream_code_into(auto_placeholder, "python"))
         auto_placeholder.code(out_py.read_text(), language="python")
         st.success(f"Automation written: {out_py}")
 
@@ -323,9 +374,21 @@ if run_tests_btn:
         exec_placeholder.warning("No automation found. Generate automation first.")
     else:
         target = files[0]
+        fid = target.stem[len("test_suite_"):]
+        tc_file = gen_dir / f"testcases_{fid}.json"
+        test_cases = json.loads(tc_file.read_text()).get("test_cases") if tc_file.exists() else None
         exec_placeholder.subheader("Execution Output")
-        code, out, err = exec_agent.run_pytest(str(target))
-        exec_placeholder.text(f"Exit: {code}\n{out}\n{err}")
+        report = exec_agent.run(str(target), feature_id=fid, test_cases=test_cases)
+        results = {k: report[k] for k in ("run_id", "feature_id", "returncode", "tests", "cases", "duration_s")}
+        (gen_dir / f"results_{fid}.json").write_text(json.dumps(results, indent=2))
+        with exec_placeholder.container():
+            st.text(f"Exit: {report['returncode']}\n{report['stdout']}\n{report['stderr']}")
+            if report["cases"]:
+                st.table([
+                    {"test": c["name"], "testcase_id": c.get("testcase_id") or "", "outcome": c["outcome"],
+                     "duration_s": round(c["duration"], 2)}
+                    for c in report["cases"]
+                ])
 
 # Publish
 if publish_btn:
@@ -336,14 +399,19 @@ if publish_btn:
     else:
         tcs = json.loads(files[0].read_text())
         issue_key = st.text_input("Jira issue key to attach to", value="STORY-101")
-        res = jira_agent.attach_testcases(issue_key, tcs)
+        attach_res = jira_agent.attach_testcases(issue_key, tcs)
         publish_placeholder.subheader("Publish Result")
-        publish_placeholder.json(res)
+        publish_placeholder.json(attach_res)
         xray_url = os.getenv("XRAY_MOCK_URL", "http://localhost:5001")
+        fid = tcs.get("feature_id", "feat_demo")
+        json_results = gen_dir / f"results_{fid}.json"
         exec_files = sorted([p for p in gen_dir.glob("results_*.txt")], key=lambda p: p.stat().st_mtime, reverse=True)
-        if exec_files:
+        if json_results.exists() or exec_files:
             try:
-                payload = {"feature_id": tcs.get("feature_id", "feat_demo"), "results": exec_files[0].read_text()}
+                if json_results.exists():
+                    payload = xray_execution_payload(fid, json.loads(json_results.read_text()))
+                else:
+                    payload = {"feature_id": fid, "results": exec_files[0].read_text()}
                 r = requests.post(f"{xray_url}/xray/executions", json=payload, timeout=3)
                 publish_placeholder.write(f"XRAY response: {r.status_code}")
             except Exception as e:
@@ -363,9 +431,13 @@ if gen_gherkin_btn:
     else:
         tcs = json.loads(last_tc.read_text())
         feature_path = gen_dir / f"{tcs.get('feature_id','feat_demo')}.feature"
-        auto_agent.synthesize_behave_feature(tcs, str(feature_path))
-        st.success(f"Gherkin feature generated: {feature_path}")
-        st.code(feature_path.read_text(), language="gherkin")
+        gherkin_area = st.empty()
+        auto_agent.synthesize_behave_feature(tcs, str(feature_path), on_chunk=stream_code_into(gherkin_area, "gherkin"))
+        report = auto_agent.last_feature_report
+        st.success(f"Gherkin feature generated: {feature_path}"
+                   + (f" ({report['kept']} scenarios unchanged, {report['generated'] + report['fallback']} regenerated)"
+                      if report else ""))
+        gherkin_area.code(feature_path.read_text(), language="gherkin")
 
 if sync_btn:
     gen_dir = Path("generated_tests")
@@ -377,6 +449,12 @@ if sync_btn:
     else:
         feature_file = feature_files[0]
         out_py = gen_dir / f"test_suite_{feature_file.stem}.py"
-        auto_agent.sync_gherkin_to_pytest(str(feature_file), str(out_py))
-        st.success(f"Pytest updated from Gherkin: {out_py}")
-        st.code(out_py.read_text(), language="python")
+        try:
+            auto_agent.sync_gherkin_to_pytest(str(feature_file), str(out_py))
+        except ValueError as e:
+            st.error(f"Could not parse {feature_file.name}: {e}")
+        else:
+            report = auto_agent.last_sync_report
+            st.success(f"Pytest updated from Gherkin: {out_py} "
+                       f"({report['scenarios']} scenarios, {report['undefined_steps']} steps without a definition)")
+            st.code(out_py.read_text(), language="python")